@@ -16,6 +16,30 @@ module "poster_api" {
   url_expires_seconds = 3600
 
   lambda_src_dir = "${path.module}/../../../lambda"
+
+  # NDJSON progress events + inline image over a streaming function URL
+  stream_endpoint_enabled = true
+
+  # tools/memory_sweep.py: init CPU (boto3 import) dominates cold starts;
+  # ~1 GB is where first-request latency flattens out before cost climbs.
+  lambda_memory_mb = 1024
+
+  # Warm pool: one pre-initialized environment during the day (US), up to 4
+  # under load; dropped to on-demand overnight.
+  provisioned_concurrency_min = 1
+  provisioned_concurrency_max = 4
+  warm_schedules = {
+    day = {
+      schedule     = "cron(0 13 * * ? *)"
+      min_capacity = 1
+      max_capacity = 4
+    }
+    night = {
+      schedule     = "cron(0 5 * * ? *)"
+      min_capacity = 0
+      max_capacity = 1
+    }
+  }
 }
 
 output "api_base_url" {
@@ -38,6 +62,10 @@ output "cognito_issuer" {
   value = module.poster_api.cognito_issuer
 }
 
+output "stream_url" {
+  value = module.poster_api.stream_url
+}
+
 output "share_cdn_url" {
   value = module.poster_api.share_cdn_url
 }
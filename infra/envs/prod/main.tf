@@ -18,6 +18,15 @@ module "poster_api" {
   lambda_src_dir = "${path.module}/../../../lambda"
 }
 
+# dev and prod share the bucket; prod alone owns its lifecycle configuration
+module "bucket_lifecycle" {
+  source = "../../modules/bucket_lifecycle"
+
+  region      = "us-east-2"
+  bucket_name = "myovieostermageenerator03"
+  envs        = ["dev", "prod"]
+}
+
 output "api_base_url" {
   value = module.poster_api.api_base_url
 }
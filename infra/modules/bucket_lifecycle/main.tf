@@ -0,0 +1,138 @@
+terraform {
+  required_version = ">= 1.5.0"
+
+  required_providers {
+    aws = {
+      source  = "hashicorp/aws"
+      version = "~> 5.0"
+    }
+  }
+}
+
+# -------------------------
+# Variables
+# -------------------------
+# A bucket has exactly one lifecycle configuration and every apply replaces
+# it, so the rules for all envs sharing the bucket live here and exactly one
+# env's root module instantiates this.
+variable "region" { type = string }
+variable "bucket_name" { type = string }
+
+variable "envs" {
+  type = list(string)
+}
+
+# Must match poster_api's export_prefix (exports/<env>/ per env)
+variable "export_prefix" {
+  type    = string
+  default = "exports/"
+}
+
+variable "export_expiration_days" {
+  type    = number
+  default = 2
+}
+
+variable "profile_expiration_days" {
+  type    = number
+  default = 14
+}
+
+variable "sweep_state_expiration_days" {
+  type    = number
+  default = 2
+}
+
+# Must match poster_api's ledger_prefix (ledger/<env>/ per env). The archives
+# are the only copy of compacted entries (snapshots keep just the totals);
+# 0 keeps them forever.
+variable "ledger_prefix" {
+  type    = string
+  default = "ledger/"
+}
+
+variable "ledger_archive_expiration_days" {
+  type    = number
+  default = 730
+}
+
+# -------------------------
+# Provider
+# -------------------------
+provider "aws" {
+  region = var.region
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "app" {
+  bucket = var.bucket_name
+
+  rule {
+    id     = "abort-incomplete-multipart"
+    status = "Enabled"
+    filter {}
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+
+  # Export archives are only reachable through their EXPORT# job row (1 day TTL)
+  dynamic "rule" {
+    for_each = toset(var.envs)
+    content {
+      id     = "expire-exports-${rule.value}"
+      status = "Enabled"
+      filter {
+        prefix = "${trimsuffix(var.export_prefix, "/")}/${rule.value}/"
+      }
+      expiration {
+        days = var.export_expiration_days
+      }
+    }
+  }
+
+  # Sampling profiler output (PROFILE_PREFIX)
+  dynamic "rule" {
+    for_each = toset(var.envs)
+    content {
+      id     = "expire-profiles-${rule.value}"
+      status = "Enabled"
+      filter {
+        prefix = "profiles/${rule.value}/"
+      }
+      expiration {
+        days = var.profile_expiration_days
+      }
+    }
+  }
+
+  # Sweeper checkpoints (SWEEP_STATE_PREFIX); a finished run deletes its own,
+  # this catches runs that died mid-way
+  dynamic "rule" {
+    for_each = toset(var.envs)
+    content {
+      id     = "expire-sweep-state-${rule.value}"
+      status = "Enabled"
+      filter {
+        prefix = "sweeper/${rule.value}/"
+      }
+      expiration {
+        days = var.sweep_state_expiration_days
+      }
+    }
+  }
+
+  # Credit ledger archives (LEDGER_ARCHIVE_PREFIX)
+  dynamic "rule" {
+    for_each = var.ledger_archive_expiration_days > 0 ? toset(var.envs) : toset([])
+    content {
+      id     = "expire-ledger-archives-${rule.value}"
+      status = "Enabled"
+      filter {
+        prefix = "${trimsuffix(var.ledger_prefix, "/")}/${rule.value}/"
+      }
+      expiration {
+        days = var.ledger_archive_expiration_days
+      }
+    }
+  }
+}
@@ -37,16 +37,107 @@ variable "api_route_path" {
 }
 
 #Add variables for credits/history
-variable "initial_credits" {
+# Daily allowance of the default ("free") plan
+variable "daily_credits" {
   type    = number
   default = 10
 }
 
+# Paid plans: Cognito group "plan-<name>" -> daily allowance
+variable "credit_plans" {
+  type    = map(number)
+  default = { pro = 100, studio = 500 }
+}
+
+# Compacted ledger entries are archived under <ledger_prefix><env>/
+variable "ledger_prefix" {
+  type    = string
+  default = "ledger/"
+}
+
+# Sampling profiler: fraction of invocations profiled to profiles/<env>/ (0 = off;
+# admins can also send "X-Profile: 1")
+variable "profile_sample_rate" {
+  type    = number
+  default = 0
+}
+
+# Folds credit ledger entries older than 30 days into snapshots
+variable "ledger_compaction_schedule" {
+  type    = string
+  default = "rate(1 day)"
+}
+
 variable "history_ttl_days" {
   type    = number
   default = 30
 }
 
+variable "export_prefix" {
+  type    = string
+  default = "exports/"
+}
+
+# Orphaned-object sweeper: scheduled inventory diff. Starts in report-only
+# mode; flip to false once the reports look right.
+variable "sweeper_dry_run" {
+  type    = bool
+  default = true
+}
+
+variable "sweeper_schedule" {
+  type    = string
+  default = "rate(1 day)"
+}
+
+# Memory also sets the CPU share (1 vCPU at 1769 MB); pick it with
+# tools/memory_sweep.py.
+variable "lambda_memory_mb" {
+  type    = number
+  default = 256
+}
+
+# Provisioned concurrency on the "live" alias that API Gateway invokes.
+# max = 0 disables it (on-demand only). Between min and max, target tracking
+# keeps utilization near the target; warm_schedules raise/lower the floor
+# ahead of known traffic (cron in UTC).
+variable "provisioned_concurrency_min" {
+  type    = number
+  default = 0
+}
+
+variable "provisioned_concurrency_max" {
+  type    = number
+  default = 0
+}
+
+variable "provisioned_concurrency_target" {
+  type    = number
+  default = 0.7
+}
+
+variable "warm_schedules" {
+  type = map(object({
+    schedule     = string
+    min_capacity = number
+    max_capacity = number
+  }))
+  default = {}
+}
+
+# Opt-in streaming endpoint for generate/edit: a second function behind a
+# function URL (RESPONSE_STREAM) running lambda/stream_server.py through the
+# Lambda Web Adapter layer. Empty layer ARN = the public x86 adapter layer.
+variable "stream_endpoint_enabled" {
+  type    = bool
+  default = false
+}
+
+variable "lambda_web_adapter_layer_arn" {
+  type    = string
+  default = ""
+}
+
 
 # -------------------------
 # Provider
@@ -60,6 +151,12 @@ locals {
   s3_prefix_for_keys    = "${local.key_prefix_normalized}/"
   public_share_prefix   = trimsuffix(var.public_share_prefix, "/")
   public_share_path     = "${local.public_share_prefix}/"
+  # The bucket is shared by every env: anything the sweeper lists or a
+  # lifecycle rule expires lives under a per-env prefix.
+  export_prefix         = "${trimsuffix(var.export_prefix, "/")}/${var.env}"
+  profile_prefix        = "profiles/${var.env}"
+  sweep_state_prefix    = "sweeper/${var.env}"
+  ledger_prefix         = "${trimsuffix(var.ledger_prefix, "/")}/${var.env}"
 }
 
 data "aws_s3_bucket" "app" {
@@ -72,9 +169,54 @@ data "aws_s3_bucket" "app" {
 data "archive_file" "lambda_zip" {
   type        = "zip"
   source_dir  = var.lambda_src_dir
+  excludes    = ["requirements.txt"]
   output_path = "${path.root}/.terraform-artifacts/lambda_${var.env}.zip"
 }
 
+# -------------------------
+# Dependencies layer (lambda/requirements.txt)
+# -------------------------
+# pip on the machine running Terraform installs Lambda-platform wheels
+# (x86_64, CPython 3.11), so no build host is needed. Rebuilt when the
+# requirements change or the build directory is missing (fresh checkout).
+locals {
+  deps_requirements = "${var.lambda_src_dir}/requirements.txt"
+  deps_layer_dir    = "${path.root}/.terraform-artifacts/deps_layer_${var.env}"
+}
+
+resource "terraform_data" "deps_layer" {
+  triggers_replace = [
+    filesha256(local.deps_requirements),
+    fileexists("${local.deps_layer_dir}/python/.built") ? "built" : timestamp(),
+  ]
+
+  provisioner "local-exec" {
+    command = <<-EOT
+      rm -rf "${local.deps_layer_dir}"
+      python3 -m pip install --quiet --platform manylinux2014_x86_64 --implementation cp \
+        --python-version 3.11 --only-binary=:all: \
+        --target "${local.deps_layer_dir}/python" -r "${local.deps_requirements}"
+      touch "${local.deps_layer_dir}/python/.built"
+    EOT
+  }
+}
+
+data "archive_file" "deps_layer_zip" {
+  type        = "zip"
+  source_dir  = local.deps_layer_dir
+  excludes    = ["python/.built"]
+  output_path = "${path.root}/.terraform-artifacts/deps_layer_${var.env}.zip"
+
+  depends_on = [terraform_data.deps_layer]
+}
+
+resource "aws_lambda_layer_version" "deps" {
+  layer_name          = "poster-image-generator-deps-${var.env}"
+  filename            = data.archive_file.deps_layer_zip.output_path
+  source_code_hash    = data.archive_file.deps_layer_zip.output_base64sha256
+  compatible_runtimes = ["python3.11"]
+}
+
 resource "aws_dynamodb_table" "app" {
   name         = "poster-app-${var.env}"
   billing_mode = "PAY_PER_REQUEST"
@@ -91,11 +233,55 @@ resource "aws_dynamodb_table" "app" {
     type = "S"
   }
 
+  # epoch-ms change stamp on GEN# rows (sparse: only those rows carry it)
+  attribute {
+    name = "u"
+    type = "N"
+  }
+
+  # Ledger compaction: live ledger entry count per balance row, on a fixed
+  # per-user shard (sparse: only CREDITS rows carry these)
+  attribute {
+    name = "ledgerShard"
+    type = "N"
+  }
+
+  attribute {
+    name = "ledgerCount"
+    type = "N"
+  }
+
+  global_secondary_index {
+    name            = "ledger-counts"
+    hash_key        = "ledgerShard"
+    range_key       = "ledgerCount"
+    projection_type = "KEYS_ONLY"
+  }
+
+  # GET /history/changes: per-user change feed ordered by stamp. It serves
+  # items from the index alone, so INCLUDE every attribute the history API
+  # returns (tools/_local_aws.py mirrors this list; tests/ checks both).
+  global_secondary_index {
+    name               = "changes"
+    hash_key           = "pk"
+    range_key          = "u"
+    projection_type    = "INCLUDE"
+    non_key_attributes = [
+      "v", "st", "p", "ar", "of", "k", "em", "ps", "featured", "deleted",
+      "status", "createdAt", "prompt", "aspect_ratio", "output_format", "s3Key", "errorMessage"
+    ]
+  }
+
   ttl {
     attribute_name = "ttl"
     enabled        = true
   }
 
+  # TTL deletes feed the orphaned-object sweeper; GEN# inserts feed the
+  # search index and preset counter writes
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+
   tags = {
     Project = "PosterImageGenerator"
     Env     = var.env
@@ -140,13 +326,73 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Action   = ["s3:PutObject", "s3:GetObject"],
         Resource = "arn:aws:s3:::${var.bucket_name}/${local.key_prefix_normalized}/*"
       },
+      # Bulk history purge + sweeper (DeleteObjects checks s3:DeleteObject per key)
+      {
+        Sid    = "S3DeleteOrphans",
+        Effect = "Allow",
+        Action = ["s3:DeleteObject"],
+        Resource = [
+          "arn:aws:s3:::${var.bucket_name}/${local.key_prefix_normalized}/*",
+          "arn:aws:s3:::${var.bucket_name}/${local.public_share_prefix}/*",
+          "arn:aws:s3:::${var.bucket_name}/${local.export_prefix}/*"
+        ]
+      },
+
+      # Sweeper inventory listing
+      {
+        Sid      = "S3ListForSweeper",
+        Effect   = "Allow",
+        Action   = ["s3:ListBucket", "s3:ListBucketMultipartUploads"],
+        Resource = "arn:aws:s3:::${var.bucket_name}"
+      },
       {
         Sid      = "S3WritePublicShare",
         Effect   = "Allow",
-        Action   = ["s3:PutObject"],
+        Action   = ["s3:PutObject", "s3:GetObject"],
         Resource = "arn:aws:s3:::${var.bucket_name}/${local.public_share_prefix}/*"
       },
 
+      # History export archives (multipart upload + presigned download)
+      {
+        Sid      = "S3HistoryExports",
+        Effect   = "Allow",
+        Action   = ["s3:PutObject", "s3:GetObject", "s3:AbortMultipartUpload"],
+        Resource = "arn:aws:s3:::${var.bucket_name}/${local.export_prefix}/*"
+      },
+
+      # Compacted credit ledger entries
+      {
+        Sid      = "S3LedgerArchive",
+        Effect   = "Allow",
+        Action   = ["s3:PutObject"],
+        Resource = "arn:aws:s3:::${var.bucket_name}/${local.ledger_prefix}/*"
+      },
+
+      # Sweeper checkpoints (filter + Scan/listing position between invocations)
+      {
+        Sid      = "S3SweepState",
+        Effect   = "Allow",
+        Action   = ["s3:PutObject", "s3:GetObject", "s3:DeleteObject"],
+        Resource = "arn:aws:s3:::${var.bucket_name}/${local.sweep_state_prefix}/*"
+      },
+
+      # Sampling profiler output
+      {
+        Sid      = "S3Profiles",
+        Effect   = "Allow",
+        Action   = ["s3:PutObject"],
+        Resource = "arn:aws:s3:::${var.bucket_name}/${local.profile_prefix}/*"
+      },
+
+      # Large exports, the search backfill and long sweeper runs are handed
+      # off to an async self-invocation
+      {
+        Sid      = "LambdaSelfInvokeExport",
+        Effect   = "Allow",
+        Action   = ["lambda:InvokeFunction"],
+        Resource = aws_lambda_function.fn.arn
+      },
+
       # CloudWatch logs
       {
         Sid      = "CloudWatchLogs",
@@ -162,7 +408,11 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "dynamodb:GetItem",
           "dynamodb:PutItem",
           "dynamodb:UpdateItem",
-          "dynamodb:Query"
+          "dynamodb:DeleteItem",
+          "dynamodb:Query",
+          "dynamodb:BatchGetItem",
+          "dynamodb:BatchWriteItem",
+          "dynamodb:Scan"
         ],
         Resource = [
           aws_dynamodb_table.app.arn,
@@ -170,6 +420,19 @@ resource "aws_iam_role_policy" "lambda_policy" {
         ]
       },
 
+      # DynamoDB Streams (TTL deletes -> sweeper)
+      {
+        Sid    = "DynamoDBStreamRead",
+        Effect = "Allow",
+        Action = [
+          "dynamodb:DescribeStream",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:ListStreams"
+        ],
+        Resource = aws_dynamodb_table.app.stream_arn
+      },
+
     ]
   })
 }
@@ -177,42 +440,271 @@ resource "aws_iam_role_policy" "lambda_policy" {
 # -------------------------
 # Lambda function
 # -------------------------
+locals {
+  # Shared by the API function and the streaming function
+  lambda_env = {
+    BUCKET_NAME         = var.bucket_name
+    KEY_PREFIX          = local.s3_prefix_for_keys
+    URL_EXPIRES_SECONDS = tostring(var.url_expires_seconds)
+    CLOUDFRONT_BASE_URL  = "https://${aws_cloudfront_distribution.share.domain_name}"
+    PUBLIC_SHARE_PREFIX  = local.public_share_path
+
+    BEDROCK_REGION = var.bedrock_region
+    S3_REGION      = var.region
+    MODEL_ID       = var.model_id
+
+    DDB_TABLE_NAME        = aws_dynamodb_table.app.name
+    HISTORY_TTL_DAYS      = tostring(var.history_ttl_days)
+    EXPORT_PREFIX         = "${local.export_prefix}/"
+    CHANGES_INDEX_NAME    = "changes"
+    DERIVED_WRITES        = "stream"
+
+    # New environment variables for daily credits and reset
+    DAILY_CREDITS         = tostring(var.daily_credits)
+    CREDITS_RESET_SECONDS = "86400"   # 86400 seconds = 24 hours
+    CREDIT_PLANS          = jsonencode(var.credit_plans)
+    LEDGER_ARCHIVE_PREFIX = "${local.ledger_prefix}/"
+    PROFILE_SAMPLE_RATE   = tostring(var.profile_sample_rate)
+    PROFILE_PREFIX        = "${local.profile_prefix}/"
+    SWEEP_STATE_PREFIX    = "${local.sweep_state_prefix}/"
+  }
+}
+
 resource "aws_lambda_function" "fn" {
   function_name = "poster-image-generator-${var.env}"
   role          = aws_iam_role.lambda_exec.arn
 
   handler = "lambda_function.lambda_handler"
   runtime = "python3.11"
+  layers  = [aws_lambda_layer_version.deps.arn]
+
+  filename         = data.archive_file.lambda_zip.output_path
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+
+  # API Gateway still cuts HTTP requests off at 30s; the longer timeout is
+  # for async history export jobs.
+  timeout     = 300
+  memory_size = var.lambda_memory_mb
+
+  # Provisioned concurrency attaches to a published version via the alias
+  publish = true
+
+  environment {
+    variables = local.lambda_env
+  }
+}
+
+# API traffic goes through the alias so it lands on provisioned (pre-initialized)
+# environments; async/background invocations keep using $LATEST.
+resource "aws_lambda_alias" "live" {
+  name             = "live"
+  function_name    = aws_lambda_function.fn.function_name
+  function_version = aws_lambda_function.fn.version
+}
+
+# -------------------------
+# Streaming endpoint (function URL, response streaming)
+# -------------------------
+# Same zip and role; the handler is run.sh, which the Web Adapter layer runs
+# as an HTTP server and streams responses from. No API Gateway in front (it
+# can't stream), so stream_server.py verifies the Cognito token itself.
+locals {
+  web_adapter_layer_arn = coalesce(
+    var.lambda_web_adapter_layer_arn,
+    "arn:aws:lambda:${var.region}:753240598075:layer:LambdaAdapterLayerX86:25"
+  )
+}
+
+resource "aws_lambda_function" "stream" {
+  count         = var.stream_endpoint_enabled ? 1 : 0
+  function_name = "poster-image-generator-stream-${var.env}"
+  role          = aws_iam_role.lambda_exec.arn
+
+  handler = "run.sh"
+  runtime = "python3.11"
+  layers  = [local.web_adapter_layer_arn, aws_lambda_layer_version.deps.arn]
 
   filename         = data.archive_file.lambda_zip.output_path
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
 
-  timeout     = 60
-  memory_size = 256
+  timeout     = 120
+  memory_size = var.lambda_memory_mb
 
   environment {
-    variables = {
-      BUCKET_NAME         = var.bucket_name
-      KEY_PREFIX          = local.s3_prefix_for_keys
-      URL_EXPIRES_SECONDS = tostring(var.url_expires_seconds)
-      CLOUDFRONT_BASE_URL  = "https://${aws_cloudfront_distribution.share.domain_name}"
-      PUBLIC_SHARE_PREFIX  = local.public_share_path
-
-      BEDROCK_REGION = var.bedrock_region
-      S3_REGION      = var.region
-      MODEL_ID       = var.model_id
-
-      DDB_TABLE_NAME        = aws_dynamodb_table.app.name
-      INITIAL_CREDITS       = tostring(var.initial_credits)
-      HISTORY_TTL_DAYS      = tostring(var.history_ttl_days)
-
-      # New environment variables for daily credits and reset
-      DAILY_CREDITS         = "10"      # You can change this value
-      CREDITS_RESET_SECONDS = "86400"   # 86400 seconds = 24 hours
+    variables = merge(local.lambda_env, {
+      AWS_LAMBDA_EXEC_WRAPPER = "/opt/bootstrap"
+      AWS_LWA_INVOKE_MODE     = "response_stream"
+      AWS_LWA_PORT            = "8080"
+      COGNITO_ISSUER          = "https://cognito-idp.${var.region}.amazonaws.com/${aws_cognito_user_pool.pool.id}"
+      COGNITO_CLIENT_ID       = aws_cognito_user_pool_client.client.id
+    })
+  }
+}
+
+resource "aws_lambda_function_url" "stream" {
+  count              = var.stream_endpoint_enabled ? 1 : 0
+  function_name      = aws_lambda_function.stream[0].function_name
+  authorization_type = "NONE"
+  invoke_mode        = "RESPONSE_STREAM"
+
+  cors {
+    allow_origins = ["http://localhost:3000"]
+    allow_methods = ["POST"]
+    allow_headers = ["content-type", "authorization"]
+    max_age       = 300
+  }
+}
+
+resource "aws_lambda_permission" "allow_stream_url" {
+  count                  = var.stream_endpoint_enabled ? 1 : 0
+  statement_id           = "AllowStreamFunctionUrl-${var.env}"
+  action                 = "lambda:InvokeFunctionUrl"
+  function_name          = aws_lambda_function.stream[0].function_name
+  principal              = "*"
+  function_url_auth_type = "NONE"
+}
+
+# -------------------------
+# Warm pool (provisioned concurrency autoscaling)
+# -------------------------
+locals {
+  warm_pool_enabled = var.provisioned_concurrency_max > 0
+}
+
+resource "aws_appautoscaling_target" "warm_pool" {
+  count              = local.warm_pool_enabled ? 1 : 0
+  service_namespace  = "lambda"
+  scalable_dimension = "lambda:function:ProvisionedConcurrency"
+  resource_id        = "function:${aws_lambda_function.fn.function_name}:${aws_lambda_alias.live.name}"
+  min_capacity       = var.provisioned_concurrency_min
+  max_capacity       = var.provisioned_concurrency_max
+}
+
+resource "aws_appautoscaling_policy" "warm_pool_utilization" {
+  count              = local.warm_pool_enabled ? 1 : 0
+  name               = "poster-warm-pool-${var.env}"
+  policy_type        = "TargetTrackingScaling"
+  service_namespace  = aws_appautoscaling_target.warm_pool[0].service_namespace
+  scalable_dimension = aws_appautoscaling_target.warm_pool[0].scalable_dimension
+  resource_id        = aws_appautoscaling_target.warm_pool[0].resource_id
+
+  target_tracking_scaling_policy_configuration {
+    target_value = var.provisioned_concurrency_target
+
+    predefined_metric_specification {
+      predefined_metric_type = "LambdaProvisionedConcurrencyUtilization"
+    }
+
+    scale_in_cooldown  = 300
+    scale_out_cooldown = 60
+  }
+}
+
+resource "aws_appautoscaling_scheduled_action" "warm_pool" {
+  for_each           = local.warm_pool_enabled ? var.warm_schedules : {}
+  name               = "poster-warm-pool-${var.env}-${each.key}"
+  service_namespace  = aws_appautoscaling_target.warm_pool[0].service_namespace
+  scalable_dimension = aws_appautoscaling_target.warm_pool[0].scalable_dimension
+  resource_id        = aws_appautoscaling_target.warm_pool[0].resource_id
+  schedule           = each.value.schedule
+
+  scalable_target_action {
+    min_capacity = each.value.min_capacity
+    max_capacity = each.value.max_capacity
+  }
+}
+
+# -------------------------
+# Orphaned-object sweeper
+# -------------------------
+# TTL deletes only (user deletes are soft and keep their objects)
+resource "aws_lambda_event_source_mapping" "ttl_deletes" {
+  event_source_arn                   = aws_dynamodb_table.app.stream_arn
+  function_name                      = aws_lambda_function.fn.arn
+  starting_position                  = "LATEST"
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 60
+  maximum_retry_attempts             = 5
+
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        eventName    = ["REMOVE"]
+        userIdentity = { type = ["Service"], principalId = ["dynamodb.amazonaws.com"] }
+      })
+    }
+  }
+}
+
+# New history rows (search index rows, preset counters) and feed rows
+# (thumbnails) are finished here instead of on the request path. The handler
+# never fails these batches.
+resource "aws_lambda_event_source_mapping" "history_inserts" {
+  event_source_arn                   = aws_dynamodb_table.app.stream_arn
+  function_name                      = aws_lambda_function.fn.arn
+  starting_position                  = "LATEST"
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 5
+  maximum_retry_attempts             = 2
+
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        eventName = ["INSERT"]
+        dynamodb  = { Keys = { sk = { S = [{ prefix = "GEN#" }] } } }
+      })
+    }
+    filter {
+      pattern = jsonencode({
+        eventName = ["INSERT"]
+        dynamodb  = { Keys = { pk = { S = [{ prefix = "FEED#" }] } } }
+      })
     }
   }
 }
 
+# Scheduled inventory diff (catches anything the stream missed)
+resource "aws_cloudwatch_event_rule" "sweeper" {
+  name                = "poster-sweeper-${var.env}"
+  schedule_expression = var.sweeper_schedule
+}
+
+resource "aws_cloudwatch_event_target" "sweeper" {
+  rule  = aws_cloudwatch_event_rule.sweeper.name
+  arn   = aws_lambda_function.fn.arn
+  input = jsonencode({ source = "poster.sweeper", dryRun = var.sweeper_dry_run })
+}
+
+resource "aws_lambda_permission" "allow_sweeper_schedule" {
+  statement_id  = "AllowSweeperSchedule-${var.env}"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.fn.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.sweeper.arn
+}
+
+# -------------------------
+# Credit ledger compaction
+# -------------------------
+resource "aws_cloudwatch_event_rule" "ledger_compaction" {
+  name                = "poster-ledger-compaction-${var.env}"
+  schedule_expression = var.ledger_compaction_schedule
+}
+
+resource "aws_cloudwatch_event_target" "ledger_compaction" {
+  rule  = aws_cloudwatch_event_rule.ledger_compaction.name
+  arn   = aws_lambda_function.fn.arn
+  input = jsonencode({ source = "poster.ledger" })
+}
+
+resource "aws_lambda_permission" "allow_ledger_compaction_schedule" {
+  statement_id  = "AllowLedgerCompactionSchedule-${var.env}"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.fn.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.ledger_compaction.arn
+}
+
 # -------------------------
 # CloudFront for public share images (OAC)
 # -------------------------
@@ -310,7 +802,7 @@ resource "aws_apigatewayv2_api" "api" {
 resource "aws_apigatewayv2_integration" "lambda" {
   api_id                 = aws_apigatewayv2_api.api.id
   integration_type       = "AWS_PROXY"
-  integration_uri        = aws_lambda_function.fn.arn
+  integration_uri        = aws_lambda_alias.live.arn
   payload_format_version = "2.0"
 }
 
@@ -421,6 +913,56 @@ resource "aws_apigatewayv2_route" "history_delete" {
   authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
 }
 
+# GET /moviePosterImageGenerator/history/changes?since=<token>  (incremental sync)
+resource "aws_apigatewayv2_route" "history_changes_get" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET ${var.api_route_path}/history/changes"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
+# GET /moviePosterImageGenerator/history/search?q=...  (prompt search)
+resource "aws_apigatewayv2_route" "history_search_get" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET ${var.api_route_path}/history/search"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
+# POST /moviePosterImageGenerator/history/export  (start ZIP export)
+resource "aws_apigatewayv2_route" "history_export_post" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "POST ${var.api_route_path}/history/export"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
+# GET /moviePosterImageGenerator/history/export?jobId=...  (poll export job)
+resource "aws_apigatewayv2_route" "history_export_get" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET ${var.api_route_path}/history/export"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
+# POST /moviePosterImageGenerator/history/bulk  (multi delete/restore)
+resource "aws_apigatewayv2_route" "history_bulk_post" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "POST ${var.api_route_path}/history/bulk"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
 # POST /moviePosterImageGenerator/history/featured  (pin)
 resource "aws_apigatewayv2_route" "history_featured_post" {
   api_id    = aws_apigatewayv2_api.api.id
@@ -431,6 +973,16 @@ resource "aws_apigatewayv2_route" "history_featured_post" {
   authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
 }
 
+# GET /moviePosterImageGenerator/presets  (prompt preset catalog)
+resource "aws_apigatewayv2_route" "presets_get" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET ${var.api_route_path}/presets"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
 # GET /moviePosterImageGenerator/featured  (optional hero-only endpoint)
 resource "aws_apigatewayv2_route" "featured_get" {
   api_id    = aws_apigatewayv2_api.api.id
@@ -460,6 +1012,46 @@ resource "aws_apigatewayv2_route" "share_get" {
   authorization_type = "NONE"
 }
 
+# GET /moviePosterImageGenerator/feed  (public gallery feed, CDN-cacheable)
+resource "aws_apigatewayv2_route" "feed_get" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET ${var.api_route_path}/feed"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  # Public endpoint by design (no JWT)
+  authorization_type = "NONE"
+}
+
+# DELETE /moviePosterImageGenerator/feed  (admin moderation)
+resource "aws_apigatewayv2_route" "feed_delete" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "DELETE ${var.api_route_path}/feed"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
+# GET /moviePosterImageGenerator/admin/stats  (admin usage analytics; group checked in Lambda)
+resource "aws_apigatewayv2_route" "admin_stats_get" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET ${var.api_route_path}/admin/stats"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
+# GET /moviePosterImageGenerator/credits/ledger  (own credit ledger)
+resource "aws_apigatewayv2_route" "credits_ledger_get" {
+  api_id    = aws_apigatewayv2_api.api.id
+  route_key = "GET ${var.api_route_path}/credits/ledger"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.jwt.id
+}
+
 resource "aws_apigatewayv2_stage" "stage" {
   api_id      = aws_apigatewayv2_api.api.id
   name        = "$default"
@@ -470,6 +1062,7 @@ resource "aws_lambda_permission" "allow_apigw" {
   statement_id  = "AllowAPIGatewayInvoke-${var.env}"
   action        = "lambda:InvokeFunction"
   function_name = aws_lambda_function.fn.function_name
+  qualifier     = aws_lambda_alias.live.name
   principal     = "apigateway.amazonaws.com"
   source_arn    = "${aws_apigatewayv2_api.api.execution_arn}/*/*"
 }
@@ -504,3 +1097,7 @@ output "cognito_issuer" {
 output "share_cdn_url" {
   value = "https://${aws_cloudfront_distribution.share.domain_name}"
 }
+
+output "stream_url" {
+  value = var.stream_endpoint_enabled ? "${trimsuffix(aws_lambda_function_url.stream[0].function_url, "/")}${var.api_route_path}" : null
+}
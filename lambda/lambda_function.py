@@ -1,15 +1,45 @@
+import io
+import itertools
 import os
+import re
 import json
 import uuid
 import base64
+import binascii
 import boto3
 import secrets
+import gzip
+import hashlib
 import time
+import random
+import sys
+import threading
+import functools
+import queue
+import urllib.request
+import zipfile
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeDeserializer
 from datetime import datetime, timezone, timedelta
 from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError
+
+try:
+    # Optional fast JSON backend (ship it in the zip/layer to enable)
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Image processing (webp/avif, re-encoding, feed thumbnails): the deps
+    # layer ships Pillow (lambda/requirements.txt); without it those are off
+    from PIL import Image
+except ImportError:
+    Image = None
+
 DAILY_CREDITS = int(os.environ.get("DAILY_CREDITS", "10"))
 
 # Regions
@@ -26,9 +56,113 @@ PUBLIC_SHARE_PREFIX = os.environ.get("PUBLIC_SHARE_PREFIX", "public-share/").str
 
 # DynamoDB (credits + history)
 DDB_TABLE_NAME = os.environ.get("DDB_TABLE_NAME", "").strip()
-INITIAL_CREDITS = int(os.environ.get("INITIAL_CREDITS", "10"))
+CREDITS_RESET_SECONDS = int(os.environ.get("CREDITS_RESET_SECONDS", "86400"))
 HISTORY_TTL_DAYS = int(os.environ.get("HISTORY_TTL_DAYS", "30"))
 
+# Credit plans: daily allowance per plan. A user's plan comes from a Cognito
+# group named PLAN_GROUP_PREFIX + plan (e.g. "plan-pro"); everyone else is free.
+CREDIT_PLANS = {"free": DAILY_CREDITS, **json.loads(os.environ.get("CREDIT_PLANS") or "{}")}
+DEFAULT_PLAN = "free"
+PLAN_GROUP_PREFIX = os.environ.get("PLAN_GROUP_PREFIX", "plan-").strip()
+
+# Credit ledger: every grant/reserve/refund/reset is an append-only
+# LEDGER#<ms>#<ref>#<kind> row written in the same transaction as the balance.
+# A scheduled job folds entries older than LEDGER_RETAIN_DAYS into
+# LEDGERSNAP# rows (raw entries archived to S3) once a user has enough.
+LEDGER_EVENT_SOURCE = "poster.ledger"
+LEDGER_RETAIN_DAYS = int(os.environ.get("LEDGER_RETAIN_DAYS", "30"))
+LEDGER_COMPACT_MIN_ENTRIES = int(os.environ.get("LEDGER_COMPACT_MIN_ENTRIES", "200"))
+# Terraform sets ledger/<env>/: the bucket is shared by every env
+LEDGER_ARCHIVE_PREFIX = os.environ.get("LEDGER_ARCHIVE_PREFIX", "ledger/").strip().rstrip("/") + "/"
+# Sparse GSI over the CREDITS rows only (ledgerShard, ledgerCount): the job
+# queries each shard for counts >= the threshold instead of scanning the
+# table. The shard is fixed per user and spreads the balance writes.
+LEDGER_INDEX_NAME = os.environ.get("LEDGER_INDEX_NAME", "ledger-counts").strip()
+LEDGER_INDEX_SHARDS = 10
+LEDGER_COMPACT_MIN_REMAINING_MS = 60_000
+
+# History change feed: GSI on (pk, u) where `u` is an epoch-ms stamp set on
+# every GEN# write (create / soft-delete / feature). Separate from `updatedAt`,
+# which the credits row stores with mixed types.
+CHANGES_INDEX_NAME = os.environ.get("CHANGES_INDEX_NAME", "changes").strip()
+CHANGES_PAGE_SIZE = int(os.environ.get("CHANGES_PAGE_SIZE", "100"))
+# Stamps come from different Lambda clocks; re-send a small overlap window.
+# Clients upsert by sk, so duplicates are harmless.
+CHANGES_SKEW_MS = int(os.environ.get("CHANGES_SKEW_MS", "2000"))
+
+# Prompt search: inverted index of normalized prompt tokens, one
+# TOKEN#<first 3 chars>#<ts>#<req_id> row per distinct prefix per SUCCESS item.
+SEARCH_INDEX_ENABLED = os.environ.get("SEARCH_INDEX_ENABLED", "1").strip() == "1"
+SEARCH_PREFIX_LEN = 3
+SEARCH_MAX_TOKENS = int(os.environ.get("SEARCH_MAX_TOKENS", "24"))
+# Upper bound on index rows read per search request (keeps latency flat)
+SEARCH_MAX_READ = int(os.environ.get("SEARCH_MAX_READ", "300"))
+# One-off backfill of index rows for GEN# items written before the index (or
+# while it was disabled): a segmented Scan that re-invokes itself with its
+# cursor until the segment is done. Idempotent, so it can be re-run.
+SEARCH_BACKFILL_EVENT_SOURCE = "poster.search-backfill"
+SEARCH_BACKFILL_MIN_REMAINING_MS = 60_000
+_SEARCH_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SEARCH_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in into is it its of on or "
+    "that the their this to was were with very ultra highly".split()
+)
+
+# Public gallery feed: FEED#<YYYY-MM-DD> partitions of opted-in shares
+FEED_PAGE_SIZE = int(os.environ.get("FEED_PAGE_SIZE", "24"))
+FEED_RETENTION_DAYS = int(os.environ.get("FEED_RETENTION_DAYS", "30"))
+FEED_MAX_DAYS_PER_PAGE = int(os.environ.get("FEED_MAX_DAYS_PER_PAGE", "14"))
+FEED_DEFAULT_PUBLISH = os.environ.get("FEED_DEFAULT_PUBLISH", "0").strip() == "1"
+FEED_THUMB_PX = int(os.environ.get("FEED_THUMB_PX", "384"))
+FEED_PROMPT_MAX_CHARS = 280
+FEED_CACHE_CONTROL = os.environ.get(
+    "FEED_CACHE_CONTROL", "public, max-age=60, s-maxage=300, stale-while-revalidate=600"
+)
+ADMIN_GROUP = os.environ.get("ADMIN_GROUP", "admin").strip()
+
+# Admin usage analytics: STATS#<YYYY-MM-DD> partitions maintained with atomic
+# ADDs derived from each new GEN# history row (TOTAL counters +
+# PROMPT#<hash> counts; see DERIVED_WRITES), bucketed by the generation's own
+# timestamp. The day's TOP row (a bounded map
+# of prompt hash -> {p, n}) is kept up to date on every successful write, so
+# reads never query PROMPT# rows.
+STATS_RETENTION_DAYS = int(os.environ.get("STATS_RETENTION_DAYS", "400"))
+STATS_MAX_DAYS = 90
+STATS_TOP_PROMPTS = 20
+STATS_PROMPT_MAX_CHARS = 200
+
+# Orphaned-object sweeper (DynamoDB Streams TTL deletes + scheduled inventory diff)
+# The bucket is shared between envs: the inventory diff only lists KEY_PREFIX
+# and EXPORT_PREFIX, which Terraform scopes per env. public-share/ is not
+# env-scoped, so only the stream path (exact keys from this table) touches it.
+SWEEPER_EVENT_SOURCE = "poster.sweeper"
+# Objects younger than this are never swept: the history row is written after
+# the upload, and exports are in flight for a while.
+SWEEP_MIN_AGE_HOURS = int(os.environ.get("SWEEP_MIN_AGE_HOURS", "24"))
+SWEEP_REPORT_SAMPLE = 20
+# Referenced keys go into a Bloom filter, so memory is fixed whatever the
+# table size (8 MB and 7 hashes: ~1% false positives at 6.7M keys; a false
+# positive only keeps an orphan). A run checkpoints the filter and its
+# Scan/listing position to SWEEP_STATE_PREFIX and hands over to a fresh
+# invocation when time runs low.
+SWEEP_FILTER_BITS = int(os.environ.get("SWEEP_FILTER_BITS", str(64 * 1024 * 1024)))
+SWEEP_FILTER_HASHES = 7
+SWEEP_STATE_PREFIX = os.environ.get("SWEEP_STATE_PREFIX", "sweeper/").strip().rstrip("/") + "/"
+SWEEP_MIN_REMAINING_MS = 60_000
+
+# Bulk history operations
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", "500"))
+BULK_MAX_WORKERS = int(os.environ.get("BULK_MAX_WORKERS", "4"))
+BULK_TX_SIZE = 100  # TransactWriteItems limit
+
+# History export (ZIP archives)
+EXPORT_PREFIX = os.environ.get("EXPORT_PREFIX", "exports/").strip().rstrip("/") + "/"
+EXPORT_SYNC_MAX_ITEMS = int(os.environ.get("EXPORT_SYNC_MAX_ITEMS", "20"))
+EXPORT_MAX_SELECTED = int(os.environ.get("EXPORT_MAX_SELECTED", "1000"))
+EXPORT_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("EXPORT_PART_SIZE", str(8 * 1024 * 1024))))
+EXPORT_JOB_TTL_DAYS = int(os.environ.get("EXPORT_JOB_TTL_DAYS", "1"))
+EXPORT_EVENT_SOURCE = "poster.export"
+
 # AWS clients
 bedrock = boto3.client("bedrock-runtime", region_name=BEDROCK_REGION)
 s3 = boto3.client("s3", region_name=S3_REGION, config=Config(signature_version="s3v4"))
@@ -36,12 +170,178 @@ s3 = boto3.client("s3", region_name=S3_REGION, config=Config(signature_version="
 ddb = boto3.resource("dynamodb", region_name=S3_REGION) if DDB_TABLE_NAME else None
 table = ddb.Table(DDB_TABLE_NAME) if ddb else None
 
+# Only needed to hand long exports off to an async invocation; created lazily
+# so it doesn't add to every cold start.
+_lambda_client = None
+
+
+def _get_lambda_client():
+    global _lambda_client
+    if _lambda_client is None:
+        _lambda_client = boto3.client("lambda", region_name=S3_REGION)
+    return _lambda_client
+
 ALLOWED_ASPECT_RATIOS = {"1:1", "16:9", "9:16", "4:3", "3:4"}
-ALLOWED_OUTPUT_FORMATS = {"png", "jpg", "jpeg"}
 
+# Output encoding. Bedrock returns png/jpg; webp/avif are re-encoded from a
+# PNG source and are only offered when Pillow has the codec.
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp", "avif": "image/avif"}
+BEDROCK_OUTPUT_FORMATS = {"png", "jpg"}
+LOSSY_FORMATS = {"jpg", "webp", "avif"}
+DEFAULT_QUALITY = {"jpg": 85, "webp": 80, "avif": 60}
+ENCODE_MIN_QUALITY = 30
+ENCODE_MIN_BYTES = 10_000
+# "auto" / Accept-negotiated tie-break, best first: webp is within ~10% of avif
+# on size at well under its encode time (tools/bench_encode.py)
+OUTPUT_FORMAT_PREFERENCE = ["webp", "avif", "jpg", "png"]
+
+
+def _pillow_formats() -> set:
+    if Image is None:
+        return set()
+    try:
+        from PIL import features
+        return {fmt for fmt in ("webp", "avif") if features.check(fmt)}
+    except Exception:
+        return set()
+
+
+ALLOWED_OUTPUT_FORMATS = {"png", "jpg", "jpeg"} | _pillow_formats()
+
+# Generation pipeline (validate -> reserve -> build -> invoke -> encode ->
+# persist -> sign -> record). Retries are per stage and only on transient AWS
+# errors; reserve is never retried (the decrement isn't idempotent).
+PIPELINE_INVOKE_RETRIES = int(os.environ.get("PIPELINE_INVOKE_RETRIES", "1"))
+PIPELINE_PERSIST_RETRIES = int(os.environ.get("PIPELINE_PERSIST_RETRIES", "2"))
+PIPELINE_RETRY_BASE_S = 0.2
+PIPELINE_LOG_TIMINGS = os.environ.get("PIPELINE_LOG_TIMINGS", "1").strip() == "1"
+# a 402 run's history error; the usage stats count it as out_of_credits
+OUT_OF_CREDITS_ERROR = "Out of credits"
+# Writes derived from a new GEN# row (search index rows, preset counter,
+# usage stats) or FEED# row (thumbnail). "stream": the table's stream
+# consumer applies them from the row alone, after the response is sent (what
+# Terraform deploys). "inline": the row's writer applies them itself (for a
+# table without the stream mapping, e.g. local tools); for generations that
+# is a background thread started once the terminal event is out.
+DERIVED_WRITES = os.environ.get("DERIVED_WRITES", "inline").strip().lower()
+_TRANSIENT_ERROR_CODES = frozenset(
+    {
+        "ThrottlingException",
+        "ServiceUnavailableException",
+        "ModelNotReadyException",
+        "InternalServerException",
+        "ServiceUnavailable",
+        "SlowDown",
+        "InternalError",
+        "RequestTimeout",
+    }
+)
+
+# Sampling profiler (opt-in): profiles PROFILE_SAMPLE_RATE of invocations
+# (0 = off, 1 = all), plus admin requests sent with "X-Profile: 1". A side
+# thread samples the handler thread's stack every PROFILE_INTERVAL_MS and the
+# collapsed stacks (flamegraph.pl / speedscope input) go to
+# PROFILE_PREFIX<route>/<day>/<request id>.collapsed. The interval doubles
+# whenever sampling costs more than PROFILE_MAX_OVERHEAD of the wall time;
+# output beyond PROFILE_MAX_BYTES is folded into one "[truncated]" line.
+# The cap covers sampling only: collapsing and uploading happen after the
+# response, from an internal extension (billed, but not client latency).
+# Outside Lambda, or if the extension can't register, they run inline before
+# the response.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_OVERHEAD = float(os.environ.get("PROFILE_MAX_OVERHEAD", "0.02"))
+PROFILE_MAX_SAMPLES = int(os.environ.get("PROFILE_MAX_SAMPLES", "10000"))
+PROFILE_MAX_BYTES = int(os.environ.get("PROFILE_MAX_BYTES", "262144"))
+PROFILE_MAX_DEPTH = 128
+PROFILE_PREFIX = os.environ.get("PROFILE_PREFIX", "profiles/").strip().rstrip("/") + "/"
+
+# Prompt presets: id -> {prompt template with "{prompt}", negative_prompt?,
+# aspect_ratio?, seed_policy: fixed|random|hash, seed?}. Loaded once per
+# container from presets.json next to this file (or PRESETS_PATH).
+PRESETS_PATH = os.environ.get(
+    "PRESETS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "presets.json")
+)
+SEED_POLICIES = {"fixed", "random", "hash"}
+SEED_MAX = 4294967294  # Stability seed range upper bound
+
+
+def _load_presets(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return {}
 
-def _public_share_key(share_id: str) -> str:
-    return f"{PUBLIC_SHARE_PREFIX}{share_id}.png"
+    presets = {}
+    for preset_id, p in raw.items():
+        template = p.get("prompt") or ""
+        if "{prompt}" not in template:
+            raise ValueError(f"Preset {preset_id!r}: prompt template must contain {{prompt}}")
+        if p.get("aspect_ratio") and p["aspect_ratio"] not in ALLOWED_ASPECT_RATIOS:
+            raise ValueError(f"Preset {preset_id!r}: invalid aspect_ratio {p['aspect_ratio']!r}")
+        policy = p.get("seed_policy") or "fixed"
+        if policy not in SEED_POLICIES:
+            raise ValueError(f"Preset {preset_id!r}: invalid seed_policy {policy!r}")
+        presets[preset_id] = {
+            "label": p.get("label") or preset_id,
+            "prompt": template,
+            "negative_prompt": p.get("negative_prompt") or "",
+            "aspect_ratio": p.get("aspect_ratio"),
+            "seed_policy": policy,
+            "seed": int(p.get("seed") or 0),
+        }
+    return presets
+
+
+PRESETS = _load_presets(PRESETS_PATH)
+
+# History items (v2 compact format)
+# Short attribute names + enum codes keep every GEN# row small, which is what
+# DynamoDB bills RCUs on. v1 rows (long names) are still readable.
+HISTORY_ITEM_VERSION = 2
+HISTORY_ERROR_MAX_CHARS = int(os.environ.get("HISTORY_ERROR_MAX_CHARS", "200"))
+STATUS_CODES = {"SUCCESS": "S", "FAILED": "F"}
+ASPECT_RATIO_CODES = {"": 0, "1:1": 1, "16:9": 2, "9:16": 3, "4:3": 4, "3:4": 5}
+OUTPUT_FORMAT_CODES = {"png": 1, "jpg": 2, "webp": 3, "avif": 4}
+# Decimal(1) hashes like 1, so DynamoDB numbers look up directly
+_STATUS_NAMES = {v: k for k, v in STATUS_CODES.items()}
+_ASPECT_RATIO_NAMES = {v: k for k, v in ASPECT_RATIO_CODES.items()}
+_OUTPUT_FORMAT_NAMES = {v: k for k, v in OUTPUT_FORMAT_CODES.items()}
+
+# Only what the history UI renders (both formats). `deleted` is only used in
+# the FilterExpression, so it doesn't need to come back.
+HISTORY_PROJECTION = {
+    "#pk": "pk",
+    "#sk": "sk",
+    "#v": "v",
+    "#st": "st",
+    "#p": "p",
+    "#ar": "ar",
+    "#of": "of",
+    "#k": "k",
+    "#em": "em",
+    "#ps": "ps",
+    "#ft": "featured",
+    # v1 names
+    "#status": "status",
+    "#createdAt": "createdAt",
+    "#prompt": "prompt",
+    "#aspect_ratio": "aspect_ratio",
+    "#output_format": "output_format",
+    "#s3Key": "s3Key",
+    "#errorMessage": "errorMessage",
+}
+
+
+def _public_share_key(share_id: str, ext: str = "png") -> str:
+    return f"{PUBLIC_SHARE_PREFIX}{share_id}.{ext}"
+
+
+def _format_from_key(key: str) -> str:
+    ext = key.rsplit(".", 1)[-1].lower() if "." in key else ""
+    ext = "jpg" if ext == "jpeg" else ext
+    return ext if ext in CONTENT_TYPES else "png"
 
 
 def _headers():
@@ -53,23 +353,42 @@ def _headers():
     }
 
 
-def _json_safe(obj):
+def _json_default(obj):
+    # Only called for values the encoder can't handle itself, so DynamoDB
+    # Decimals are converted in place instead of copying the whole payload.
     if isinstance(obj, Decimal):
         if obj % 1 == 0:
             return int(obj)
         return float(obj)
-    if isinstance(obj, dict):
-        return {k: _json_safe(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_json_safe(v) for v in obj]
-    return obj
+    if isinstance(obj, set):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default).decode("utf-8")
+    return json.dumps(obj, default=_json_default)
+
 
+def _canonical_json(obj) -> bytes:
+    # sorted keys, bytes straight to botocore (no str round trip)
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, default=_json_default, sort_keys=True).encode("utf-8")
 
-def _resp(code: int, payload: dict):
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _resp(code: int, payload: dict, headers: dict | None = None):
     return {
         "statusCode": code,
-        "headers": _headers(),
-        "body": json.dumps(_json_safe(payload)),
+        "headers": {**_headers(), **headers} if headers else _headers(),
+        "body": _dumps(payload),
     }
 
 
@@ -81,10 +400,14 @@ def _json_body(event: dict) -> dict:
     body = event.get("body")
     if not body:
         return {}
-    if event.get("isBase64Encoded"):
-        body = base64.b64decode(body).decode("utf-8")
     try:
-        return json.loads(body)
+        if event.get("isBase64Encoded"):
+            # a2b_base64 reads the ASCII str in place (b64decode copies it to
+            # bytes first). Stdlib json on purpose: on a fresh multi-MB body
+            # orjson's parse buffers cost ~1000 page faults, which is more
+            # than it saves here (tools/bench_json.py).
+            return json.loads(binascii.a2b_base64(body))
+        return _loads(body)
     except Exception:
         return {}
 
@@ -100,6 +423,18 @@ def _user_sub(event: dict) -> str | None:
     return claims.get("sub")
 
 
+def _user_groups(event: dict) -> set:
+    # HTTP API flattens list claims to "[admin editors]"
+    raw = get_claims(event).get("cognito:groups") or ""
+    if isinstance(raw, list):
+        return set(raw)
+    return {g for g in raw.strip("[]").replace(",", " ").split() if g}
+
+
+def _is_admin(event: dict) -> bool:
+    return ADMIN_GROUP in _user_groups(event)
+
+
 def _pk(sub: str) -> str:
     return f"USER#{sub}"
 
@@ -112,6 +447,105 @@ def _history_sk(ts_iso: str, req_id: str) -> str:
     return f"GEN#{ts_iso}#{req_id}"
 
 
+def _created_at_from_sk(sk: str) -> str | None:
+    # GEN#<ts_iso>#<req_id>
+    parts = (sk or "").split("#")
+    if len(parts) >= 3 and parts[0] == "GEN":
+        return "#".join(parts[1:-1])
+    return None
+
+
+def _encode_history_item(
+    sub: str,
+    ts_iso: str,
+    req_id: str,
+    prompt: str,
+    aspect_ratio: str,
+    output_format: str,
+    status: str,
+    s3_key: str | None = None,
+    error_message: str | None = None,
+    preset_id: str | None = None,
+) -> dict:
+    """
+    Build a v2 (compact) history row.
+    createdAt is not stored: it's already the middle of the sk.
+    prompt is what the user typed; a preset is kept by id (ps), not expanded.
+    """
+    item = {
+        "pk": _pk(sub),
+        "sk": _history_sk(ts_iso, req_id),
+        "v": HISTORY_ITEM_VERSION,
+        "st": STATUS_CODES.get(status, status),
+        "p": prompt,
+        "u": _now_ms(),
+    }
+    ar = ASPECT_RATIO_CODES.get(aspect_ratio or "")
+    item["ar"] = ar if ar is not None else aspect_ratio
+    of = OUTPUT_FORMAT_CODES.get(output_format)
+    item["of"] = of if of is not None else output_format
+    if s3_key:
+        item["k"] = s3_key
+    if error_message:
+        # str(e) can carry a whole Bedrock response; the UI only shows a line.
+        if len(error_message) > HISTORY_ERROR_MAX_CHARS:
+            error_message = error_message[: HISTORY_ERROR_MAX_CHARS - 3] + "..."
+        item["em"] = error_message
+    if preset_id:
+        item["ps"] = preset_id
+    return item
+
+
+def _decode_history_item(item: dict | None) -> dict | None:
+    """
+    Normalize a history row (v1 or v2) to the public shape the API returns:
+    pk, sk, status, createdAt, prompt, aspect_ratio, output_format, s3Key,
+    errorMessage, preset, featured, deleted.
+    """
+    if not item:
+        return item
+    if "v" not in item:
+        return item  # v1: already uses the public names
+
+    out = {
+        "pk": item.get("pk"),
+        "sk": item.get("sk"),
+        "status": _STATUS_NAMES.get(item.get("st"), item.get("st")),
+        "createdAt": _created_at_from_sk(item.get("sk")),
+        "prompt": item.get("p"),
+        "aspect_ratio": _ASPECT_RATIO_NAMES.get(item.get("ar"), item.get("ar")),
+        "output_format": _OUTPUT_FORMAT_NAMES.get(item.get("of"), item.get("of")),
+    }
+    if item.get("k"):
+        out["s3Key"] = item["k"]
+    if item.get("em"):
+        out["errorMessage"] = item["em"]
+    if item.get("ps"):
+        out["preset"] = item["ps"]
+    for name in ("featured", "deleted", "ttl"):
+        if name in item:
+            out[name] = item[name]
+    return out
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _encode_cursor(obj: dict) -> str:
+    return base64.urlsafe_b64encode(_dumps(obj).encode("utf-8")).decode("utf-8").rstrip("=")
+
+
+def _decode_cursor(token: str | None) -> dict | None:
+    if not token:
+        return None
+    try:
+        obj = json.loads(base64.urlsafe_b64decode(token + "==").decode("utf-8"))
+    except Exception:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
 def _ttl_epoch(days: int) -> int:
     dt = datetime.now(timezone.utc) + timedelta(days=days)
     return int(dt.timestamp())
@@ -152,136 +586,160 @@ def get_history_item_by_sk(sub: str, target_sk: str):
     resp = table.get_item(
         Key={"pk": _pk(sub), "sk": target_sk}
     )
-    return resp.get("Item")
+    return _decode_history_item(resp.get("Item"))
 
-def get_credits(sub: str) -> int:
-    """
-    Read credits without modifying them.
-    If credits item doesn't exist yet, return INITIAL_CREDITS to match lazy-init behavior.
-    If the reset time has passed, refill credits.
-    """
-    if not table:
-        return 0
+def _plan_for(event: dict) -> str:
+    """Plan from Cognito groups named PLAN_GROUP_PREFIX + plan; best one wins."""
+    plans = [
+        g[len(PLAN_GROUP_PREFIX):]
+        for g in _user_groups(event)
+        if g.startswith(PLAN_GROUP_PREFIX) and g[len(PLAN_GROUP_PREFIX):] in CREDIT_PLANS
+    ]
+    return max(plans, key=CREDIT_PLANS.get) if plans else DEFAULT_PLAN
 
-    resp = table.get_item(Key=_credits_key(sub))
-    item = resp.get("Item") or {}
 
-    credits = item.get("credits")
-    reset_at = item.get("resetAt")  # Retrieve resetAt from DynamoDB
+def _ledger_entry(sub: str, kind: str, delta: int, ref: str) -> dict:
+    # LEDGER#<epoch ms>#<ref>#<kind>: append-only, ordered by time
+    item = {
+        "pk": _pk(sub),
+        "sk": f"LEDGER#{_now_ms():013d}#{ref}#{kind}",
+        "kind": kind,
+        "delta": delta,
+        "ref": ref,
+        "at": int(time.time()),
+    }
+    return {"Put": {"TableName": DDB_TABLE_NAME, "Item": item, "ConditionExpression": "attribute_not_exists(sk)"}}
 
-    # Lazy init if item is not found
-    if credits is None:
-        return int(INITIAL_CREDITS)
 
-    now = int(time.time())  # Current timestamp
+def _ledger_shard(sub: str) -> int:
+    return int(hashlib.sha1(sub.encode("utf-8")).hexdigest()[:8], 16) % LEDGER_INDEX_SHARDS
 
-    # If resetAt is passed, refill the credits to the initial amount
-    if reset_at and now >= int(reset_at):
-        new_reset_at = now + 86400  # Set next resetAt time (24 hours from now)
-        try:
-            table.update_item(
-                Key=_credits_key(sub),
-                UpdateExpression="SET credits = :c, resetAt = :r, updatedAt = :u",
-                ExpressionAttributeValues={
-                    ":c": DAILY_CREDITS,   # Use DAILY_CREDITS here (10, for example)
-                    ":r": new_reset_at,
-                    ":u": now,
-                },
-                ConditionExpression="attribute_exists(pk) AND attribute_exists(sk)",
-            )
-        except ClientError:
-            pass  # If update fails, just return existing credits
 
-    return int(credits)
+def _credit_transact(sub: str, update: str, values: dict, condition: str, entries: list):
+    """Balance update (a SET clause) + its ledger entries, all or nothing."""
+    # the resource's client (de)serializes plain Python values, like Table does
+    balance = {
+        "TableName": DDB_TABLE_NAME,
+        "Key": _credits_key(sub),
+        "UpdateExpression": f"{update}, ledgerShard = if_not_exists(ledgerShard, :shard) ADD ledgerCount :entries",
+        "ConditionExpression": condition,
+        "ExpressionAttributeValues": {**values, ":entries": len(entries), ":shard": _ledger_shard(sub)},
+    }
+    if "#plan" in update:
+        balance["ExpressionAttributeNames"] = {"#plan": "plan"}
+    ddb.meta.client.transact_write_items(TransactItems=[{"Update": balance}, *entries])
+
 
+def _is_txn_conflict(e: ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") == "TransactionCanceledException"
 
-DAILY_CREDITS = int(os.environ.get("DAILY_CREDITS", "10"))  # Default to 10 if not set
 
-def reserve_credit_or_fail(sub: str) -> int:
+def get_credits(sub: str, plan: str = DEFAULT_PLAN) -> int:
     """
-    Atomically:
-      - initializes credits if missing (DAILY_CREDITS)
-      - decrements by 1
-      - blocks if credits == 0
-      - checks if credits need to be reset
-    Returns remaining credits AFTER decrement.
+    Read credits. A missing balance reads as the plan's allowance (it is
+    created on first reserve). If the reset time has passed, refill to the
+    plan's allowance and record the reset in the ledger.
     """
     if not table:
-        return -1
+        return 0
 
-    try:
-        # Fetch credits and check if reset is needed
-        resp = table.get_item(Key=_credits_key(sub))
-        item = resp.get("Item")
-        
-        # If no item exists, initialize with DAILY_CREDITS and set resetAt to 24 hours from now
-        if not item:
-            table.put_item(
-                Item={
-                    "pk": _pk(sub),
-                    "sk": "CREDITS",
-                    "credits": DAILY_CREDITS,  # Use DAILY_CREDITS for new users
-                    "resetAt": int(time.time()) + 86400,  # Set reset time for 24 hours from now
-                    "updatedAt": int(time.time())
-                }
-            )
-            return DAILY_CREDITS  # Return DAILY_CREDITS for the first time
+    item = table.get_item(Key=_credits_key(sub)).get("Item")
+    if not item or item.get("credits") is None:
+        return CREDIT_PLANS[plan]
 
-        credits = int(item.get("credits", DAILY_CREDITS))  # Default to DAILY_CREDITS if missing
+    credits = int(item["credits"])
+    reset_at = int(item.get("resetAt") or 0)
+    now = int(time.time())
+    if reset_at and now >= reset_at:
+        allowance = CREDIT_PLANS[plan]
+        try:
+            _credit_transact(
+                sub,
+                "SET credits = :c, resetAt = :r, updatedAt = :u, #plan = :p",
+                {":c": allowance, ":r": now + CREDITS_RESET_SECONDS, ":u": now, ":p": plan, ":old": reset_at},
+                "resetAt = :old",
+                [_ledger_entry(sub, "reset", allowance - credits, uuid.uuid4().hex)],
+            )
+            credits = allowance
+        except ClientError:
+            pass  # someone else reset it; return what we read
 
-        # Fetch 'resetAt' value, and default to 0 if missing
-        reset_at = item.get("resetAt", 0)
+    return credits
 
-        # If resetAt is missing or reset, refill credits to DAILY_CREDITS
-        now = int(time.time())  # Current timestamp
 
-        # If resetAt has passed, refill the credits to DAILY_CREDITS
-        if now >= int(reset_at):
-            new_reset_at = now + 86400  # Set next resetAt time (24 hours from now)
-            table.update_item(
-                Key=_credits_key(sub),
-                UpdateExpression="SET credits = :c, resetAt = :r, updatedAt = :u",
-                ExpressionAttributeValues={
-                    ":c": DAILY_CREDITS,  # Use DAILY_CREDITS
-                    ":r": new_reset_at,
-                    ":u": now,
-                },
-                ConditionExpression="attribute_exists(pk) AND attribute_exists(sk)",
-            )
-            credits = DAILY_CREDITS  # Reset credits to DAILY_CREDITS
+def reserve_credit_or_fail(sub: str, req_id: str | None = None, plan: str = DEFAULT_PLAN) -> int:
+    """
+    Take 1 credit, writing the balance and its LEDGER# entries in one
+    transaction:
+      - no balance yet: grant the plan allowance, then reserve
+      - reset time passed: refill to the plan allowance, then reserve
+      - otherwise: decrement, conditional on credits >= 1
+    Raises ValueError("OUT_OF_CREDITS"). Returns remaining credits AFTER
+    decrement (-1 when credits aren't configured).
+    """
+    if not table:
+        return -1
 
-        # Decrement credits if greater than 0
-        if credits > 0:
-            updated_credits = credits - 1
-            table.update_item(
-                Key=_credits_key(sub),
-                UpdateExpression="SET credits = :c, updatedAt = :u",
-                ExpressionAttributeValues={
-                    ":c": updated_credits,
-                    ":u": now,
-                },
-                ConditionExpression="attribute_exists(pk) AND attribute_exists(sk)",
+    ref = req_id or uuid.uuid4().hex
+    for attempt in range(3):
+        item = table.get_item(Key=_credits_key(sub), ConsistentRead=True).get("Item")
+        now = int(time.time())
+        try:
+            if not item:
+                allowance = CREDIT_PLANS[plan]
+                if allowance < 1:
+                    raise ValueError("OUT_OF_CREDITS")
+                _credit_transact(
+                    sub,
+                    "SET credits = :c, resetAt = :r, updatedAt = :u, #plan = :p",
+                    {":c": allowance - 1, ":r": now + CREDITS_RESET_SECONDS, ":u": now, ":p": plan},
+                    "attribute_not_exists(pk)",
+                    [_ledger_entry(sub, "grant", allowance, ref), _ledger_entry(sub, "reserve", -1, ref)],
+                )
+                return allowance - 1
+
+            credits = int(item.get("credits", 0))
+            reset_at = int(item.get("resetAt") or 0)
+            if now >= reset_at:
+                allowance = CREDIT_PLANS[plan]
+                if allowance < 1:
+                    raise ValueError("OUT_OF_CREDITS")
+                _credit_transact(
+                    sub,
+                    "SET credits = :c, resetAt = :r, updatedAt = :u, #plan = :p",
+                    {":c": allowance - 1, ":r": now + CREDITS_RESET_SECONDS, ":u": now, ":p": plan, ":old": reset_at},
+                    "resetAt = :old OR attribute_not_exists(resetAt)",
+                    [_ledger_entry(sub, "reset", allowance - credits, ref), _ledger_entry(sub, "reserve", -1, ref)],
+                )
+                return allowance - 1
+
+            if credits < 1:
+                raise ValueError("OUT_OF_CREDITS")
+            _credit_transact(
+                sub,
+                "SET credits = credits - :one, updatedAt = :u",
+                {":one": 1, ":u": now},
+                "credits >= :one",
+                [_ledger_entry(sub, "reserve", -1, ref)],
             )
-            return updated_credits  # Return remaining credits after decrement
-        else:
-            raise ValueError("OUT_OF_CREDITS")
-    except ClientError as e:
-        print(f"Error during DynamoDB operation: {e}")
-        raise
+            return credits - 1
+        except ClientError as e:
+            # lost a race (concurrent reserve/reset): re-read and retry
+            if not _is_txn_conflict(e) or attempt == 2:
+                print(f"Error during DynamoDB operation: {e}")
+                raise
 
 
-def refund_credit_best_effort(sub: str):
+def refund_credit_best_effort(sub: str, req_id: str | None = None):
     if not table:
         return
     try:
-        table.update_item(
-            Key=_credits_key(sub),
-            UpdateExpression="SET credits = credits + :one, updatedAt = :now",
-            ExpressionAttributeValues={
-                ":one": 1,
-                ":now": datetime.now(timezone.utc).isoformat(),
-            },
-            ConditionExpression="attribute_exists(credits)",
+        _credit_transact(
+            sub,
+            "SET credits = credits + :one, updatedAt = :now",
+            {":one": 1, ":now": int(time.time())},
+            "attribute_exists(credits)",
+            [_ledger_entry(sub, "refund", 1, req_id or uuid.uuid4().hex)],
         )
     except Exception:
         return
@@ -297,45 +755,254 @@ def write_history_best_effort(
     status: str,
     s3_key: str | None = None,
     error_message: str | None = None,
-):
+    preset_id: str | None = None,
+) -> dict | None:
+    """Put a GEN# row; returns it, or None if it wasn't written."""
     if not table:
-        return
+        return None
 
-    item = {
-        "pk": _pk(sub),
-        "sk": _history_sk(ts_iso, req_id),
-        "createdAt": ts_iso,
-        "status": status,
-        "prompt": prompt,
-        "aspect_ratio": aspect_ratio,
-        "output_format": output_format,
-    }
-    if s3_key:
-        item["s3Key"] = s3_key
-    if error_message:
-        item["errorMessage"] = error_message
+    item = _encode_history_item(
+        sub=sub,
+        ts_iso=ts_iso,
+        req_id=req_id,
+        prompt=prompt,
+        aspect_ratio=aspect_ratio,
+        output_format=output_format,
+        status=status,
+        s3_key=s3_key,
+        error_message=error_message,
+        preset_id=preset_id,
+    )
 
     if HISTORY_TTL_DAYS > 0:
         item["ttl"] = _ttl_epoch(HISTORY_TTL_DAYS)
 
     try:
         table.put_item(Item=item)
+    except Exception:
+        return None
+    return item
+
+
+def apply_derived_writes(item: dict):
+    """
+    Usage stats, search index rows and preset counter for a new GEN# row
+    (all best effort). Everything comes from the row itself.
+    """
+    ok = item.get("st") == STATUS_CODES["SUCCESS"]
+    if ok:
+        outcome = "ok"
+    elif item.get("em") == OUT_OF_CREDITS_ERROR:
+        outcome = "out_of_credits"
+    else:
+        outcome = "failed"
+    # only edits have no aspect ratio; a written row means credits are on,
+    # so every success spent one
+    kind = "generate" if _ASPECT_RATIO_NAMES.get(item.get("ar"), item.get("ar")) else "edit"
+    record_usage_best_effort(
+        kind, outcome, prompt=item.get("p") or "", credits=1 if ok else 0, ts_iso=_created_at_from_sk(item["sk"])
+    )
+
+    if not ok:
+        return
+    if SEARCH_INDEX_ENABLED:
+        write_search_index_best_effort(item["pk"][len("USER#"):], item["sk"], item.get("p") or "", item.get("ttl"))
+    if item.get("ps"):
+        count_preset_usage_best_effort(item["ps"])
+
+
+def _search_tokens(text: str) -> list:
+    """lowercase, strip accents, split on non-alphanumerics, drop stopwords/short tokens, dedupe"""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    out = []
+    for tok in _SEARCH_TOKEN_RE.findall(text):
+        if len(tok) < SEARCH_PREFIX_LEN or tok in _SEARCH_STOPWORDS or tok in out:
+            continue
+        out.append(tok)
+        if len(out) >= SEARCH_MAX_TOKENS:
+            break
+    return out
+
+
+def _search_sk(prefix: str, gen_sk: str) -> str:
+    # GEN#<ts>#<req_id> -> TOKEN#<prefix>#<ts>#<req_id>: newest-first within a prefix
+    return f"TOKEN#{prefix}#{gen_sk[len('GEN#'):]}"
+
+
+def _gen_sk_from_search_sk(search_sk: str) -> str:
+    return "GEN#" + search_sk.split("#", 2)[2]
+
+
+def _search_index_rows(sub: str, gen_sk: str, prompt: str, ttl: int | None = None) -> list:
+    tokens = _search_tokens(prompt)
+    joined = " ".join(tokens)
+    rows = []
+    for prefix in sorted({t[:SEARCH_PREFIX_LEN] for t in tokens}):
+        row = {"pk": _pk(sub), "sk": _search_sk(prefix, gen_sk), "t": joined}
+        if ttl:
+            row["ttl"] = ttl
+        rows.append(row)
+    return rows
+
+
+def write_search_index_best_effort(sub: str, gen_sk: str, prompt: str, ttl: int | None = None):
+    rows = _search_index_rows(sub, gen_sk, prompt, ttl)
+    if not table or not rows:
+        return
+
+    try:
+        with table.batch_writer() as bw:
+            for row in rows:
+                bw.put_item(Item=row)
     except Exception:
         return
 
 
+def run_search_backfill(event: dict, context=None):
+    """
+    Async entry point: {"source": SEARCH_BACKFILL_EVENT_SOURCE, "totalSegments"?: n}
+    fans out one invocation per Scan segment; each then pages through its
+    segment ({"segment", "totalSegments", "cursor"?}), writing TOKEN# rows for
+    SUCCESS items (v1 and v2), and hands its cursor to a fresh invocation when
+    the remaining time runs low. Deleted items are indexed too; search drops
+    them at read time, same as for live writes.
+    """
+    if not table:
+        return {"ok": False}
+
+    function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    total = max(1, int(event.get("totalSegments") or 1))
+
+    def _continue(payload):
+        _get_lambda_client().invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=_dumps({"source": SEARCH_BACKFILL_EVENT_SOURCE, "totalSegments": total, **payload}).encode("utf-8"),
+        )
+
+    if "segment" not in event:
+        if total > 1 and function_name:
+            for segment in range(total):
+                _continue({"segment": segment})
+            return {"ok": True, "segments": total}
+        event = {**event, "segment": 0, "totalSegments": 1}
+
+    params = {
+        "Segment": int(event["segment"]),
+        "TotalSegments": total,
+        "FilterExpression": "begins_with(sk, :gen)",
+        "ExpressionAttributeValues": {":gen": "GEN#"},
+    }
+    eks = _decode_cursor(event.get("cursor"))
+    scanned = indexed = 0
+    while True:
+        if eks:
+            params["ExclusiveStartKey"] = eks
+        resp = table.scan(**params)
+        scanned += resp.get("ScannedCount", 0)
+        with table.batch_writer(overwrite_by_pkeys=["pk", "sk"]) as bw:
+            for row in resp.get("Items", []) or []:
+                it = _decode_history_item(row)
+                if it.get("status") != "SUCCESS":
+                    continue
+                for index_row in _search_index_rows(it["pk"][len("USER#"):], it["sk"], it.get("prompt") or "", row.get("ttl")):
+                    bw.put_item(Item=index_row)
+                indexed += 1
+        eks = resp.get("LastEvaluatedKey")
+        if not eks:
+            break
+        remaining = context.get_remaining_time_in_millis() if context else None
+        if remaining is not None and remaining < SEARCH_BACKFILL_MIN_REMAINING_MS and function_name:
+            _continue({"segment": params["Segment"], "cursor": _encode_cursor(eks)})
+            break
+
+    print(_dumps({"searchBackfill": {"segment": params["Segment"], "scanned": scanned, "indexed": indexed, "done": not eks}}))
+    return {"ok": True, "scanned": scanned, "indexed": indexed, "done": not eks}
+
+
+def search_history(sub: str, q: str, limit: int = 20, cursor: str | None = None):
+    """
+    Prompt search over this user's SUCCESS items, newest first.
+    Every query term must match (as a prefix) some token of the prompt.
+
+    Reads one TOKEN#<prefix> range (the longest term's), so the cost is
+    bounded by SEARCH_MAX_READ index rows, not by history size.
+    """
+    terms = _search_tokens(q)
+    if not terms:
+        raise ValueError(f"Query needs at least one word of {SEARCH_PREFIX_LEN}+ characters")
+    if not table:
+        return {"items": [], "nextCursor": None}
+
+    limit = max(1, min(limit, 50))
+    pk = _pk(sub)
+    driver = max(terms, key=len)
+    eks = _decode_cursor(cursor)
+
+    matched = []
+    read = 0
+    next_eks = None
+    while len(matched) < limit and read < SEARCH_MAX_READ:
+        params = {
+            "KeyConditionExpression": Key("pk").eq(pk) & Key("sk").begins_with(f"TOKEN#{driver[:SEARCH_PREFIX_LEN]}#"),
+            "ScanIndexForward": False,
+            "Limit": min(100, SEARCH_MAX_READ - read),
+        }
+        if eks:
+            params["ExclusiveStartKey"] = eks
+        resp = table.query(**params)
+        rows = resp.get("Items", []) or []
+        lek = resp.get("LastEvaluatedKey")
+
+        for i, row in enumerate(rows):
+            read += 1
+            tokens = (row.get("t") or "").split()
+            if all(any(tok.startswith(term) for tok in tokens) for term in terms):
+                matched.append(_gen_sk_from_search_sk(row["sk"]))
+            if len(matched) >= limit:
+                # stop mid-page; resume right after this row
+                if i < len(rows) - 1 or lek:
+                    next_eks = {"pk": pk, "sk": row["sk"]}
+                break
+        else:
+            next_eks = lek
+        if not lek or len(matched) >= limit:
+            break
+        eks = lek
+
+    items = []
+    if matched:
+        names = dict(HISTORY_PROJECTION, **{"#deleted": "deleted"})
+        rows = _batch_get_history(sub, matched, ", ".join(names.keys()), names)
+        by_sk = {r["sk"]: _decode_history_item(r) for r in rows}
+        for sk in matched:
+            it = by_sk.get(sk)
+            if not it or it.get("deleted") is True:
+                continue  # soft-deleted or TTL-expired: index rows are left to expire
+            it.pop("deleted", None)
+            key = it.get("s3Key")
+            if key:
+                it["presigned_url"] = s3.generate_presigned_url(
+                    ClientMethod="get_object",
+                    Params={"Bucket": BUCKET_NAME, "Key": key},
+                    ExpiresIn=URL_EXPIRES_SECONDS,
+                    HttpMethod="GET",
+                )
+            items.append(it)
+
+    return {"items": items, "nextCursor": _encode_cursor(next_eks) if next_eks else None}
+
+
 def get_history(sub: str, limit: int = 20, cursor: str | None = None):
     if not table:
         return {"items": [], "nextCursor": None}
 
     limit = max(1, min(limit, 50))
 
-    eks = None
-    if cursor:
-        try:
-            eks = json.loads(base64.urlsafe_b64decode(cursor + "==").decode("utf-8"))
-        except Exception:
-            eks = None
+    eks = _decode_cursor(cursor)
+    # First page also hands out the starting point for /history/changes
+    sync_token = None if cursor else _encode_cursor({"since": _now_ms()})
 
     params = {
         "KeyConditionExpression": "pk = :pk AND begins_with(sk, :gen)",
@@ -345,6 +1012,8 @@ def get_history(sub: str, limit: int = 20, cursor: str | None = None):
             ":false": False,
         },
         "FilterExpression": "attribute_not_exists(deleted) OR deleted = :false",
+        "ProjectionExpression": ", ".join(HISTORY_PROJECTION.keys()),
+        "ExpressionAttributeNames": HISTORY_PROJECTION,
         "Limit": limit,
         "ScanIndexForward": False,
     }
@@ -352,7 +1021,7 @@ def get_history(sub: str, limit: int = 20, cursor: str | None = None):
         params["ExclusiveStartKey"] = eks
 
     resp = table.query(**params)
-    items = resp.get("Items", [])
+    items = [_decode_history_item(it) for it in resp.get("Items", [])]
 
     for it in items:
         key = it.get("s3Key")
@@ -365,15 +1034,70 @@ def get_history(sub: str, limit: int = 20, cursor: str | None = None):
             )
 
     lek = resp.get("LastEvaluatedKey")
-    next_cursor = None
+    next_cursor = _encode_cursor(lek) if lek else None
+
+    out = {"items": items, "nextCursor": next_cursor}
+    if sync_token:
+        out["syncToken"] = sync_token
+    return out
+
+
+def get_history_changes(sub: str, since_token: str | None):
+    """
+    Items created, soft-deleted or (un)featured since `since_token`
+    (from get_history's syncToken or a previous call's nextToken).
+
+    Returns {items, nextToken, hasMore}. Deleted rows come back as
+    {sk, deleted: true} only; others in the get_history shape.
+    """
+    if not table:
+        return {"items": [], "nextToken": since_token, "hasMore": False}
+
+    state = _decode_cursor(since_token)
+    if not state or "since" not in state:
+        raise ValueError("Invalid or missing 'since' token")
+
+    since = int(state["since"])
+    high = int(state.get("high") or since)  # max stamp seen across pages
+
+    params = {
+        "IndexName": CHANGES_INDEX_NAME,
+        "KeyConditionExpression": Key("pk").eq(_pk(sub)) & Key("u").gt(since - CHANGES_SKEW_MS),
+        "Limit": CHANGES_PAGE_SIZE,
+        "ScanIndexForward": True,
+    }
+    if state.get("eks"):
+        params["ExclusiveStartKey"] = state["eks"]
+
+    resp = table.query(**params)
+
+    items = []
+    for raw in resp.get("Items", []) or []:
+        high = max(high, int(raw.get("u") or 0))
+        it = _decode_history_item(raw)
+        if it.get("deleted") is True:
+            items.append({"sk": it.get("sk"), "deleted": True})
+            continue
+        it.pop("ttl", None)
+        it.pop("u", None)
+        key = it.get("s3Key")
+        if key:
+            it["presigned_url"] = s3.generate_presigned_url(
+                ClientMethod="get_object",
+                Params={"Bucket": BUCKET_NAME, "Key": key},
+                ExpiresIn=URL_EXPIRES_SECONDS,
+                HttpMethod="GET",
+            )
+        items.append(it)
+
+    lek = resp.get("LastEvaluatedKey")
     if lek:
-        next_cursor = (
-            base64.urlsafe_b64encode(json.dumps(lek).encode("utf-8"))
-            .decode("utf-8")
-            .rstrip("=")
-        )
+        # same window, next page
+        next_state = {"since": since, "high": high, "eks": lek}
+    else:
+        next_state = {"since": high}
 
-    return {"items": items, "nextCursor": next_cursor}
+    return {"items": items, "nextToken": _encode_cursor(next_state), "hasMore": bool(lek)}
 
 
 def handle_delete_history(event):
@@ -408,8 +1132,8 @@ def handle_delete_history(event):
     try:
         table.update_item(
             Key={"pk": pk, "sk": sk},
-            UpdateExpression="SET deleted = :d",
-            ExpressionAttributeValues={":d": True},
+            UpdateExpression="SET deleted = :d, u = :u",
+            ExpressionAttributeValues={":d": True, ":u": _now_ms()},
             ConditionExpression="attribute_exists(sk)",
         )
         return {"statusCode": 204, "headers": _headers(), "body": ""}
@@ -486,8 +1210,8 @@ def handle_set_featured_history(event):
         try:
             table.update_item(
                 Key={"pk": pk, "sk": old_sk},
-                UpdateExpression="SET featured = :f",
-                ExpressionAttributeValues={":f": False},
+                UpdateExpression="SET featured = :f, u = :u",
+                ExpressionAttributeValues={":f": False, ":u": _now_ms()},
                 ConditionExpression="attribute_exists(sk)",
             )
         except Exception:
@@ -497,8 +1221,8 @@ def handle_set_featured_history(event):
     try:
         table.update_item(
             Key={"pk": pk, "sk": sk},
-            UpdateExpression="SET featured = :t",
-            ExpressionAttributeValues={":t": True},
+            UpdateExpression="SET featured = :t, u = :u",
+            ExpressionAttributeValues={":t": True, ":u": _now_ms()},
             ConditionExpression="attribute_exists(sk)",
         )
     except ClientError as e:
@@ -512,6 +1236,158 @@ def handle_set_featured_history(event):
     return {"statusCode": 204, "headers": _headers(), "body": ""}
 
 
+def _bulk_transact(updates: list) -> dict:
+    """
+    Apply [(sk, update_kwargs)] in TransactWriteItems chunks. If a chunk is
+    cancelled (e.g. an item vanished meanwhile) fall back to single updates
+    so each sk still gets its own result. Returns {sk: "ok"|"not_found"|"error"}.
+    """
+    client = ddb.meta.client  # thread-safe, unlike the Table resource
+    results = {}
+
+    def _one_by_one(chunk):
+        out = {}
+        for sk, kw in chunk:
+            try:
+                client.update_item(TableName=DDB_TABLE_NAME, **kw)
+                out[sk] = "ok"
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code", "")
+                out[sk] = "not_found" if code == "ConditionalCheckFailedException" else "error"
+            except Exception:
+                out[sk] = "error"
+        return out
+
+    def _chunk(chunk):
+        try:
+            client.transact_write_items(
+                TransactItems=[{"Update": {"TableName": DDB_TABLE_NAME, **kw}} for _, kw in chunk]
+            )
+            return {sk: "ok" for sk, _ in chunk}
+        except ClientError:
+            return _one_by_one(chunk)
+
+    chunks = [updates[i : i + BULK_TX_SIZE] for i in range(0, len(updates), BULK_TX_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, min(BULK_MAX_WORKERS, len(chunks)))) as pool:
+        for part in pool.map(_chunk, chunks):
+            results.update(part)
+    return results
+
+
+def _delete_s3_objects_best_effort(keys: list) -> set:
+    """DeleteObjects in 1000-key chunks; returns the keys that failed."""
+    failed = set()
+    for i in range(0, len(keys), 1000):
+        chunk = keys[i : i + 1000]
+        try:
+            resp = s3.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True},
+            )
+            failed.update(err.get("Key") for err in resp.get("Errors", []) or [])
+        except Exception:
+            failed.update(chunk)
+    return failed
+
+
+def handle_bulk_history(event, sub: str):
+    """
+    POST {"action": "delete"|"restore", "sks": [...], "purge": false}
+    - ownership: items are looked up under the caller's pk (BatchGetItem)
+    - delete/restore: soft-delete flag flipped with transactional writes
+    - purge (delete only): also removes the S3 objects (DeleteObjects); the
+      row keeps its history entry but can no longer be restored with an image
+    Returns {"results": [{"sk", "result"}], "summary": {result: count}}.
+    """
+    if not table:
+        return _resp(500, {"error": "DynamoDB table not configured"})
+
+    body = _json_body(event)
+    action = (body.get("action") or "").strip().lower()
+    sks = body.get("sks")
+    purge = body.get("purge") is True
+
+    if action not in ("delete", "restore"):
+        return _resp(400, {"error": "Invalid 'action'. Allowed: ['delete', 'restore']"})
+    if not isinstance(sks, list) or not sks or not all(isinstance(x, str) and x.startswith("GEN#") for x in sks):
+        return _resp(400, {"error": "Missing or invalid 'sks' (expected a list of GEN# keys)."})
+    if len(sks) > BULK_MAX_ITEMS:
+        return _resp(400, {"error": f"Too many items (max {BULK_MAX_ITEMS})."})
+    if purge and action != "delete":
+        return _resp(400, {"error": "'purge' is only valid with action=delete."})
+
+    sks = list(dict.fromkeys(sks))
+    names = {"#sk": "sk", "#k": "k", "#s3Key": "s3Key", "#deleted": "deleted", "#purged": "purged"}
+    try:
+        rows = _batch_get_history(sub, sks, ", ".join(names.keys()), names)
+    except Exception as e:
+        return _resp(500, {"error": f"Failed to read history items: {str(e)}"})
+    found = {r["sk"]: r for r in rows}
+
+    pk = _pk(sub)
+    now_ms = _now_ms()
+    results = {}
+    updates = []
+    purge_keys = {}
+    for sk in sks:
+        row = found.get(sk)
+        if not row:
+            results[sk] = "not_found"
+            continue
+        is_deleted = row.get("deleted") is True
+        s3_key = row.get("k") or row.get("s3Key")
+
+        if action == "restore":
+            if not is_deleted:
+                results[sk] = "unchanged"
+                continue
+            if row.get("purged") is True:
+                results[sk] = "purged"
+                continue
+            expr = "SET deleted = :f, u = :u"
+            values = {":f": False, ":u": now_ms}
+        else:
+            if is_deleted and not (purge and s3_key):
+                results[sk] = "unchanged"
+                continue
+            expr = "SET deleted = :t, u = :u"
+            values = {":t": True, ":u": now_ms}
+            if purge and s3_key:
+                expr += ", purged = :t REMOVE k, s3Key"
+                purge_keys[sk] = s3_key
+
+        updates.append(
+            (
+                sk,
+                {
+                    "Key": {"pk": pk, "sk": sk},
+                    "UpdateExpression": expr,
+                    "ExpressionAttributeValues": values,
+                    "ConditionExpression": "attribute_exists(sk)",
+                },
+            )
+        )
+
+    applied = _bulk_transact(updates) if updates else {}
+    done = "deleted" if action == "delete" else "restored"
+    for sk, outcome in applied.items():
+        results[sk] = done if outcome == "ok" else outcome
+
+    # Objects go only after their rows no longer point at them
+    to_purge = [purge_keys[sk] for sk in purge_keys if applied.get(sk) == "ok"]
+    if to_purge:
+        failed = _delete_s3_objects_best_effort(to_purge)
+        for sk, key in purge_keys.items():
+            if key in failed:
+                results[sk] = "purge_failed"
+
+    summary = {}
+    for outcome in results.values():
+        summary[outcome] = summary.get(outcome, 0) + 1
+
+    return _resp(200, {"results": [{"sk": sk, "result": results[sk]} for sk in sks], "summary": summary})
+
+
 def get_featured(sub: str):
     if not table:
         return {"presigned_url": None, "sk": None}
@@ -545,7 +1421,7 @@ def get_featured(sub: str):
         items = resp.get("Items", []) or []
 
         if items:
-            it = items[0]
+            it = _decode_history_item(items[0])
             key = it.get("s3Key")
             if not key:
                 return {"presigned_url": None, "sk": it.get("sk")}
@@ -602,11 +1478,14 @@ def handle_edit(event):
           "prompt": "...",
           "image": "<base64>",
           "strength": 0.35,            # optional (0..1)
-          "output_format": "png|jpg",  # optional
+          "output_format": "png|jpg|webp|avif|auto",  # optional (or Accept)
+          "quality": 80,               # optional, lossy formats
+          "max_bytes": 300000,         # optional byte budget, lossy formats
           "seed": 0,                   # optional
           "negative_prompt": "..."     # optional
         }
     - returns { presigned_url, credits_remaining? }
+      (or NDJSON progress events, same as generation)
     """
     if not table:
         return _resp(500, {"error": "DynamoDB table not configured"})
@@ -615,155 +1494,254 @@ def handle_edit(event):
     if not sub:
         return _resp(401, {"error": "Unauthorized (missing JWT claims)"})
 
-    body = _json_body(event)
+    return handle_generation(event, sub, "image-to-image")
 
-    prompt = (body.get("prompt") or "").strip()
-    if not prompt:
-        return _resp(400, {"error": "Missing required parameter: prompt"})
 
-    image_b64 = body.get("image")
-    if not image_b64 or not isinstance(image_b64, str):
-        return _resp(400, {"error": "Missing required parameter: image (base64 string)"})
+# -------------------------
+# SAMPLING PROFILER
+# -------------------------
+_profile_labels = {}  # code object -> "module:function"
 
 
-    negative_prompt = (body.get("negative_prompt") or "").strip()
+def _code_label(code) -> str:
+    label = _profile_labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if "site-packages/" in path:
+            path = path.rsplit("site-packages/", 1)[1]
+        else:
+            path = os.path.basename(path)
+        label = f"{path[:-3] if path.endswith('.py') else path}:{code.co_name}"
+        _profile_labels[code] = label
+    return label
+
+
+class _StackSampler:
+    """Wall-clock sampler for one thread; stacks are kept as code-object tuples."""
+
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.interval_s = PROFILE_INTERVAL_MS / 1000.0
+        self.stacks = {}
+        self.samples = 0
+        self.backoffs = 0
+        self.overhead_s = 0.0
+        self.wall_s = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.wall_s = time.perf_counter() - self._t0
+
+    def _run(self):
+        cpu0 = time.thread_time()
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            if self._stop.is_set():
+                break  # the handler already returned; this would sample stop() itself
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            key = tuple(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+            if self.samples >= PROFILE_MAX_SAMPLES:
+                break
 
-    strength = body.get("strength", None)
-    if strength is None:
-        strength = 0.35
+            self.overhead_s = time.thread_time() - cpu0
+            if self.overhead_s > PROFILE_MAX_OVERHEAD * (time.perf_counter() - self._t0) and self.interval_s < 1.0:
+                self.interval_s *= 2
+                self.backoffs += 1
+
+    def collapsed(self) -> bytes:
+        """One "frame;frame;... count" line per stack, hottest first, capped at PROFILE_MAX_BYTES."""
+        merged = {}
+        for codes, n in self.stacks.items():
+            line = ";".join(_code_label(c) for c in codes)
+            merged[line] = merged.get(line, 0) + n
+
+        out, size, dropped = [], 0, 0
+        budget = PROFILE_MAX_BYTES - 64  # room for the [truncated] line
+        for line, n in sorted(merged.items(), key=lambda kv: kv[1], reverse=True):
+            line = f"{line} {n}\n".encode("utf-8")
+            if size + len(line) > budget:
+                dropped += n
+                continue
+            out.append(line)
+            size += len(line)
+        if dropped:
+            out.append(f"[truncated] {dropped}\n".encode("utf-8"))
+        return b"".join(out)
+
+
+def _profile_route(event: dict) -> str:
+    """METHOD + path below the API base path, ids collapsed; event source otherwise."""
+    method = (event.get("requestContext") or {}).get("http", {}).get("method")
+    if not method:
+        if isinstance(event.get("Records"), list):
+            return "stream"
+        return event.get("source") or "unknown"
+    parts = get_http_path(event).strip("/").split("/")[1:]
+    if "share" in parts[:-1]:
+        parts[parts.index("share") + 1] = "{id}"
+    return f"{method} /{'/'.join(parts)}"
+
+
+def _should_profile(event: dict) -> bool:
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    headers = event.get("headers") or {}
+    return headers.get("x-profile") == "1" and _is_admin(event)
+
+
+def _write_profile_best_effort(sampler: _StackSampler, event: dict, context, status):
+    if not sampler.samples:
+        return  # finished inside the first interval
+    route = _profile_route(event)
+    req_id = getattr(context, "aws_request_id", None) or (event.get("requestContext") or {}).get("requestId") or uuid.uuid4().hex
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    key = f"{PROFILE_PREFIX}{re.sub(r'[^a-z0-9]+', '-', route.lower()).strip('-') or 'root'}/{day}/{req_id}.collapsed"
+    meta = {
+        "route": route,
+        "requestId": req_id,
+        "status": status,
+        "wallMs": round(sampler.wall_s * 1000, 1),
+        "samples": sampler.samples,
+        "intervalMs": round(sampler.interval_s * 1000, 2),
+        "backoffs": sampler.backoffs,
+        "overheadMs": round(sampler.overhead_s * 1000, 2),
+    }
     try:
-        strength = float(strength)
-    except Exception:
-        return _resp(400, {"error": "Invalid strength (must be a number)"})
-
+        s3.put_object(
+            Bucket=BUCKET_NAME,
+            Key=key,
+            Body=sampler.collapsed(),
+            ContentType="text/plain; charset=utf-8",
+            Metadata={k.lower(): str(v) for k, v in meta.items()},
+        )
+        print(_dumps({"profile": key, **meta}))
+    except Exception as e:
+        print(f"profile upload failed: {e}")
 
-    if strength < 0.0 or strength > 1.0:
-        return _resp(400, {"error": "Invalid strength. Range: 0.0 to 1.0"})
 
+class _ProfileUploader:
+    """
+    Internal Lambda extension (Extensions API) that runs profile uploads
+    after the response is sent. Lambda doesn't freeze the environment until
+    every extension asks for its next event, so each INVOKE waits for the
+    handler to hand over its upload (or None) and runs it before asking.
+    """
 
-    output_format = (body.get("output_format") or "png").strip().lower()
-    if output_format == "jpeg":
-        output_format = "jpg"
-    if output_format not in ALLOWED_OUTPUT_FORMATS:
-        return _resp(400, {"error": f"Invalid output_format. Allowed: {sorted(ALLOWED_OUTPUT_FORMATS)}"})
+    def __init__(self, runtime_api: str):
+        self._base = f"http://{runtime_api}/2020-01-01/extension"
+        self._pending = queue.Queue()
+        req = urllib.request.Request(
+            f"{self._base}/register",
+            data=_dumps({"events": ["INVOKE"]}).encode("utf-8"),
+            headers={"Lambda-Extension-Name": "poster-profiler"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=2) as resp:
+            self._id = resp.headers["Lambda-Extension-Identifier"]
+        threading.Thread(target=self._run, name="profile-uploader", daemon=True).start()
 
+    def submit(self, upload):
+        """Once per invocation, from the handler thread: a callable or None."""
+        self._pending.put(upload)
 
-    seed = body.get("seed", 0)
+    def _run(self):
+        next_req = urllib.request.Request(f"{self._base}/event/next", headers={"Lambda-Extension-Identifier": self._id})
+        while True:
+            with urllib.request.urlopen(next_req) as resp:  # blocks until the next invocation
+                event = json.loads(resp.read())
+            if event.get("eventType") != "INVOKE":
+                continue
+            try:
+                upload = self._pending.get(timeout=max(0.0, event["deadlineMs"] / 1000.0 - time.time()))
+            except queue.Empty:
+                continue  # the handler timed out; the environment is torn down anyway
+            if upload:
+                upload()
+
+
+def _start_profile_uploader():
+    # Only under the API handler: the streaming function (run.sh) never calls
+    # lambda_handler, so an extension there would hold every invocation open
+    # until its deadline.
+    runtime_api = os.environ.get("AWS_LAMBDA_RUNTIME_API")
+    if not runtime_api or os.environ.get("_HANDLER") != "lambda_function.lambda_handler":
+        return None
     try:
-        seed = int(seed)
-    except Exception:
-        seed = 0
-
-
-    ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
-    req_id = uuid.uuid4().hex
+        return _ProfileUploader(runtime_api)
+    except Exception as e:
+        print(f"profile uploader not registered, uploading inline: {e}")
+        return None
 
-    # 1) Reserve credit (same pool)
-    try:
-        remaining = reserve_credit_or_fail(sub)
-    except ValueError as e:
-        if str(e) == "OUT_OF_CREDITS":
-            write_history_best_effort(
-                sub=sub,
-                ts_iso=ts_iso,
-                req_id=req_id,
-                prompt=prompt,
-                aspect_ratio="",
-                output_format=output_format,
-                status="FAILED",
-                error_message="Out of credits",
-            )
-            return _resp(402, {"error": "Out of credits"})
-        raise
 
-    try:
-        # 2) Invoke Bedrock (Stability image-to-image style body)
-        # NOTE: For Stability models on Bedrock, image-to-image commonly accepts:
-        #   prompt, image (base64), strength, output_format, seed, negative_prompt
-        request_body = {
-            "prompt": prompt,
-            "image": image_b64,
-            "strength": strength,
-            "output_format": output_format,
-            "seed": seed,
-        }
-        if negative_prompt:
-            request_body["negative_prompt"] = negative_prompt
-
-        br = bedrock.invoke_model(
-            modelId=MODEL_ID,
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps(request_body),
-        )
+_profile_uploader = _start_profile_uploader()
 
-        data = json.loads(br["body"].read())
 
-        if "images" in data and data["images"]:
-            out_b64 = data["images"][0]
-        elif "artifacts" in data and data["artifacts"]:
-            out_b64 = data["artifacts"][0].get("base64")
-        else:
-            raise RuntimeError(f"No image in Bedrock response: {data}")
+def _profiled(handler):
+    """Wrap the Lambda entry point with the sampling profiler when this invocation is picked."""
 
-        image_bytes = base64.b64decode(out_b64)
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not _should_profile(event or {}):
+            try:
+                return handler(event, context)
+            finally:
+                if _profile_uploader:
+                    _profile_uploader.submit(None)
 
-        # 3) Save output to S3
-        ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-        prefix = KEY_PREFIX if KEY_PREFIX.endswith("/") else f"{KEY_PREFIX}/"
-        key = f"{prefix}{ts}-{req_id}.{output_format}"
+        sampler = _StackSampler(threading.get_ident())
+        sampler.start()
+        resp = None
+        try:
+            resp = handler(event, context)
+            return resp
+        finally:
+            sampler.stop()
+            status = resp.get("statusCode") if isinstance(resp, dict) else None
+            upload = functools.partial(_write_profile_best_effort, sampler, event or {}, context, status)
+            if _profile_uploader:
+                _profile_uploader.submit(upload)
+            else:
+                upload()
 
-        content_type = "image/png" if output_format == "png" else "image/jpeg"
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=key,
-            Body=image_bytes,
-            ContentType=content_type,
-        )
+    return wrapper
 
-        presigned_url = s3.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": BUCKET_NAME, "Key": key},
-            ExpiresIn=URL_EXPIRES_SECONDS,
-            HttpMethod="GET",
-        )
 
-        # 4) Write history (best effort)
-        write_history_best_effort(
-            sub=sub,
-            ts_iso=ts_iso,
-            req_id=req_id,
-            prompt=prompt,
-            aspect_ratio="",
-            output_format=output_format,
-            status="SUCCESS",
-            s3_key=key,
-        )
+@_profiled
+def lambda_handler(event, context):
+    event = event or {}
 
-        payload = {"presigned_url": presigned_url}
-        if remaining >= 0:
-            payload["credits_remaining"] = remaining
+    # Async export job (self-invoked by handle_history_export)
+    if event.get("source") == EXPORT_EVENT_SOURCE:
+        return run_export_job(event)
 
-        return _resp(200, payload)
+    # One-off search index backfill (invoked by hand, then self-invoked)
+    if event.get("source") == SEARCH_BACKFILL_EVENT_SOURCE:
+        return run_search_backfill(event, context)
 
-    except Exception as e:
-        refund_credit_best_effort(sub)
-
-        write_history_best_effort(
-            sub=sub,
-            ts_iso=ts_iso,
-            req_id=req_id,
-            prompt=prompt,
-            aspect_ratio="",
-            output_format=output_format,
-            status="FAILED",
-            error_message=str(e),
-        )
-        return _resp(502, {"error": "Edit failed"})
+    # Scheduled inventory sweep (EventBridge)
+    if event.get("source") == SWEEPER_EVENT_SOURCE:
+        return run_sweeper(event, context)
 
+    # Scheduled credit ledger compaction (EventBridge)
+    if event.get("source") == LEDGER_EVENT_SOURCE:
+        return run_ledger_compaction(event, context)
 
-def lambda_handler(event, context):
-    event = event or {}
+    # DynamoDB Streams (TTL deletes)
+    records = event.get("Records")
+    if isinstance(records, list) and records and records[0].get("eventSource") == "aws:dynamodb":
+        return handle_stream_records(event)
 
     # ✅ UPDATED: canonical method/path/sub parsing (as requested)
     method = (event.get("requestContext") or {}).get("http", {}).get("method") or event.get("httpMethod") or ""
@@ -778,6 +1756,10 @@ def lambda_handler(event, context):
     if method == "GET" and "/share/" in path:
         return handle_get_share(event)
 
+    # ✅ PUBLIC: gallery feed (CDN-cacheable)
+    if method == "GET" and path.endswith("/feed"):
+        return handle_get_feed(event)
+
     # ✅ Everything else below requires auth
     if not sub:
         return _resp(401, {"error": "Unauthorized (missing JWT claims)"})
@@ -797,14 +1779,57 @@ def lambda_handler(event, context):
         data = get_history(sub=sub, limit=limit, cursor=cursor)
         return _resp(200, data)
 
+    # 1a) GET /moviePosterImageGenerator/history/changes?since=<token>
+    elif method == "GET" and path.endswith("/history/changes"):
+        qsp = event.get("queryStringParameters") or {}
+        try:
+            data = get_history_changes(sub=sub, since_token=qsp.get("since"))
+        except ValueError as e:
+            return _resp(400, {"error": str(e)})
+        return _resp(200, data)
+
+    # 1b) GET /moviePosterImageGenerator/history/search?q=...
+    elif method == "GET" and path.endswith("/history/search"):
+        qsp = event.get("queryStringParameters") or {}
+        try:
+            limit = int(qsp.get("limit") or 20)
+        except Exception:
+            limit = 20
+        try:
+            data = search_history(sub=sub, q=qsp.get("q") or "", limit=limit, cursor=qsp.get("cursor"))
+        except ValueError as e:
+            return _resp(400, {"error": str(e)})
+        return _resp(200, data)
+
+    # 1c) POST /moviePosterImageGenerator/history/export  (start ZIP export)
+    #     GET  /moviePosterImageGenerator/history/export?jobId=...  (poll)
+    elif path.endswith("/history/export") and method in ("POST", "GET"):
+        return handle_history_export(event, sub=sub, context=context)
+
     # 2) DELETE /moviePosterImageGenerator/history
     elif method == "DELETE" and path.endswith("/history"):
         return handle_delete_history(event)
 
+    # GET /moviePosterImageGenerator/admin/stats  (admin usage analytics)
+    elif method == "GET" and path.endswith("/admin/stats"):
+        return handle_admin_stats(event)
+
+    # DELETE /moviePosterImageGenerator/feed  (admin moderation)
+    elif method == "DELETE" and path.endswith("/feed"):
+        return handle_remove_from_feed(event)
+
+    # 2b) POST /moviePosterImageGenerator/history/bulk  (multi delete/restore)
+    elif method == "POST" and path.endswith("/history/bulk"):
+        return handle_bulk_history(event, sub=sub)
+
     # 3) POST /moviePosterImageGenerator/history/featured
     elif method == "POST" and path.endswith("/history/featured"):
         return handle_set_featured_history(event)
 
+    # 3b) GET /moviePosterImageGenerator/presets
+    elif method == "GET" and path.endswith("/presets"):
+        return _resp(200, list_presets())
+
     # 4) GET /moviePosterImageGenerator/featured
     elif method == "GET" and path.endswith("/featured"):
         data = get_featured(sub=sub)
@@ -824,133 +1849,626 @@ def lambda_handler(event, context):
         return handle_edit(event)
 
 
+    # GET /moviePosterImageGenerator/credits/ledger
+    if method == "GET" and path.endswith("/credits/ledger"):
+        return handle_get_ledger(event, sub)
+
     # 7) GET /moviePosterImageGenerator  (credits)
     # Keep this LAST among GET routes, otherwise it could “catch” other GETs depending on path matching.
     elif method == "GET":
-        credits = get_credits(sub)
-        return _resp(200, {"credits": credits})
+        plan = _plan_for(event)
+        credits = get_credits(sub, plan)
+        return _resp(200, {"credits": credits, "plan": plan, "dailyCredits": CREDIT_PLANS[plan]})
 
     # -------------------------
     # GENERATION (POST /moviePosterImageGenerator)
     # -------------------------
     # Everything below here is generation
-    qsp = event.get("queryStringParameters") or {}
-    body = _json_body(event)
+    return handle_generation(event, sub, "text-to-image")
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join((text or "").split())
+
+
+def _merge_negative(*parts: str) -> str:
+    # comma-separated terms, deduped case-insensitively, order kept
+    seen = {}
+    for part in parts:
+        for term in (part or "").split(","):
+            term = _normalize_text(term)
+            if term and term.lower() not in seen:
+                seen[term.lower()] = term
+    return ", ".join(seen.values())
+
+
+def _canonicalize_generation(preset, prompt, negative_prompt, aspect_ratio, output_format):
+    """
+    Apply a preset (if any) and normalize whitespace so logically identical
+    requests produce byte-identical Bedrock bodies. Returns
+    (prompt, negative_prompt, seed).
+    """
+    prompt = _normalize_text(prompt)
+    negative_prompt = _merge_negative(negative_prompt)
+    if not preset:
+        return prompt, negative_prompt, 0
+
+    prompt = _normalize_text(preset["prompt"].replace("{prompt}", prompt)).strip(" ,")
+    negative_prompt = _merge_negative(preset["negative_prompt"], negative_prompt)
+
+    policy = preset["seed_policy"]
+    if policy == "random":
+        seed = secrets.randbelow(SEED_MAX + 1)
+    elif policy == "hash":
+        # same inputs -> same seed -> same image, so results can be reused
+        digest = hashlib.sha256(
+            "\x1f".join((prompt, negative_prompt, aspect_ratio, output_format)).encode("utf-8")
+        ).digest()
+        seed = int.from_bytes(digest[:4], "big") % (SEED_MAX + 1)
+    else:
+        seed = preset["seed"]
+    return prompt, negative_prompt, seed
+
+
+def count_preset_usage_best_effort(preset_id: str):
+    if not table or not preset_id:
+        return
+    try:
+        table.update_item(
+            Key={"pk": f"PRESET#{preset_id}", "sk": "USAGE"},
+            UpdateExpression="ADD uses :one SET lastUsedAt = :now",
+            ExpressionAttributeValues={":one": 1, ":now": int(time.time())},
+        )
+    except Exception:
+        return
+
+
+def list_presets() -> dict:
+    return {
+        "presets": [
+            {
+                "id": preset_id,
+                "label": p["label"],
+                "aspect_ratio": p["aspect_ratio"],
+                "seed_policy": p["seed_policy"],
+            }
+            for preset_id, p in PRESETS.items()
+        ]
+    }
+
+
+def _negotiate_output_format(event: dict, requested: str) -> str:
+    """
+    Explicit output_format wins. "auto" or no parameter falls back to image
+    types in the Accept header (highest q, then OUTPUT_FORMAT_PREFERENCE);
+    "auto" without any picks the best available, otherwise png.
+    """
+    requested = (requested or "").strip().lower()
+    if requested == "jpeg":
+        requested = "jpg"
+    if requested and requested != "auto":
+        return requested
+
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    by_type = {v: k for k, v in CONTENT_TYPES.items()}
+    accepted = {}
+    for part in (headers.get("accept") or "").split(","):
+        media, _, params = part.strip().partition(";")
+        fmt = by_type.get(media.strip().lower())
+        if not fmt or fmt not in ALLOWED_OUTPUT_FORMATS:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted[fmt] = q
+
+    if not accepted and requested == "auto":
+        accepted = {f: 1.0 for f in CONTENT_TYPES if f in ALLOWED_OUTPUT_FORMATS}
+    if not accepted:
+        return "png"
+    return min(accepted, key=lambda f: (-accepted[f], OUTPUT_FORMAT_PREFERENCE.index(f)))
+
+
+def _output_options(event: dict, body: dict, qsp: dict) -> tuple:
+    """(output_format, quality, max_bytes) from the request; ValueError -> 400."""
+    output_format = _negotiate_output_format(event, body.get("output_format") or qsp.get("output_format"))
+    if output_format not in ALLOWED_OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output_format. Allowed: {sorted(ALLOWED_OUTPUT_FORMATS | {'auto'})}")
+
+    quality = body.get("quality", qsp.get("quality"))
+    max_bytes = body.get("max_bytes", qsp.get("max_bytes"))
+    try:
+        quality = int(quality) if quality not in (None, "") else None
+        max_bytes = int(max_bytes) if max_bytes not in (None, "") else None
+    except (TypeError, ValueError):
+        raise ValueError("quality and max_bytes must be integers")
+
+    if (quality is not None or max_bytes is not None) and output_format not in LOSSY_FORMATS:
+        raise ValueError(f"quality/max_bytes only apply to {sorted(LOSSY_FORMATS)}")
+    if (quality is not None or max_bytes is not None) and Image is None:
+        raise ValueError("quality/max_bytes are not available (no image encoder)")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Invalid quality. Range: 1 to 100")
+    if max_bytes is not None and max_bytes < ENCODE_MIN_BYTES:
+        raise ValueError(f"Invalid max_bytes. Minimum: {ENCODE_MIN_BYTES}")
+    return output_format, quality, max_bytes
+
+
+def _bedrock_format(output_format: str) -> str:
+    # re-encoded formats start from a lossless source
+    return output_format if output_format in BEDROCK_OUTPUT_FORMATS else "png"
+
+
+def _encode(im, output_format: str, quality: int | None) -> bytes:
+    out = io.BytesIO()
+    if output_format == "png":
+        im.save(out, format="PNG")
+    elif output_format == "jpg":
+        im.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    elif output_format == "webp":
+        im.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        im.save(out, format="AVIF", quality=quality, speed=8)
+    return out.getvalue()
+
+
+def encode_output(
+    image_bytes: bytes,
+    source_format: str,
+    output_format: str,
+    quality: int | None = None,
+    max_bytes: int | None = None,
+) -> bytes:
+    """
+    Encoding stage after the Bedrock decode. Bytes pass through untouched when
+    Bedrock already produced the requested format and no quality/budget was
+    asked for. With max_bytes, the highest quality (<= the requested one) that
+    fits is picked by binary search; if nothing fits, the smallest attempt is
+    returned.
+    """
+    if output_format == source_format and quality is None and max_bytes is None:
+        return image_bytes
+    if Image is None:
+        raise RuntimeError(f"No encoder available for {output_format}")
+
+    with Image.open(io.BytesIO(image_bytes)) as im:
+        im = im.convert("RGB")
+        if output_format not in LOSSY_FORMATS:
+            return _encode(im, output_format, None)
+
+        quality = quality or DEFAULT_QUALITY[output_format]
+        data = _encode(im, output_format, quality)
+        if not max_bytes or len(data) <= max_bytes:
+            return data
+
+        best, smallest = None, data
+        lo, hi = ENCODE_MIN_QUALITY, quality - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            attempt = _encode(im, output_format, mid)
+            if len(attempt) <= max_bytes:
+                best, lo = attempt, mid + 1
+            else:
+                smallest, hi = min(smallest, attempt, key=len), mid - 1
+        return best or smallest
+
+
+def _wants_stream(event: dict, body: dict, qsp: dict) -> bool:
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    return (
+        body.get("stream") is True
+        or str(qsp.get("stream") or "").lower() in ("1", "true")
+        or "application/x-ndjson" in (headers.get("accept") or "")
+    )
+
+
+def _ndjson_resp(events):
+    """
+    NDJSON through API Gateway, which can't stream: the whole body is
+    buffered, so the client gets every event (and the inline image) at once,
+    at the end, with no TTFB gain over the JSON flow. The function URL
+    (stream_server.py) sends the same events as they happen. Errors are
+    in-band, as they are there once the first byte has gone out.
+    """
+    return {
+        "statusCode": 200,
+        "headers": {**_headers(), "Content-Type": "application/x-ndjson"},
+        "body": "".join(_dumps(ev) + "\n" for ev in events),
+    }
+
+
+def _collect_generation(events):
+    """Classic JSON flow: {presigned_url, credits_remaining?} or {error}."""
+    for ev in events:
+        if ev["event"] == "error":
+            return _resp(ev["status"], {"error": ev["error"]})
+        if ev["event"] == "done":
+            payload = {"presigned_url": ev["presigned_url"]}
+            if "request_hash" in ev:
+                payload["request_hash"] = ev["request_hash"]
+            if "credits_remaining" in ev:
+                payload["credits_remaining"] = ev["credits_remaining"]
+            return _resp(200, payload)
+    return _resp(502, {"error": "Generation failed"})
+
+
+# -------------------------
+# GENERATION PIPELINE
+# -------------------------
+class GenerationError(Exception):
+    """A stage failure with a client-facing status (bad input, no credits)."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, ClientError):
+        return e.response.get("Error", {}).get("Code") in _TRANSIENT_ERROR_CODES
+    return isinstance(e, (BotoConnectionError, ReadTimeoutError))
+
+
+def _accept(ctx: dict) -> dict:
+    ctx["ts_iso"] = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+    ctx["req_id"] = uuid.uuid4().hex
+    return {"event": "accepted", "reqId": ctx["req_id"]}
+
+
+def _validate_output(ctx: dict):
+    try:
+        ctx["output_format"], ctx["quality"], ctx["max_bytes"] = _output_options(
+            ctx["event"], ctx["body"], ctx["qsp"]
+        )
+    except ValueError as e:
+        raise GenerationError(400, str(e))
+
+
+def _validate_text_to_image(ctx: dict) -> dict:
+    body, qsp = ctx["body"], ctx["qsp"]
+
+    preset_id = (body.get("preset") or qsp.get("preset") or "").strip()
+    preset = PRESETS.get(preset_id) if preset_id else None
+    if preset_id and not preset:
+        raise GenerationError(400, f"Unknown preset. Allowed: {sorted(PRESETS)}")
 
     prompt = (body.get("prompt") or qsp.get("prompt") or "").strip()
-    if not prompt:
-        return _resp(400, {"error": "Missing required parameter: prompt"})
+    if not prompt and not preset:
+        raise GenerationError(400, "Missing required parameter: prompt")
 
     negative_prompt = (body.get("negative_prompt") or qsp.get("negative_prompt") or "").strip()
 
-    aspect_ratio = (body.get("aspect_ratio") or qsp.get("aspect_ratio") or "1:1").strip()
+    aspect_ratio = (body.get("aspect_ratio") or qsp.get("aspect_ratio") or "").strip()
+    if not aspect_ratio:
+        aspect_ratio = (preset or {}).get("aspect_ratio") or "1:1"
     if aspect_ratio not in ALLOWED_ASPECT_RATIOS:
-        return _resp(400, {"error": f"Invalid aspect_ratio. Allowed: {sorted(ALLOWED_ASPECT_RATIOS)}"})
+        raise GenerationError(400, f"Invalid aspect_ratio. Allowed: {sorted(ALLOWED_ASPECT_RATIOS)}")
 
-    output_format = (body.get("output_format") or qsp.get("output_format") or "png").strip().lower()
-    if output_format == "jpeg":
-        output_format = "jpg"
-    if output_format not in ALLOWED_OUTPUT_FORMATS:
-        return _resp(400, {"error": f"Invalid output_format. Allowed: {sorted(ALLOWED_OUTPUT_FORMATS)}"})
+    _validate_output(ctx)
+
+    ctx["prompt"], ctx["negative_prompt"], ctx["seed"] = _canonicalize_generation(
+        preset, prompt, negative_prompt, aspect_ratio, _bedrock_format(ctx["output_format"])
+    )
+    # history, search and exports keep what the user typed; the preset by id
+    ctx["user_prompt"] = _normalize_text(prompt)
+    ctx["aspect_ratio"] = aspect_ratio
+    ctx["preset_id"] = preset_id or None
+    return _accept(ctx)
+
+
+def _validate_image_to_image(ctx: dict) -> dict:
+    body = ctx["body"]
+
+    prompt = (body.get("prompt") or "").strip()
+    if not prompt:
+        raise GenerationError(400, "Missing required parameter: prompt")
+
+    image_b64 = body.get("image")
+    if not image_b64 or not isinstance(image_b64, str):
+        raise GenerationError(400, "Missing required parameter: image (base64 string)")
+
+    strength = body.get("strength", None)
+    if strength is None:
+        strength = 0.35
+    try:
+        strength = float(strength)
+    except Exception:
+        raise GenerationError(400, "Invalid strength (must be a number)")
+    if strength < 0.0 or strength > 1.0:
+        raise GenerationError(400, "Invalid strength. Range: 0.0 to 1.0")
+
+    _validate_output(ctx)
+
+    try:
+        seed = int(body.get("seed", 0))
+    except Exception:
+        seed = 0
+
+    ctx.update(
+        prompt=prompt,
+        user_prompt=prompt,
+        negative_prompt=(body.get("negative_prompt") or "").strip(),
+        aspect_ratio="",
+        source_image=image_b64,
+        strength=strength,
+        seed=seed,
+    )
+    return _accept(ctx)
 
-    ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
-    req_id = uuid.uuid4().hex
 
+def _stage_reserve(ctx: dict) -> dict:
     try:
-        remaining = reserve_credit_or_fail(sub)
+        ctx["remaining"] = reserve_credit_or_fail(ctx["sub"], req_id=ctx["req_id"], plan=_plan_for(ctx["event"]))
     except ValueError as e:
         if str(e) == "OUT_OF_CREDITS":
-            write_history_best_effort(
-                sub=sub,
-                ts_iso=ts_iso,
-                req_id=req_id,
-                prompt=prompt,
-                aspect_ratio=aspect_ratio,
-                output_format=output_format,
-                status="FAILED",
-                error_message="Out of credits",
-            )
-            return _resp(402, {"error": "Out of credits"})
+            raise GenerationError(402, OUT_OF_CREDITS_ERROR)
         raise
 
-    try:
-        request_body = {
-            "prompt": prompt,
-            "negative_prompt": negative_prompt,
+    ev = {"event": "credit_reserved"}
+    if ctx["remaining"] >= 0:
+        ev["credits_remaining"] = ctx["remaining"]
+    return ev
+
+
+def _model_request(ctx: dict, request_body: dict, hashed: bool = True) -> dict:
+    # canonical body: sorted keys, so identical requests hash identically
+    ctx["bedrock_body"] = _canonical_json(request_body)
+    ev = {"event": "model_invoked", "modelId": MODEL_ID}
+    if hashed:
+        ctx["request_hash"] = ev["request_hash"] = hashlib.sha256(ctx["bedrock_body"]).hexdigest()
+    return ev
+
+
+def _build_text_to_image(ctx: dict) -> dict:
+    return _model_request(
+        ctx,
+        {
+            "prompt": ctx["prompt"],
+            "negative_prompt": ctx["negative_prompt"],
             "mode": "text-to-image",
-            "seed": 0,
-            "output_format": output_format,
-            "aspect_ratio": aspect_ratio,
-        }
+            "seed": ctx["seed"],
+            "output_format": _bedrock_format(ctx["output_format"]),
+            "aspect_ratio": ctx["aspect_ratio"],
+        },
+    )
 
-        br = bedrock.invoke_model(
-            modelId=MODEL_ID,
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps(request_body),
-        )
 
-        data = json.loads(br["body"].read())
+def _build_image_to_image(ctx: dict) -> dict:
+    # Stability image-to-image on Bedrock: prompt, image (base64), strength,
+    # output_format, seed, negative_prompt
+    request_body = {
+        "prompt": ctx["prompt"],
+        "image": ctx["source_image"],
+        "strength": ctx["strength"],
+        "output_format": _bedrock_format(ctx["output_format"]),
+        "seed": ctx["seed"],
+    }
+    if ctx["negative_prompt"]:
+        request_body["negative_prompt"] = ctx["negative_prompt"]
+    # no request_hash: hashing the ~2 MB source image costs more than it's worth
+    return _model_request(ctx, request_body, hashed=False)
+
+
+def _stage_invoke(ctx: dict):
+    br = bedrock.invoke_model(
+        modelId=MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=ctx["bedrock_body"],
+    )
+    data = _loads(br["body"].read())
+
+    if "images" in data and data["images"]:
+        ctx["image_b64"] = data["images"][0]
+    elif "artifacts" in data and data["artifacts"]:
+        ctx["image_b64"] = data["artifacts"][0].get("base64")
+    else:
+        raise RuntimeError(f"No image in Bedrock response: {data}")
 
-        if "images" in data and data["images"]:
-            image_b64 = data["images"][0]
-        elif "artifacts" in data and data["artifacts"]:
-            image_b64 = data["artifacts"][0].get("base64")
-        else:
-            raise RuntimeError(f"No image in Bedrock response: {data}")
 
-        image_bytes = base64.b64decode(image_b64)
+def _stage_encode(ctx: dict):
+    output_format = ctx["output_format"]
+    decoded = base64.b64decode(ctx["image_b64"])
+    ctx["image_bytes"] = encode_output(
+        decoded, _bedrock_format(output_format), output_format, ctx.get("quality"), ctx.get("max_bytes")
+    )
+    ctx["content_type"] = CONTENT_TYPES[output_format]
+    # pass-through keeps Bedrock's base64 for the inline image event
+    ctx["passthrough"] = ctx["image_bytes"] is decoded
 
-        ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-        prefix = KEY_PREFIX if KEY_PREFIX.endswith("/") else f"{KEY_PREFIX}/"
-        key = f"{prefix}{ts}-{req_id}.{output_format}"
 
-        content_type = "image/png" if output_format == "png" else "image/jpeg"
-        s3.put_object(
-            Bucket=BUCKET_NAME,
-            Key=key,
-            Body=image_bytes,
-            ContentType=content_type,
-        )
+def _stage_persist(ctx: dict):
+    ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    prefix = KEY_PREFIX if KEY_PREFIX.endswith("/") else f"{KEY_PREFIX}/"
+    ctx["s3_key"] = f"{prefix}{ts}-{ctx['req_id']}.{ctx['output_format']}"
 
-        presigned_url = s3.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": BUCKET_NAME, "Key": key},
-            ExpiresIn=URL_EXPIRES_SECONDS,
-            HttpMethod="GET",
-        )
+    s3.put_object(
+        Bucket=BUCKET_NAME,
+        Key=ctx["s3_key"],
+        Body=ctx["image_bytes"],
+        ContentType=ctx["content_type"],
+    )
 
-        write_history_best_effort(
-            sub=sub,
-            ts_iso=ts_iso,
-            req_id=req_id,
-            prompt=prompt,
-            aspect_ratio=aspect_ratio,
-            output_format=output_format,
-            status="SUCCESS",
-            s3_key=key,
-        )
+    if ctx.get("inline"):
+        # only once it's stored: from here on the client has the image, so a
+        # later failure no longer refunds the credit
+        ctx["delivered"] = True
+        image_b64 = ctx["image_b64"]
+        if not ctx["passthrough"]:
+            image_b64 = base64.b64encode(ctx["image_bytes"]).decode("ascii")
+        return {"event": "image", "contentType": ctx["content_type"], "base64": image_b64}
+
+
+def _stage_sign(ctx: dict) -> dict:
+    ctx["presigned_url"] = s3.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={"Bucket": BUCKET_NAME, "Key": ctx["s3_key"]},
+        ExpiresIn=URL_EXPIRES_SECONDS,
+        HttpMethod="GET",
+    )
+    return {"event": "upload_complete", "presigned_url": ctx["presigned_url"], "bytes": len(ctx["image_bytes"])}
+
+
+def _stage_record(ctx: dict) -> dict:
+    ctx["row"] = write_history_best_effort(
+        sub=ctx["sub"],
+        ts_iso=ctx["ts_iso"],
+        req_id=ctx["req_id"],
+        prompt=ctx["user_prompt"],
+        aspect_ratio=ctx["aspect_ratio"],
+        output_format=ctx["output_format"],
+        status="SUCCESS",
+        s3_key=ctx["s3_key"],
+        preset_id=ctx.get("preset_id"),
+    )
+    remaining = ctx["remaining"]
+    done = {"event": "done", "presigned_url": ctx["presigned_url"]}
+    if ctx.get("request_hash"):
+        done["request_hash"] = ctx["request_hash"]
+    if remaining >= 0:
+        done["credits_remaining"] = remaining
+    return done
+
+
+def _pipeline_failed(spec: dict, ctx: dict, e: Exception) -> dict:
+    """Undo/record a failed run; returns the terminal error event."""
+    if isinstance(e, GenerationError):
+        status, message, error_message = e.status, e.message, e.message
+    else:
+        status, message, error_message = 502, spec["error"], str(e)
+
+    if "req_id" not in ctx:
+        # rejected in validate: nothing reserved or written yet
+        return {"event": "error", "status": status, "error": message}
+
+    if "remaining" in ctx and not ctx.get("delivered"):
+        refund_credit_best_effort(ctx["sub"], req_id=ctx["req_id"])
+
+    ctx["row"] = write_history_best_effort(
+        sub=ctx["sub"],
+        ts_iso=ctx["ts_iso"],
+        req_id=ctx["req_id"],
+        prompt=ctx["user_prompt"],
+        aspect_ratio=ctx["aspect_ratio"],
+        output_format=ctx["output_format"],
+        status="FAILED",
+        error_message=error_message,
+        preset_id=ctx.get("preset_id"),
+    )
+    return {"event": "error", "status": status, "error": message}
+
+
+def _pipeline_stages(validate, build) -> tuple:
+    # (name, fn, retries); fn(ctx) -> progress event or None
+    return (
+        ("validate", validate, 0),
+        ("reserve", _stage_reserve, 0),
+        ("build", build, 0),
+        ("invoke", _stage_invoke, PIPELINE_INVOKE_RETRIES),
+        ("encode", _stage_encode, 0),
+        ("persist", _stage_persist, PIPELINE_PERSIST_RETRIES),
+        ("sign", _stage_sign, 0),
+        ("record", _stage_record, 0),
+    )
 
-        payload = {"presigned_url": presigned_url}
-        if remaining >= 0:
-            payload["credits_remaining"] = remaining
 
-        return _resp(200, payload)
+# New modes (upscale, inpaint, variations) are new entries: their own
+# validate/build stages over the shared reserve -> ... -> record chain.
+GENERATION_MODES = {
+    "text-to-image": {
+        "kind": "generate",
+        "error": "Generation failed",
+        "stages": _pipeline_stages(_validate_text_to_image, _build_text_to_image),
+    },
+    "image-to-image": {
+        "kind": "edit",
+        "error": "Edit failed",
+        "stages": _pipeline_stages(_validate_image_to_image, _build_image_to_image),
+    },
+}
+
+
+def _run_stage(fn, ctx: dict, retries: int):
+    for attempt in range(retries + 1):
+        try:
+            return fn(ctx)
+        except Exception as e:
+            if attempt >= retries or not _is_transient(e):
+                raise
+            time.sleep(PIPELINE_RETRY_BASE_S * (2**attempt))
+
+
+def run_pipeline(mode: str, ctx: dict):
+    """
+    Run a GENERATION_MODES pipeline as a sequence of progress events:
+      accepted -> credit_reserved -> model_invoked -> image? -> upload_complete -> done
+    or a terminal {"event": "error", "status", "error"}.
+
+    ctx needs sub, event, body, qsp and inline (send the encoded image as soon
+    as it's in S3, for streaming clients). Each stage is timed into
+    ctx["timings"] (ms) and logged once per request. With
+    DERIVED_WRITES=inline the history row's derived writes start only after
+    the terminal event has been taken, in a thread nothing waits on.
+    """
+    spec = GENERATION_MODES[mode]
+    ctx["kind"] = spec["kind"]
+    timings = ctx.setdefault("timings", {})
+    failed_stage = None
+    try:
+        for name, fn, retries in spec["stages"]:
+            t0 = time.perf_counter()
+            try:
+                ev = _run_stage(fn, ctx, retries)
+            except Exception as e:
+                timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+                failed_stage = name
+                yield _pipeline_failed(spec, ctx, e)
+                return
+            timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+            if ev:
+                yield ev
+    finally:
+        if ctx.get("row") and DERIVED_WRITES != "stream":
+            threading.Thread(target=apply_derived_writes, args=(ctx["row"],), name="derived-writes", daemon=True).start()
+        if PIPELINE_LOG_TIMINGS and "req_id" in ctx:
+            print(_dumps({"pipeline": mode, "reqId": ctx["req_id"], "failedStage": failed_stage, "timingsMs": timings}))
+
+
+def start_generation(event, body: dict, sub: str, mode: str, inline: bool):
+    """
+    Start a pipeline run: (error response, None) for bad input, else
+    (None, events). validate runs before the first event, so bad input is
+    still a plain 4xx with nothing reserved. Shared with stream_server.py.
+    """
+    qsp = event.get("queryStringParameters") or {}
+    events = run_pipeline(mode, {"sub": sub, "event": event, "body": body, "qsp": qsp, "inline": inline})
+
+    first = next(events)
+    if first["event"] == "error":
+        return _resp(first["status"], {"error": first["error"]}), None
+    return None, itertools.chain([first], events)
+
+
+def handle_generation(event, sub: str, mode: str):
+    """POST generation endpoints: JSON + presigned URL, or NDJSON progress events."""
+    # Opt-in progress events (+ inline image) instead of JSON + presigned URL
+    body = _json_body(event)
+    stream = _wants_stream(event, body, event.get("queryStringParameters") or {})
+    error, events = start_generation(event, body, sub, mode, inline=stream)
+    if error:
+        return error
+
+    if stream:
+        return _ndjson_resp(events)
+    return _collect_generation(events)
 
-    except Exception as e:
-        refund_credit_best_effort(sub)
-
-        write_history_best_effort(
-            sub=sub,
-            ts_iso=ts_iso,
-            req_id=req_id,
-            prompt=prompt,
-            aspect_ratio=aspect_ratio,
-            output_format=output_format,
-            status="FAILED",
-            error_message=str(e),
-        )
-        return _resp(502, {"error": "Generation failed"})
 
 def handle_create_share(event, sub: str):
     try:
@@ -960,6 +2478,9 @@ def handle_create_share(event, sub: str):
 
         sk = body.get("sk")
         expires_in = body.get("expiresInSeconds")  # optional
+        publish = body.get("publishToFeed")  # optional: list in the public gallery feed
+        if not isinstance(publish, bool):
+            publish = FEED_DEFAULT_PUBLISH
 
         if not sk:
             return _resp(400, {"error": "Missing sk"})
@@ -982,13 +2503,14 @@ def handle_create_share(event, sub: str):
 
         created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
-        public_key = _public_share_key(share_id)
+        image_format = _format_from_key(s3_key)
+        public_key = _public_share_key(share_id, image_format)
         try:
             s3.copy_object(
                 Bucket=BUCKET_NAME,
                 CopySource={"Bucket": BUCKET_NAME, "Key": s3_key},
                 Key=public_key,
-                ContentType="image/png",
+                ContentType=CONTENT_TYPES[image_format],
                 MetadataDirective="REPLACE",
             )
         except Exception as e:
@@ -1012,6 +2534,9 @@ def handle_create_share(event, sub: str):
 
         table.put_item(Item=share_item)
 
+        if publish:
+            append_feed_best_effort(share_item, aspect_ratio=gen.get("aspect_ratio"))
+
         payload = {"shareId": share_id, "shareUrl": f"/share/{share_id}"}
         if PUBLIC_SHARE_CDN_URL:
             payload["public_image_url"] = f"{PUBLIC_SHARE_CDN_URL}/{public_key}"
@@ -1063,3 +2588,1260 @@ def handle_get_share(event):
         )
     except Exception as e:
         return _resp(500, {"error": str(e) or "Get share failed"})
+
+
+# -------------------------
+# HISTORY EXPORT (ZIP)
+# -------------------------
+class _S3MultipartWriter:
+    """
+    Write-only, non-seekable file object backed by an S3 multipart upload.
+    Holds at most one part in memory, so zipfile can stream an archive of
+    any size through it.
+    """
+
+    def __init__(self, bucket: str, key: str, content_type: str = "application/zip"):
+        self.bucket = bucket
+        self.key = key
+        self._buf = bytearray()
+        self._parts = []
+        self._pos = 0
+        self._upload_id = s3.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type
+        )["UploadId"]
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def write(self, data) -> int:
+        self._buf += data
+        self._pos += len(data)
+        while len(self._buf) >= EXPORT_PART_SIZE:
+            self._upload_part(bytes(self._buf[:EXPORT_PART_SIZE]))
+            del self._buf[:EXPORT_PART_SIZE]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, data: bytes):
+        n = len(self._parts) + 1
+        r = s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=n, Body=data
+        )
+        self._parts.append({"ETag": r["ETag"], "PartNumber": n})
+
+    def close(self):
+        # last part may be smaller than 5 MB (or the only part)
+        if self._buf or not self._parts:
+            self._upload_part(bytes(self._buf))
+            self._buf = bytearray()
+        s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def abort(self):
+        try:
+            s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        except Exception:
+            pass
+
+
+def _export_key(sub: str, job_id: str) -> str:
+    return f"{EXPORT_PREFIX}{sub}/{job_id}.zip"
+
+
+def _export_job_key(sub: str, job_id: str) -> dict:
+    return {"pk": _pk(sub), "sk": f"EXPORT#{job_id}"}
+
+
+def _exportable(item: dict | None) -> bool:
+    return bool(
+        item
+        and (item.get("status") or "").upper() == "SUCCESS"
+        and item.get("s3Key")
+        and item.get("deleted") is not True
+    )
+
+
+def _batch_get_history(sub: str, sks: list, projection: str, names: dict) -> list:
+    """
+    BatchGetItem over this user's GEN# rows (100 keys per call, retries
+    UnprocessedKeys). Only keys under the caller's pk are ever requested.
+    """
+    out = []
+    pk = _pk(sub)
+    keys = [{"pk": pk, "sk": sk} for sk in dict.fromkeys(sks)]
+    for i in range(0, len(keys), 100):
+        request = {
+            DDB_TABLE_NAME: {
+                "Keys": keys[i : i + 100],
+                "ProjectionExpression": projection,
+                "ExpressionAttributeNames": names,
+            }
+        }
+        for attempt in range(5):
+            resp = ddb.batch_get_item(RequestItems=request)
+            out.extend(resp.get("Responses", {}).get(DDB_TABLE_NAME, []))
+            request = resp.get("UnprocessedKeys") or {}
+            if not request:
+                break
+            time.sleep(0.05 * (2**attempt))
+    return out
+
+
+def _export_items(sub: str, sks: list | None):
+    """
+    Yield (s3_key, created_at) for the SUCCESS items to export, newest
+    first. sks=None means the whole (non-deleted) history, read one Query
+    page at a time (newest first by sk), so it is never all in memory.
+    """
+    names = {"#sk": "sk", "#v": "v", "#st": "st", "#k": "k", "#status": "status", "#s3Key": "s3Key", "#deleted": "deleted"}
+    projection = ", ".join(names.keys())
+
+    if sks is not None:
+        # at most EXPORT_MAX_SELECTED rows; BatchGet returns them unordered
+        items = [it for it in map(_decode_history_item, _batch_get_history(sub, sks, projection, names)) if _exportable(it)]
+        items.sort(key=lambda it: it.get("sk") or "", reverse=True)
+        for it in items:
+            yield it["s3Key"], it.get("createdAt")
+        return
+
+    eks = None
+    while True:
+        params = {
+            "KeyConditionExpression": Key("pk").eq(_pk(sub)) & Key("sk").begins_with("GEN#"),
+            "ProjectionExpression": projection,
+            "ExpressionAttributeNames": names,
+            "ScanIndexForward": False,
+        }
+        if eks:
+            params["ExclusiveStartKey"] = eks
+        resp = table.query(**params)
+        for it in map(_decode_history_item, resp.get("Items", []) or []):
+            if _exportable(it):
+                yield it["s3Key"], it.get("createdAt")
+        eks = resp.get("LastEvaluatedKey")
+        if not eks:
+            return
+
+
+def _is_missing_object(e: ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound")
+
+
+def build_export_archive(sub: str, job_id: str, items) -> dict:
+    """
+    Stream every object into a ZIP that is multipart-uploaded as it is
+    written. Peak memory is one upload part plus one read chunk, regardless
+    of how many images are exported. items can be any iterable, e.g. the
+    _export_items generator.
+
+    An object that is gone from S3 (deleted or expired since its row was
+    read) is skipped, not fatal; manifest.json at the end of the archive
+    lists what was exported and what was missing. Any other failure aborts
+    the multipart upload and raises.
+
+    Returns {archiveKey, count, missing}.
+    """
+    archive_key = _export_key(sub, job_id)
+    writer = _S3MultipartWriter(BUCKET_NAME, archive_key)
+    exported, missing = [], []
+    try:
+        # images are already compressed; STORED avoids burning CPU for nothing
+        with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for s3_key, created_at in items:
+                name = os.path.basename(s3_key)
+                try:
+                    obj = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
+                except ClientError as e:
+                    if not _is_missing_object(e):
+                        raise
+                    missing.append({"file": name, "createdAt": created_at})
+                    continue
+                modified = obj.get("LastModified")
+                date_time = modified.timetuple()[:6] if modified else time.gmtime()[:6]
+                info = zipfile.ZipInfo(name, date_time=date_time)
+                info.file_size = int(obj.get("ContentLength") or 0)
+                with zf.open(info, mode="w", force_zip64=True) as dst:
+                    for chunk in obj["Body"].iter_chunks(chunk_size=1024 * 1024):
+                        dst.write(chunk)
+                exported.append({"file": name, "createdAt": created_at})
+            zf.writestr("manifest.json", _dumps({"exported": exported, "missing": missing}))
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return {"archiveKey": archive_key, "count": len(exported), "missing": len(missing)}
+
+
+def _export_download_url(archive_key: str) -> str:
+    return s3.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={
+            "Bucket": BUCKET_NAME,
+            "Key": archive_key,
+            "ResponseContentDisposition": 'attachment; filename="poster-history.zip"',
+        },
+        ExpiresIn=URL_EXPIRES_SECONDS,
+        HttpMethod="GET",
+    )
+
+
+def _set_export_job(sub: str, job_id: str, status: str, **extra):
+    item = {
+        **_export_job_key(sub, job_id),
+        "status": status,
+        "updatedAt": int(time.time()),
+        "ttl": _ttl_epoch(EXPORT_JOB_TTL_DAYS),
+        **extra,
+    }
+    table.put_item(Item=item)
+
+
+def run_export_job(event: dict):
+    """Async entry point: {"source": EXPORT_EVENT_SOURCE, "sub", "jobId", "sks"}."""
+    sub = event.get("sub")
+    job_id = event.get("jobId")
+    if not sub or not job_id or not table:
+        return {"ok": False}
+
+    _set_export_job(sub, job_id, "RUNNING")
+    try:
+        built = build_export_archive(sub, job_id, _export_items(sub, event.get("sks")))
+        _set_export_job(sub, job_id, "DONE", **built)
+        return {"ok": True}
+    except Exception as e:
+        _set_export_job(sub, job_id, "FAILED", errorMessage=str(e)[:HISTORY_ERROR_MAX_CHARS])
+        return {"ok": False}
+
+
+def handle_history_export(event, sub: str, context=None):
+    """
+    POST {"sks": [...]} (optional; default = whole history)
+      - small exports are built inline -> 200 {jobId, status: DONE, download_url, count, missing}
+      - large exports run async        -> 202 {jobId, status: PENDING}
+    GET ?jobId=... -> {jobId, status, download_url?, count?, missing?}
+    count is the images in the archive; missing, those gone from S3 (named
+    in the archive's manifest.json).
+    """
+    if not table:
+        return _resp(500, {"error": "DynamoDB table not configured"})
+
+    if _method(event) == "GET":
+        qsp = event.get("queryStringParameters") or {}
+        job_id = (qsp.get("jobId") or "").strip()
+        if not job_id:
+            return _resp(400, {"error": "Missing jobId"})
+        job = table.get_item(Key=_export_job_key(sub, job_id)).get("Item")
+        if not job:
+            return _resp(404, {"error": "Export job not found"})
+        payload = {"jobId": job_id, "status": job.get("status")}
+        if job.get("status") == "DONE":
+            payload["download_url"] = _export_download_url(job["archiveKey"])
+            payload["count"] = job.get("count")
+            payload["missing"] = job.get("missing", 0)
+        elif job.get("errorMessage"):
+            payload["error"] = job["errorMessage"]
+        return _resp(200, payload)
+
+    body = _json_body(event)
+    sks = body.get("sks")
+    if sks is not None:
+        if not isinstance(sks, list) or not all(isinstance(x, str) and x.startswith("GEN#") for x in sks):
+            return _resp(400, {"error": "Invalid 'sks' (expected a list of GEN# keys)."})
+        if not sks:
+            return _resp(400, {"error": "Nothing to export."})
+        if len(sks) > EXPORT_MAX_SELECTED:
+            return _resp(400, {"error": f"Too many items (max {EXPORT_MAX_SELECTED})."})
+
+    job_id = uuid.uuid4().hex
+    try:
+        # one item past the inline limit is enough to choose inline vs async
+        items = list(itertools.islice(_export_items(sub, sks), EXPORT_SYNC_MAX_ITEMS + 1))
+    except Exception as e:
+        return _resp(500, {"error": f"Failed to read history: {str(e)}"})
+    if not items:
+        return _resp(400, {"error": "No exportable items."})
+
+    if len(items) <= EXPORT_SYNC_MAX_ITEMS:
+        try:
+            built = build_export_archive(sub, job_id, items)
+        except Exception as e:
+            return _resp(500, {"error": f"Export failed: {str(e)}"})
+        _set_export_job(sub, job_id, "DONE", **built)
+        return _resp(
+            200,
+            {
+                "jobId": job_id,
+                "status": "DONE",
+                "download_url": _export_download_url(built["archiveKey"]),
+                "count": built["count"],
+                "missing": built["missing"],
+            },
+        )
+
+    function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    if not function_name:
+        return _resp(500, {"error": "Async export not available"})
+
+    _set_export_job(sub, job_id, "PENDING")
+    try:
+        _get_lambda_client().invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=_dumps({"source": EXPORT_EVENT_SOURCE, "sub": sub, "jobId": job_id, "sks": sks}).encode("utf-8"),
+        )
+    except Exception as e:
+        _set_export_job(sub, job_id, "FAILED", errorMessage=str(e)[:HISTORY_ERROR_MAX_CHARS])
+        return _resp(500, {"error": "Failed to start export"})
+
+    return _resp(202, {"jobId": job_id, "status": "PENDING"})
+
+
+# -------------------------
+# ORPHANED OBJECT SWEEPER
+# -------------------------
+_deserializer = TypeDeserializer()
+
+
+def _image_from_stream(image: dict | None) -> dict:
+    return {k: _deserializer.deserialize(v) for k, v in (image or {}).items()}
+
+
+def _is_ttl_delete(record: dict) -> bool:
+    identity = record.get("userIdentity") or {}
+    return (
+        record.get("eventName") == "REMOVE"
+        and identity.get("type") == "Service"
+        and identity.get("principalId") == "dynamodb.amazonaws.com"
+    )
+
+
+def _orphans_for_removed_row(old: dict) -> list:
+    """
+    S3 keys owned by `old` (an OLD_IMAGE) alone. Generated images are never
+    deleted here: a GEN# row's object can still back any number of SHARE#
+    rows (s3Key), which one stream record can't see; the inventory diff,
+    which gathers every reference, removes them once nothing points at them.
+    """
+    pk = old.get("pk") or ""
+    sk = old.get("sk") or ""
+    keys = []
+
+    if pk.startswith("SHARE#"):
+        public_key = old.get("publicS3Key") or _public_share_key(pk[len("SHARE#"):])
+        keys.append(public_key)
+        if old.get("thumbKey"):
+            keys.append(old["thumbKey"])
+
+    elif sk.startswith("EXPORT#"):
+        if old.get("archiveKey"):
+            keys.append(old["archiveKey"])
+
+    return keys
+
+
+def _is_history_insert(record: dict) -> bool:
+    keys = (record.get("dynamodb") or {}).get("Keys") or {}
+    return record.get("eventName") == "INSERT" and (keys.get("sk") or {}).get("S", "").startswith("GEN#")
+
+
+def _is_feed_insert(record: dict) -> bool:
+    keys = (record.get("dynamodb") or {}).get("Keys") or {}
+    return record.get("eventName") == "INSERT" and (keys.get("pk") or {}).get("S", "").startswith("FEED#")
+
+
+def handle_stream_records(event: dict):
+    """
+    DynamoDB Streams consumer, fed by two filtered event source mappings:
+    - GEN# and FEED# inserts: apply the row's derived writes / make the feed
+      thumbnail (DERIVED_WRITES=stream). All best effort, so these batches
+      never fail.
+    - TTL deletes: remove the S3 objects the expired row owned. Failures are
+      raised so Lambda retries the batch.
+    """
+    keys = []
+    for record in event.get("Records") or []:
+        if _is_history_insert(record):
+            apply_derived_writes(_image_from_stream((record.get("dynamodb") or {}).get("NewImage")))
+            continue
+        if _is_feed_insert(record):
+            make_feed_thumbnail_best_effort(_image_from_stream((record.get("dynamodb") or {}).get("NewImage")))
+            continue
+        if not _is_ttl_delete(record):
+            continue
+        old = _image_from_stream((record.get("dynamodb") or {}).get("OldImage"))
+        keys.extend(_orphans_for_removed_row(old))
+
+    keys = list(dict.fromkeys(keys))
+    failed = _delete_s3_objects_best_effort(keys) if keys else set()
+    if failed:
+        raise RuntimeError(f"Failed to delete {len(failed)} orphaned objects")
+    if keys:
+        print(_dumps({"sweeper": "stream", "deleted": len(keys)}))
+    return {"deleted": len(keys)}
+
+
+class _KeyFilter:
+    """Bloom filter over S3 keys (double hashing on one blake2b digest)."""
+
+    def __init__(self, bits: int, data: bytes | None = None):
+        self.bits = bits
+        self.data = bytearray(data) if data is not None else bytearray(bits // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.bits for i in range(SWEEP_FILTER_HASHES))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def _sweep_state_key(run_id: str) -> str:
+    return f"{SWEEP_STATE_PREFIX}{run_id}.bin"
+
+
+def _save_sweep_state(state: dict, keys: _KeyFilter):
+    header = _dumps(state).encode("utf-8")
+    body = len(header).to_bytes(4, "big") + header + bytes(keys.data)
+    s3.put_object(Bucket=BUCKET_NAME, Key=_sweep_state_key(state["runId"]), Body=gzip.compress(body, compresslevel=1))
+
+
+def _load_sweep_state(run_id: str) -> tuple:
+    body = gzip.decompress(s3.get_object(Bucket=BUCKET_NAME, Key=_sweep_state_key(run_id))["Body"].read())
+    size = int.from_bytes(body[:4], "big")
+    state = _loads(body[4 : 4 + size])
+    return state, _KeyFilter(state["filterBits"], body[4 + size :])
+
+
+def _scan_referenced_page(state: dict, keys: _KeyFilter) -> bool:
+    """
+    One Scan page of rows that point at S3 objects, into the filter. Rows
+    whose TTL has passed (DynamoDB removes them lazily) don't count as
+    references. Returns True when the Scan is done.
+    """
+    names = {"#k": "k", "#s3Key": "s3Key", "#pub": "publicS3Key", "#thumb": "thumbKey", "#arc": "archiveKey", "#ttl": "ttl"}
+    params = {"ProjectionExpression": ", ".join(names.keys()), "ExpressionAttributeNames": names}
+    if state.get("cursor"):
+        params["ExclusiveStartKey"] = _decode_cursor(state["cursor"])
+    resp = table.scan(**params)
+    for row in resp.get("Items", []) or []:
+        state["rowsScanned"] += 1
+        ttl = row.get("ttl")
+        if ttl is not None and int(ttl) <= state["now"]:
+            continue
+        for name in ("k", "s3Key", "publicS3Key", "thumbKey", "archiveKey"):
+            if row.get(name):
+                if row[name] not in keys:
+                    state["referenced"] += 1
+                keys.add(row[name])
+    eks = resp.get("LastEvaluatedKey")
+    state["cursor"] = _encode_cursor(eks) if eks else None
+    return not eks
+
+
+def _sweep_list_page(state: dict, keys: _KeyFilter, prefixes: list) -> bool:
+    """
+    One listing page of the current prefix: objects not in the filter and
+    older than the grace period are orphans, deleted right away (unless
+    dryRun). Returns True when every prefix is done.
+    """
+    pfx = prefixes[state["prefix"]]
+    stats = state["prefixes"].setdefault(pfx, {"listed": 0, "orphans": 0, "orphanBytes": 0})
+    params = {"Bucket": BUCKET_NAME, "Prefix": pfx}
+    if state.get("token"):
+        params["ContinuationToken"] = state["token"]
+    resp = s3.list_objects_v2(**params)
+
+    orphans = []
+    for obj in resp.get("Contents", []) or []:
+        stats["listed"] += 1
+        if obj["LastModified"].timestamp() > state["cutoff"] or obj["Key"] in keys:
+            continue
+        stats["orphans"] += 1
+        stats["orphanBytes"] += int(obj.get("Size") or 0)
+        orphans.append(obj["Key"])
+    state["orphans"] += len(orphans)
+    state["sample"].extend(orphans[: SWEEP_REPORT_SAMPLE - len(state["sample"])])
+    if orphans and not state["dryRun"]:
+        failed = _delete_s3_objects_best_effort(orphans)
+        state["deleted"] += len(orphans) - len(failed)
+        state["failed"] += len(failed)
+
+    state["token"] = resp.get("NextContinuationToken")
+    if not state["token"]:
+        state["prefix"] += 1
+    return state["prefix"] >= len(prefixes)
+
+
+def run_sweeper(event: dict, context=None):
+    """
+    Inventory diff: list this env's generated/ and exports/ prefixes and
+    remove objects no live row references. {"dryRun": true} only reports.
+    Also aborts multipart uploads (failed exports) older than the grace period.
+
+    Memory is bounded (a fixed-size filter of referenced keys, one Scan or
+    listing page at a time), and a run that outlives its invocation
+    checkpoints to S3 and continues in a fresh one ({"runId"}), like the
+    search backfill. Without a Lambda context it runs to the end in one go.
+    """
+    if not table:
+        return {"error": "DynamoDB table not configured"}
+
+    function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    prefix = KEY_PREFIX if KEY_PREFIX.endswith("/") else f"{KEY_PREFIX}/"
+    prefixes = [prefix, EXPORT_PREFIX]
+
+    if event.get("runId"):
+        try:
+            state, keys = _load_sweep_state(event["runId"])
+        except Exception as e:
+            print(_dumps({"sweeper": "inventory", "runId": event["runId"], "error": f"state not loaded: {e}"}))
+            return {"error": "Sweep state not found"}
+    else:
+        now = int(time.time())
+        state = {
+            "runId": uuid.uuid4().hex,
+            "dryRun": event.get("dryRun", True) is not False,
+            "now": now,
+            "cutoff": now - SWEEP_MIN_AGE_HOURS * 3600,
+            "filterBits": SWEEP_FILTER_BITS,
+            "phase": "scan",
+            "cursor": None,
+            "prefix": 0,
+            "token": None,
+            "rowsScanned": 0,
+            "referenced": 0,
+            "prefixes": {},
+            "orphans": 0,
+            "sample": [],
+            "deleted": 0,
+            "failed": 0,
+            "invocations": 0,
+        }
+        keys = _KeyFilter(SWEEP_FILTER_BITS)
+    state["invocations"] += 1
+
+    while True:
+        if state["phase"] == "scan":
+            if _scan_referenced_page(state, keys):
+                state["phase"] = "list"
+        elif _sweep_list_page(state, keys, prefixes):
+            break
+
+        remaining = context.get_remaining_time_in_millis() if context else None
+        if remaining is not None and remaining < SWEEP_MIN_REMAINING_MS and function_name:
+            _save_sweep_state(state, keys)
+            _get_lambda_client().invoke(
+                FunctionName=function_name,
+                InvocationType="Event",
+                Payload=_dumps({"source": SWEEPER_EVENT_SOURCE, "runId": state["runId"]}).encode("utf-8"),
+            )
+            return {"runId": state["runId"], "phase": state["phase"], "continued": True}
+
+    cutoff = datetime.fromtimestamp(state["cutoff"], timezone.utc)
+    stale_uploads = []
+    for page in s3.get_paginator("list_multipart_uploads").paginate(Bucket=BUCKET_NAME, Prefix=EXPORT_PREFIX):
+        for up in page.get("Uploads", []) or []:
+            if up["Initiated"] <= cutoff:
+                stale_uploads.append((up["Key"], up["UploadId"]))
+    if not state["dryRun"]:
+        for key, upload_id in stale_uploads:
+            try:
+                s3.abort_multipart_upload(Bucket=BUCKET_NAME, Key=key, UploadId=upload_id)
+            except Exception:
+                pass
+
+    report = {
+        "dryRun": state["dryRun"],
+        "rowsScanned": state["rowsScanned"],
+        "referenced": state["referenced"],
+        "prefixes": state["prefixes"],
+        "orphans": state["orphans"],
+        "sample": state["sample"],
+        "staleUploads": len(stale_uploads),
+        "invocations": state["invocations"],
+    }
+    if not state["dryRun"]:
+        report["deleted"] = state["deleted"]
+        report["failed"] = state["failed"]
+    if state["invocations"] > 1:
+        try:
+            s3.delete_object(Bucket=BUCKET_NAME, Key=_sweep_state_key(state["runId"]))
+        except Exception:
+            pass
+
+    print(_dumps({"sweeper": "inventory", **report}))
+    return report
+
+
+# -------------------------
+# PUBLIC GALLERY FEED
+# -------------------------
+def _feed_pk(day: str) -> str:
+    return f"FEED#{day}"
+
+
+def _feed_thumb_key(share_id: str) -> str:
+    return f"{PUBLIC_SHARE_PREFIX}thumbs/{share_id}.jpg"
+
+
+def _make_thumbnail(image_bytes: bytes) -> bytes | None:
+    if Image is None:
+        return None
+    with Image.open(io.BytesIO(image_bytes)) as im:
+        im.thumbnail((FEED_THUMB_PX, FEED_THUMB_PX))
+        out = io.BytesIO()
+        im.convert("RGB").save(out, format="JPEG", quality=80, optimize=True)
+        return out.getvalue()
+
+
+def append_feed_best_effort(share_item: dict, aspect_ratio: str | None = None):
+    """
+    Add a share to today's FEED#<day> partition. URLs are stored precomputed
+    (CloudFront), so serving the feed needs no presigning. Keys are not
+    stored here on purpose: the sweeper treats stored keys as references.
+    The thumbnail is made off the publish path (make_feed_thumbnail_best_effort);
+    until it exists the full image doubles as the thumbnail.
+    """
+    if not table or not PUBLIC_SHARE_CDN_URL:
+        return
+
+    share_id = share_item["pk"][len("SHARE#"):]
+    created_at = share_item["createdAt"]
+    image_url = f"{PUBLIC_SHARE_CDN_URL}/{share_item['publicS3Key']}"
+
+    ttl = _ttl_epoch(FEED_RETENTION_DAYS)
+    if share_item.get("ttl"):
+        ttl = min(ttl, int(share_item["ttl"]))
+
+    feed_pk = _feed_pk(created_at[:10])
+    feed_sk = f"{created_at}#{share_id}"
+    prompt = share_item.get("prompt") or ""
+    row = {
+        "pk": feed_pk,
+        "sk": feed_sk,
+        "shareId": share_id,
+        "img": image_url,
+        "thumb": image_url,
+        "prompt": prompt[:FEED_PROMPT_MAX_CHARS],
+        "createdAt": created_at,
+        "ttl": ttl,
+    }
+    if aspect_ratio:
+        row["ar"] = aspect_ratio
+
+    try:
+        table.put_item(Item=row)
+        table.update_item(
+            Key={"pk": share_item["pk"], "sk": "META"},
+            UpdateExpression="SET feedPk = :p, feedSk = :s",
+            ExpressionAttributeValues={":p": feed_pk, ":s": feed_sk},
+        )
+    except Exception:
+        return
+
+    if DERIVED_WRITES != "stream":
+        make_feed_thumbnail_best_effort(row)
+
+
+def make_feed_thumbnail_best_effort(row: dict):
+    """
+    Thumbnail for a new FEED# row (from the table stream, or inline without
+    the stream mapping). The share's META gets thumbKey before the upload:
+    public-share/ is only cleaned up through keys the table holds, so the
+    object is never unreferenced. Then the feed row points at it.
+    """
+    if Image is None or not table or not PUBLIC_SHARE_CDN_URL:
+        return
+    prefix = f"{PUBLIC_SHARE_CDN_URL}/"
+    image_url = row.get("img") or ""
+    if not image_url.startswith(prefix) or row.get("thumb") != image_url:
+        return
+
+    share_id = row["shareId"]
+    thumb_key = _feed_thumb_key(share_id)
+    try:
+        thumb = _make_thumbnail(s3.get_object(Bucket=BUCKET_NAME, Key=image_url[len(prefix):])["Body"].read())
+        if not thumb:
+            return
+        table.update_item(
+            Key={"pk": f"SHARE#{share_id}", "sk": "META"},
+            UpdateExpression="SET thumbKey = :t",
+            ConditionExpression="attribute_exists(pk)",
+            ExpressionAttributeValues={":t": thumb_key},
+        )
+        s3.put_object(
+            Bucket=BUCKET_NAME,
+            Key=thumb_key,
+            Body=thumb,
+            ContentType="image/jpeg",
+            CacheControl="public, max-age=31536000, immutable",
+        )
+        table.update_item(
+            Key={"pk": row["pk"], "sk": row["sk"]},
+            UpdateExpression="SET thumb = :u",
+            ConditionExpression="attribute_exists(pk)",
+            ExpressionAttributeValues={":u": f"{PUBLIC_SHARE_CDN_URL}/{thumb_key}"},
+        )
+    except Exception:
+        return
+
+
+def get_feed(cursor: str | None = None, limit: int = FEED_PAGE_SIZE):
+    """
+    Newest-first across day partitions. Each call walks back at most
+    FEED_MAX_DAYS_PER_PAGE days, so empty stretches cost bounded reads;
+    the cursor carries {day, eks} to resume.
+    """
+    if not table:
+        return {"items": [], "nextCursor": None}
+
+    limit = max(1, min(limit, 50))
+    today = datetime.now(timezone.utc).date()
+    oldest = today - timedelta(days=FEED_RETENTION_DAYS)
+
+    state = _decode_cursor(cursor) or {}
+    try:
+        day = datetime.strptime(state.get("day") or today.isoformat(), "%Y-%m-%d").date()
+    except ValueError:
+        day = today
+    eks = state.get("eks")
+
+    now = int(time.time())
+    items = []
+    days_walked = 0
+    while day >= oldest and days_walked < FEED_MAX_DAYS_PER_PAGE:
+        params = {
+            "KeyConditionExpression": Key("pk").eq(_feed_pk(day.isoformat())),
+            "ScanIndexForward": False,
+            "Limit": limit - len(items),
+        }
+        if eks:
+            params["ExclusiveStartKey"] = eks
+        resp = table.query(**params)
+        for row in resp.get("Items", []) or []:
+            if row.get("ttl") is not None and int(row["ttl"]) <= now:
+                continue
+            items.append(
+                {
+                    "shareId": row.get("shareId"),
+                    "shareUrl": f"/share/{row.get('shareId')}",
+                    "image_url": row.get("img"),
+                    "thumb_url": row.get("thumb"),
+                    "prompt": row.get("prompt"),
+                    "aspect_ratio": row.get("ar"),
+                    "createdAt": row.get("createdAt"),
+                }
+            )
+        eks = resp.get("LastEvaluatedKey")
+        if not eks:
+            day -= timedelta(days=1)
+            days_walked += 1
+        if len(items) >= limit:
+            break
+
+    next_cursor = None
+    if eks:
+        next_cursor = _encode_cursor({"day": day.isoformat(), "eks": eks})
+    elif day >= oldest:
+        next_cursor = _encode_cursor({"day": day.isoformat()})
+    return {"items": items, "nextCursor": next_cursor}
+
+
+def handle_get_feed(event):
+    qsp = event.get("queryStringParameters") or {}
+    try:
+        limit = int(qsp.get("limit") or FEED_PAGE_SIZE)
+    except Exception:
+        limit = FEED_PAGE_SIZE
+    try:
+        data = get_feed(cursor=qsp.get("cursor"), limit=limit)
+    except Exception as e:
+        return _resp(500, {"error": str(e) or "Feed failed"})
+    return _resp(200, data, headers={"Cache-Control": FEED_CACHE_CONTROL})
+
+
+def handle_remove_from_feed(event):
+    """Admin moderation: DELETE {"shareId": "..."} drops it from the feed."""
+    if not table:
+        return _resp(500, {"error": "DynamoDB table not configured"})
+    if not _is_admin(event):
+        return _resp(403, {"error": "Forbidden"})
+
+    share_id = (_json_body(event).get("shareId") or "").strip()
+    if not share_id:
+        return _resp(400, {"error": "Missing shareId"})
+
+    share = table.get_item(Key={"pk": f"SHARE#{share_id}", "sk": "META"}).get("Item")
+    if not share or not share.get("feedPk"):
+        return _resp(404, {"error": "Not in feed"})
+
+    try:
+        table.delete_item(Key={"pk": share["feedPk"], "sk": share["feedSk"]})
+        table.update_item(
+            Key={"pk": f"SHARE#{share_id}", "sk": "META"},
+            UpdateExpression="SET feedRemoved = :t REMOVE feedPk, feedSk",
+            ExpressionAttributeValues={":t": True},
+        )
+    except Exception as e:
+        return _resp(500, {"error": f"Failed to remove from feed: {str(e)}"})
+    return {"statusCode": 204, "headers": _headers(), "body": ""}
+
+
+# -------------------------
+# ADMIN USAGE ANALYTICS
+# -------------------------
+def _stats_pk(day: str) -> str:
+    return f"STATS#{day}"
+
+
+def record_usage_best_effort(kind: str, outcome: str, prompt: str = "", credits: int = 0, ts_iso: str | None = None):
+    """
+    kind: generate|edit, outcome: ok|failed|out_of_credits. One ADD on the
+    day's TOTAL row (day of ts_iso, the generation's accept time), plus the
+    prompt's counter and the day's TOP row on success.
+    """
+    if not table:
+        return
+    day = (ts_iso or datetime.now(timezone.utc).isoformat())[:10]
+    ttl = _ttl_epoch(STATS_RETENTION_DAYS)
+    try:
+        update = "ADD #c :one"
+        values = {":one": 1, ":ttl": ttl}
+        if credits:
+            update += ", creditsSpent :cr"
+            values[":cr"] = credits
+        table.update_item(
+            Key={"pk": _stats_pk(day), "sk": "TOTAL"},
+            UpdateExpression=f"{update} SET #ttl = if_not_exists(#ttl, :ttl)",
+            ExpressionAttributeNames={"#c": f"{kind}_{outcome}", "#ttl": "ttl"},
+            ExpressionAttributeValues=values,
+        )
+
+        prompt = _normalize_text(prompt).lower()[:STATS_PROMPT_MAX_CHARS]
+        if outcome == "ok" and prompt:
+            prompt_id = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:16]
+            resp = table.update_item(
+                Key={"pk": _stats_pk(day), "sk": f"PROMPT#{prompt_id}"},
+                UpdateExpression="ADD n :one SET p = if_not_exists(p, :p), #ttl = if_not_exists(#ttl, :ttl)",
+                ExpressionAttributeNames={"#ttl": "ttl"},
+                ExpressionAttributeValues={":one": 1, ":p": prompt, ":ttl": ttl},
+                ReturnValues="UPDATED_NEW",
+            )
+            _bump_top_prompt(day, prompt_id, prompt, int(resp["Attributes"]["n"]), ttl)
+    except Exception:
+        return
+
+
+def _bump_top_prompt(day: str, prompt_id: str, prompt: str, n: int, ttl: int):
+    """
+    Keep the day's TOP row (map t: prompt hash -> {p, n}, at most
+    STATS_TOP_PROMPTS entries) in step with a PROMPT# counter that just
+    reached n. Usually one conditional write: the prompt is listed already or
+    there is room. Otherwise read the row and evict the smallest entry if n
+    beats it; a lost race retries, bounded.
+    """
+    key = {"pk": _stats_pk(day), "sk": "TOP"}
+    entry = {"p": prompt, "n": n}
+    for _ in range(3):
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression="SET #t.#id = :e",
+                ConditionExpression="#t.#id.n < :n OR (attribute_exists(#t) AND attribute_not_exists(#t.#id) AND size(#t) < :cap)",
+                ExpressionAttributeNames={"#t": "t", "#id": prompt_id},
+                ExpressionAttributeValues={":e": entry, ":n": n, ":cap": STATS_TOP_PROMPTS},
+            )
+            return
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+
+        top = (table.get_item(Key=key, ConsistentRead=True).get("Item") or {}).get("t")
+        try:
+            if top is None:
+                # first successful prompt of the day
+                table.put_item(
+                    Item={**key, "t": {prompt_id: entry}, "ttl": ttl},
+                    ConditionExpression="attribute_not_exists(pk)",
+                )
+                return
+            if prompt_id in top:
+                return  # a concurrent write already recorded a count >= n
+            if len(top) < STATS_TOP_PROMPTS:
+                continue  # an entry was evicted since; the fast path fits now
+            low_id, low = min(top.items(), key=lambda kv: int(kv[1]["n"]))
+            if int(low["n"]) >= n:
+                return
+            table.update_item(
+                Key=key,
+                UpdateExpression="REMOVE #t.#low SET #t.#id = :e",
+                ConditionExpression="#t.#low.n = :low AND attribute_not_exists(#t.#id)",
+                ExpressionAttributeNames={"#t": "t", "#low": low_id, "#id": prompt_id},
+                ExpressionAttributeValues={":e": entry, ":low": low["n"]},
+            )
+            return
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+
+
+def _top_prompts(top_row: dict) -> list:
+    top = [{"prompt": e["p"], "count": int(e["n"])} for e in (top_row.get("t") or {}).values()]
+    top.sort(key=lambda t: t["count"], reverse=True)
+    return top
+
+
+def _day_summary(day: str, total: dict) -> dict:
+    out = {"day": day, "creditsSpent": int(total.get("creditsSpent", 0))}
+    ok = failed = 0
+    for kind in ("generate", "edit"):
+        counts = {
+            "ok": int(total.get(f"{kind}_ok", 0)),
+            "failed": int(total.get(f"{kind}_failed", 0)),
+            "outOfCredits": int(total.get(f"{kind}_out_of_credits", 0)),
+        }
+        ok += counts["ok"]
+        failed += counts["failed"]
+        out[kind] = counts
+    out["failureRate"] = round(failed / (ok + failed), 4) if ok + failed else 0.0
+    return out
+
+
+def get_usage_stats(days: int) -> dict:
+    """
+    O(days) reads: one BatchGet over the TOTAL/TOP rows, today included.
+    """
+    today = datetime.now(timezone.utc).date()
+    day_list = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+
+    rows = {}
+    keys = [{"pk": _stats_pk(d), "sk": sk} for d in day_list for sk in ("TOTAL", "TOP")]
+    for i in range(0, len(keys), 100):
+        request = {DDB_TABLE_NAME: {"Keys": keys[i : i + 100]}}
+        for attempt in range(5):
+            resp = ddb.batch_get_item(RequestItems=request)
+            for r in resp.get("Responses", {}).get(DDB_TABLE_NAME, []):
+                rows[(r["pk"], r["sk"])] = r
+            request = resp.get("UnprocessedKeys") or {}
+            if not request:
+                break
+            time.sleep(0.05 * (2**attempt))
+
+    summaries = []
+    merged = {}
+    for day in day_list:
+        total = rows.get((_stats_pk(day), "TOTAL"))
+        if not total:
+            summaries.append(_day_summary(day, {}))
+            continue
+        summaries.append(_day_summary(day, total))
+
+        for t in _top_prompts(rows.get((_stats_pk(day), "TOP")) or {}):
+            merged[t["prompt"]] = merged.get(t["prompt"], 0) + t["count"]
+
+    totals = _day_summary("total", {})
+    totals.pop("day")
+    for d in summaries:
+        totals["creditsSpent"] += d["creditsSpent"]
+        for kind in ("generate", "edit"):
+            for k in totals[kind]:
+                totals[kind][k] += d[kind][k]
+    ok = totals["generate"]["ok"] + totals["edit"]["ok"]
+    failed = totals["generate"]["failed"] + totals["edit"]["failed"]
+    totals["failureRate"] = round(failed / (ok + failed), 4) if ok + failed else 0.0
+
+    # merged from per-day top lists, so counts are exact only for prompts
+    # that made every day's top list
+    top_prompts = sorted(({"prompt": p, "count": n} for p, n in merged.items()), key=lambda t: t["count"], reverse=True)
+    return {"days": summaries, "totals": totals, "topPrompts": top_prompts[:STATS_TOP_PROMPTS]}
+
+
+def handle_admin_stats(event):
+    if not table:
+        return _resp(500, {"error": "DynamoDB table not configured"})
+    if not _is_admin(event):
+        return _resp(403, {"error": "Forbidden"})
+
+    qsp = event.get("queryStringParameters") or {}
+    try:
+        days = int(qsp.get("days") or 7)
+    except Exception:
+        return _resp(400, {"error": "Invalid days"})
+    days = max(1, min(days, STATS_MAX_DAYS))
+
+    try:
+        return _resp(200, get_usage_stats(days))
+    except Exception as e:
+        return _resp(500, {"error": str(e) or "Stats failed"})
+
+
+# -------------------------
+# CREDIT LEDGER
+# -------------------------
+_LEDGER_FIELDS = ("kind", "delta", "ref", "at")
+
+
+def _ledger_row(item: dict) -> dict:
+    return {
+        "kind": item.get("kind"),
+        "delta": int(item.get("delta") or 0),
+        "ref": item.get("ref"),
+        "at": int(item.get("at") or 0),
+    }
+
+
+def _latest_ledger_snapshot(sub: str) -> dict | None:
+    resp = table.query(
+        KeyConditionExpression="pk = :pk AND begins_with(sk, :snap)",
+        ExpressionAttributeValues={":pk": _pk(sub), ":snap": "LEDGERSNAP#"},
+        ScanIndexForward=False,
+        Limit=1,
+    )
+    items = resp.get("Items") or []
+    return items[0] if items else None
+
+
+def _snapshot_out(snap: dict | None) -> dict | None:
+    if not snap:
+        return None
+    return {
+        "entries": int(snap.get("entries") or 0),
+        "totals": {k: int(v) for k, v in (snap.get("totals") or {}).items()},
+        "net": int(snap.get("net") or 0),
+        "lifetimeNet": int(snap.get("lifetimeNet") or 0),
+        "fromAt": int(snap.get("fromAt") or 0),
+        "throughAt": int(snap.get("throughAt") or 0),
+        "createdAt": int(snap.get("createdAt") or 0),
+    }
+
+
+def get_ledger(sub: str, limit: int = 50, cursor: str | None = None) -> dict:
+    """Newest-first ledger entries; the first page also carries the latest snapshot."""
+    limit = max(1, min(limit, 100))
+    eks = _decode_cursor(cursor)
+    if eks and eks.get("pk") != _pk(sub):
+        eks = None
+
+    params = {
+        "KeyConditionExpression": "pk = :pk AND begins_with(sk, :ledger)",
+        "ExpressionAttributeValues": {":pk": _pk(sub), ":ledger": "LEDGER#"},
+        "ProjectionExpression": ", ".join(f"#{f}" for f in _LEDGER_FIELDS),
+        "ExpressionAttributeNames": {f"#{f}": f for f in _LEDGER_FIELDS},
+        "Limit": limit,
+        "ScanIndexForward": False,
+    }
+    if eks:
+        params["ExclusiveStartKey"] = eks
+
+    resp = table.query(**params)
+    lek = resp.get("LastEvaluatedKey")
+    out = {
+        "items": [_ledger_row(it) for it in resp.get("Items", [])],
+        "nextCursor": _encode_cursor(lek) if lek else None,
+    }
+    if not cursor:
+        out["snapshot"] = _snapshot_out(_latest_ledger_snapshot(sub))
+    return out
+
+
+def handle_get_ledger(event, sub: str):
+    if not table:
+        return _resp(500, {"error": "DynamoDB table not configured"})
+    qsp = event.get("queryStringParameters") or {}
+    try:
+        limit = int(qsp.get("limit") or 50)
+    except Exception:
+        limit = 50
+    return _resp(200, get_ledger(sub, limit=limit, cursor=qsp.get("cursor")))
+
+
+def _ledger_entries_before(sub: str, cutoff_sk: str) -> list:
+    # "LEDGER#..." sorts below "LEDGERSNAP#...", so snapshots are never included
+    items, eks = [], None
+    while True:
+        params = {
+            "KeyConditionExpression": "pk = :pk AND sk BETWEEN :lo AND :hi",
+            "ExpressionAttributeValues": {":pk": _pk(sub), ":lo": "LEDGER#", ":hi": cutoff_sk},
+            "ConsistentRead": True,
+        }
+        if eks:
+            params["ExclusiveStartKey"] = eks
+        resp = table.query(**params)
+        items.extend(resp.get("Items", []))
+        eks = resp.get("LastEvaluatedKey")
+        if not eks:
+            return items
+
+
+def compact_ledger(sub: str, now: int | None = None) -> dict:
+    """
+    Fold LEDGER# entries older than LEDGER_RETAIN_DAYS into one LEDGERSNAP# row.
+    Order is archive (gzip JSONL to S3) -> snapshot -> delete, all in the same
+    run, so a crash never loses an entry. Entries at or below the latest
+    snapshot's throughSk are only left over when a run died between its
+    snapshot and the delete; they're already folded in, so the next run
+    deletes them without counting them again ("stale").
+    """
+    now = now or int(time.time())
+    cutoff_sk = f"LEDGER#{(now - LEDGER_RETAIN_DAYS * 86400) * 1000:013d}"
+
+    prev = _latest_ledger_snapshot(sub)
+    through = (prev or {}).get("throughSk") or ""
+    entries = _ledger_entries_before(sub, cutoff_sk)
+    stale = [e for e in entries if e["sk"] <= through]
+    fresh = [e for e in entries if e["sk"] > through]
+
+    report = {"entries": len(fresh), "stale": len(stale)}
+    if fresh:
+        first, last = fresh[0]["sk"][len("LEDGER#"):], fresh[-1]["sk"][len("LEDGER#"):]
+        archive_key = f"{LEDGER_ARCHIVE_PREFIX}{sub}/{first.replace('#', '-')}_{last.replace('#', '-')}.jsonl.gz"
+        body = "\n".join(_dumps({"sk": e["sk"], **_ledger_row(e)}) for e in fresh) + "\n"
+        s3.put_object(
+            Bucket=BUCKET_NAME,
+            Key=archive_key,
+            Body=gzip.compress(body.encode("utf-8")),
+            ContentType="application/x-ndjson",
+            ContentEncoding="gzip",
+        )
+
+        totals = {}
+        for e in fresh:
+            totals[e["kind"]] = totals.get(e["kind"], 0) + int(e.get("delta") or 0)
+        net = sum(totals.values())
+        table.put_item(
+            Item={
+                "pk": _pk(sub),
+                "sk": f"LEDGERSNAP#{last}",
+                "entries": len(fresh),
+                "totals": totals,
+                "net": net,
+                "lifetimeNet": int((prev or {}).get("lifetimeNet") or 0) + net,
+                "fromSk": fresh[0]["sk"],
+                "throughSk": fresh[-1]["sk"],
+                "fromAt": int(fresh[0].get("at") or 0),
+                "throughAt": int(fresh[-1].get("at") or 0),
+                "archiveKey": archive_key,
+                "createdAt": now,
+            }
+        )
+        report["archiveKey"] = archive_key
+
+    if entries:
+        with table.batch_writer() as bw:
+            for e in entries:
+                bw.delete_item(Key={"pk": e["pk"], "sk": e["sk"]})
+        table.update_item(
+            Key=_credits_key(sub),
+            UpdateExpression="ADD ledgerCount :n",
+            ExpressionAttributeValues={":n": -len(entries)},
+        )
+    return report
+
+
+def run_ledger_compaction(event: dict, context=None):
+    """
+    Scheduled: compact every user whose balance row counts at least
+    LEDGER_COMPACT_MIN_ENTRIES live ledger entries, found with one Query per
+    ledger-counts shard. When the remaining time runs low it hands its place
+    ({"shard", "cursor", "now"}) to a fresh invocation, so a large backlog
+    finishes over several runs instead of stopping at the timeout.
+    {"tagExisting": true} (once, by hand) gives balance rows written before
+    the index their ledgerShard, which is a Scan.
+    """
+    if not table:
+        return {"error": "DynamoDB table not configured"}
+
+    if event.get("tagExisting"):
+        return _tag_ledger_shards()
+
+    function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    min_entries = int(event.get("minEntries") or LEDGER_COMPACT_MIN_ENTRIES)
+    # one cutoff for the whole run, continuations included
+    now = int(event.get("now") or time.time())
+    start = int(event.get("shard") or 0)
+    report = {"users": 0, "compacted": 0, "stale": 0, "failed": 0}
+
+    def _handoff(shard, eks) -> bool:
+        remaining = context.get_remaining_time_in_millis() if context else None
+        if remaining is None or remaining >= LEDGER_COMPACT_MIN_REMAINING_MS or not function_name:
+            return False
+        payload = {"source": LEDGER_EVENT_SOURCE, "minEntries": min_entries, "now": now, "shard": shard}
+        if eks:
+            payload["cursor"] = _encode_cursor(eks)
+        _get_lambda_client().invoke(
+            FunctionName=function_name, InvocationType="Event", Payload=_dumps(payload).encode("utf-8")
+        )
+        return True
+
+    for shard in range(start, LEDGER_INDEX_SHARDS):
+        # eks: position after the last user handled (a compacted user can
+        # stay above the threshold, so the cursor is what moves a run on)
+        eks = _decode_cursor(event.get("cursor")) if shard == start else None
+        while True:
+            params = {
+                "IndexName": LEDGER_INDEX_NAME,
+                "KeyConditionExpression": Key("ledgerShard").eq(shard) & Key("ledgerCount").gte(min_entries),
+            }
+            if eks:
+                params["ExclusiveStartKey"] = eks
+            resp = table.query(**params)
+            for row in resp.get("Items", []) or []:
+                if _handoff(shard, eks):
+                    print(_dumps({"ledger": "compaction", **report, "done": False}))
+                    return {**report, "done": False}
+                sub = row["pk"][len("USER#"):]
+                report["users"] += 1
+                try:
+                    done = compact_ledger(sub, now=now)
+                    report["compacted"] += done["entries"]
+                    report["stale"] += done["stale"]
+                except Exception as e:
+                    report["failed"] += 1
+                    print(f"ledger compaction failed for {sub}: {e}")
+                eks = {k: row[k] for k in ("pk", "sk", "ledgerShard", "ledgerCount")}
+            eks = resp.get("LastEvaluatedKey")
+            if not eks:
+                break
+
+    print(_dumps({"ledger": "compaction", **report, "done": True}))
+    return {**report, "done": True}
+
+
+def _tag_ledger_shards() -> dict:
+    tagged = 0
+    eks = None
+    while True:
+        params = {
+            "FilterExpression": "sk = :credits AND attribute_exists(ledgerCount) AND attribute_not_exists(ledgerShard)",
+            "ExpressionAttributeValues": {":credits": "CREDITS"},
+            "ProjectionExpression": "pk",
+        }
+        if eks:
+            params["ExclusiveStartKey"] = eks
+        resp = table.scan(**params)
+        for row in resp.get("Items", []) or []:
+            table.update_item(
+                Key={"pk": row["pk"], "sk": "CREDITS"},
+                UpdateExpression="SET ledgerShard = if_not_exists(ledgerShard, :shard)",
+                ExpressionAttributeValues={":shard": _ledger_shard(row["pk"][len("USER#"):])},
+            )
+            tagged += 1
+        eks = resp.get("LastEvaluatedKey")
+        if not eks:
+            break
+    print(_dumps({"ledger": "tagExisting", "tagged": tagged}))
+    return {"tagged": tagged}
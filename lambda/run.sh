@@ -0,0 +1,4 @@
+#!/bin/sh
+# Handler of the streaming function: the Lambda Web Adapter layer runs this
+# and proxies function URL requests to the server (see stream_server.py).
+exec python3 stream_server.py
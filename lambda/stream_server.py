@@ -0,0 +1,143 @@
+"""
+Streaming front end for the generate/edit endpoints (Lambda function URL,
+invoke mode RESPONSE_STREAM).
+
+The python runtime can't stream a response body itself, so this function
+runs behind the Lambda Web Adapter layer: run.sh starts this HTTP server and
+the adapter forwards each function URL request to it, streaming the
+response back as it's written. Every run_pipeline() event goes out as its
+own chunk the moment it's produced:
+
+    POST <function url>/moviePosterImageGenerator       text-to-image
+    POST <function url>/moviePosterImageGenerator/edit  image-to-image
+
+Bodies are the same as on the API Gateway routes; the response is always
+NDJSON (bad input is still a plain JSON 4xx, before anything is reserved).
+
+A function URL has no JWT authorizer in front of it, so the Cognito access
+token ("Authorization: Bearer") is verified here with PyJWT (deps layer,
+lambda/requirements.txt): RS256 against the pool's JWKS, issuer, expiry,
+token_use "access" and app client. Its claims go where the authorizer puts
+them, so credits, plans and history behave exactly as on the buffered route.
+"""
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import jwt
+
+import lambda_function as lf
+
+PORT = int(os.environ.get("AWS_LWA_PORT") or os.environ.get("PORT") or "8080")
+COGNITO_ISSUER = os.environ.get("COGNITO_ISSUER", "").rstrip("/")
+COGNITO_CLIENT_ID = os.environ.get("COGNITO_CLIENT_ID", "")
+JWKS_TTL_SECONDS = 3600
+
+# Caches the JWKS; an unknown kid refetches it once (key rotation)
+_jwks_client = (
+    jwt.PyJWKClient(f"{COGNITO_ISSUER}/.well-known/jwks.json", cache_keys=True, lifespan=JWKS_TTL_SECONDS, timeout=5)
+    if COGNITO_ISSUER
+    else None
+)
+
+
+def verify_jwt(token: str) -> dict:
+    """Claims of a valid Cognito access token for this app client; ValueError otherwise."""
+    if _jwks_client is None:
+        raise ValueError("COGNITO_ISSUER not configured")
+    try:
+        key = _jwks_client.get_signing_key_from_jwt(token)
+        claims = jwt.decode(
+            token,
+            key.key,
+            algorithms=["RS256"],
+            issuer=COGNITO_ISSUER,
+            options={"require": ["exp", "iss", "sub", "token_use", "client_id"]},
+        )
+    except jwt.PyJWTError as e:
+        raise ValueError(str(e) or type(e).__name__)
+    # an ID token is signed by the same keys; only access tokens authorize calls
+    if claims["token_use"] != "access":
+        raise ValueError("not an access token")
+    if not COGNITO_CLIENT_ID or claims["client_id"] != COGNITO_CLIENT_ID:
+        raise ValueError("wrong app client")
+    return claims
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass  # the pipeline logs its own timings
+
+    def claims(self) -> dict:
+        scheme, _, token = (self.headers.get("Authorization") or "").partition(" ")
+        if scheme.lower() != "bearer" or not token.strip():
+            raise ValueError("missing bearer token")
+        return verify_jwt(token.strip())
+
+    def _send_json(self, status: int, body: str):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        # Web Adapter readiness check
+        self._send_json(200, lf._dumps({"ok": True}))
+
+    def do_POST(self):
+        try:
+            claims = self.claims()
+        except ValueError as e:
+            self._send_json(401, lf._dumps({"error": f"Unauthorized ({e})"}))
+            return
+
+        url = urlparse(self.path)
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        event = {
+            "rawPath": url.path,
+            "rawQueryString": url.query,
+            "headers": {k.lower(): v for k, v in self.headers.items()},
+            "queryStringParameters": dict(parse_qsl(url.query)) or None,
+            "requestContext": {
+                "http": {"method": "POST", "path": url.path},
+                "authorizer": {"jwt": {"claims": claims}},
+            },
+            "body": raw.decode("utf-8") if raw else None,
+        }
+        mode = "image-to-image" if url.path.rstrip("/").endswith("/edit") else "text-to-image"
+
+        error, events = lf.start_generation(event, lf._json_body(event), claims["sub"], mode, inline=True)
+        if error:
+            self._send_json(error["statusCode"], error["body"])
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        connected = True
+        for ev in events:
+            if not connected:
+                continue  # client went away: finish the run so it's stored and recorded
+            try:
+                self._chunk((lf._dumps(ev) + "\n").encode("utf-8"))
+            except OSError:
+                connected = False
+        if connected:
+            self._chunk(b"")
+
+
+def main():
+    ThreadingHTTPServer(("127.0.0.1", PORT), StreamHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,51 @@
 "use client";
 
+import { useEffect, useState } from "react";
 import { useSession } from "next-auth/react";
 
+type Counts = { ok: number; failed: number; outOfCredits: number };
+
+type DayStats = {
+  day: string;
+  creditsSpent: number;
+  generate: Counts;
+  edit: Counts;
+  failureRate: number;
+};
+
+type StatsResponse = {
+  days: DayStats[];
+  totals: Omit<DayStats, "day">;
+  topPrompts: { prompt: string; count: number }[];
+};
+
+function pct(rate: number) {
+  return `${(rate * 100).toFixed(1)}%`;
+}
+
 export default function AdminPage() {
   const { data: session, status } = useSession();
+  const isAdmin = session?.groups?.includes("admin");
+
+  const [days, setDays] = useState(7);
+  const [stats, setStats] = useState<StatsResponse | null>(null);
+  const [error, setError] = useState<string | null>(null);
+
+  useEffect(() => {
+    if (!isAdmin) return;
+    let cancelled = false;
+    setError(null);
+    fetch(`/api/admin/stats?days=${days}`, { method: "GET" })
+      .then(async (res) => {
+        const data = await res.json().catch(() => ({}));
+        if (!res.ok) throw new Error(data?.error || `Stats failed (${res.status})`);
+        if (!cancelled) setStats(data);
+      })
+      .catch((e) => !cancelled && setError(e?.message || String(e)));
+    return () => {
+      cancelled = true;
+    };
+  }, [isAdmin, days]);
 
   if (status === "loading") return <div className="p-6">Loading…</div>;
 
@@ -16,8 +58,6 @@ export default function AdminPage() {
     );
   }
 
-  const isAdmin = session?.groups?.includes("admin");
-
   if (!isAdmin) {
     return (
       <div className="p-6">
@@ -31,12 +71,85 @@ export default function AdminPage() {
   }
 
   return (
-    <div className="p-6">
-      <h1 className="text-xl font-semibold">Admin (Protected)</h1>
-      <p>If you can see this, you are in the admin group.</p>
-      <p className="mt-2 text-sm opacity-70">
-        Groups: {(session.groups ?? []).join(", ")}
-      </p>
+    <div className="p-6 space-y-6">
+      <div className="flex items-center justify-between gap-3">
+        <h1 className="text-xl font-semibold">Usage</h1>
+        <select
+          className="rounded-lg border border-border bg-surface px-2 py-1 text-sm"
+          value={days}
+          onChange={(e) => setDays(Number(e.target.value))}
+        >
+          <option value={7}>Last 7 days</option>
+          <option value={30}>Last 30 days</option>
+          <option value={90}>Last 90 days</option>
+        </select>
+      </div>
+
+      {error && <p className="text-sm text-danger">{error}</p>}
+      {!stats && !error && <p className="text-sm opacity-70">Loading…</p>}
+
+      {stats && (
+        <>
+          <div className="grid gap-3 sm:grid-cols-4">
+            <div className="rounded-xl border border-border bg-surface p-4">
+              <div className="text-xs opacity-70">Generations</div>
+              <div className="text-2xl font-semibold">{stats.totals.generate.ok}</div>
+            </div>
+            <div className="rounded-xl border border-border bg-surface p-4">
+              <div className="text-xs opacity-70">Edits</div>
+              <div className="text-2xl font-semibold">{stats.totals.edit.ok}</div>
+            </div>
+            <div className="rounded-xl border border-border bg-surface p-4">
+              <div className="text-xs opacity-70">Failure rate</div>
+              <div className="text-2xl font-semibold">{pct(stats.totals.failureRate)}</div>
+            </div>
+            <div className="rounded-xl border border-border bg-surface p-4">
+              <div className="text-xs opacity-70">Credits spent</div>
+              <div className="text-2xl font-semibold">{stats.totals.creditsSpent}</div>
+            </div>
+          </div>
+
+          <table className="w-full text-sm">
+            <thead className="text-left opacity-70">
+              <tr>
+                <th className="py-1">Day</th>
+                <th>Generate ok / failed</th>
+                <th>Edit ok / failed</th>
+                <th>Out of credits</th>
+                <th>Failure rate</th>
+                <th>Credits</th>
+              </tr>
+            </thead>
+            <tbody>
+              {stats.days.map((d) => (
+                <tr key={d.day} className="border-t border-border">
+                  <td className="py-1">{d.day}</td>
+                  <td>
+                    {d.generate.ok} / {d.generate.failed}
+                  </td>
+                  <td>
+                    {d.edit.ok} / {d.edit.failed}
+                  </td>
+                  <td>{d.generate.outOfCredits + d.edit.outOfCredits}</td>
+                  <td>{pct(d.failureRate)}</td>
+                  <td>{d.creditsSpent}</td>
+                </tr>
+              ))}
+            </tbody>
+          </table>
+
+          <div>
+            <h2 className="mb-2 font-semibold">Top prompts</h2>
+            <ol className="list-decimal space-y-1 pl-5 text-sm">
+              {stats.topPrompts.map((t) => (
+                <li key={t.prompt}>
+                  {t.prompt} <span className="opacity-70">({t.count})</span>
+                </li>
+              ))}
+            </ol>
+          </div>
+        </>
+      )}
     </div>
   );
 }
@@ -0,0 +1,45 @@
+import { NextResponse } from "next/server";
+import { getToken } from "next-auth/jwt";
+
+// Admin usage analytics: ?days=1..90 (admin group enforced upstream)
+export async function GET(req: Request) {
+  try {
+    const token = await getToken({ req: req as any });
+    const accessToken = (token as any)?.accessToken;
+
+    if (!accessToken) {
+      return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+    }
+
+    const apiBase = process.env.API_BASE_URL;
+    if (!apiBase) {
+      return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+    }
+
+    const { searchParams } = new URL(req.url);
+    const upstreamUrl = new URL(`${apiBase}/moviePosterImageGenerator/admin/stats`);
+    upstreamUrl.searchParams.set("days", searchParams.get("days") ?? "7");
+
+    const upstream = await fetch(upstreamUrl.toString(), {
+      method: "GET",
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+      },
+      cache: "no-store",
+    });
+
+    const text = await upstream.text();
+    const contentType = upstream.headers.get("content-type") || "application/json";
+
+    return new NextResponse(text, {
+      status: upstream.status,
+      headers: { "Content-Type": contentType },
+    });
+  } catch (e: any) {
+    console.error("GET /api/admin/stats failed:", e);
+    return NextResponse.json(
+      { error: "Admin stats proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
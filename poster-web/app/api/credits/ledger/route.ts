@@ -0,0 +1,47 @@
+import { NextResponse } from "next/server";
+import { getToken } from "next-auth/jwt";
+
+// Own credit ledger: ?limit=1..100&cursor=... (newest first; first page includes the latest snapshot)
+export async function GET(req: Request) {
+  try {
+    const token = await getToken({ req: req as any });
+    const accessToken = (token as any)?.accessToken;
+
+    if (!accessToken) {
+      return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+    }
+
+    const apiBase = process.env.API_BASE_URL;
+    if (!apiBase) {
+      return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+    }
+
+    const { searchParams } = new URL(req.url);
+    const upstreamUrl = new URL(`${apiBase}/moviePosterImageGenerator/credits/ledger`);
+    upstreamUrl.searchParams.set("limit", searchParams.get("limit") ?? "50");
+    const cursor = searchParams.get("cursor");
+    if (cursor) upstreamUrl.searchParams.set("cursor", cursor);
+
+    const upstream = await fetch(upstreamUrl.toString(), {
+      method: "GET",
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+      },
+      cache: "no-store",
+    });
+
+    const text = await upstream.text();
+    const contentType = upstream.headers.get("content-type") || "application/json";
+
+    return new NextResponse(text, {
+      status: upstream.status,
+      headers: { "Content-Type": contentType },
+    });
+  } catch (e: any) {
+    console.error("GET /api/credits/ledger failed:", e);
+    return NextResponse.json(
+      { error: "Credit ledger proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,39 @@
+import { NextResponse } from "next/server";
+
+// Public gallery feed (no auth). Upstream sets Cache-Control; pass it through
+// so the CDN in front of Next can cache pages too.
+export async function GET(req: Request) {
+  try {
+    const apiBase = process.env.API_BASE_URL;
+    if (!apiBase) {
+      return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+    }
+
+    const { searchParams } = new URL(req.url);
+    const upstreamUrl = new URL(`${apiBase}/moviePosterImageGenerator/feed`);
+    const limit = searchParams.get("limit");
+    const cursor = searchParams.get("cursor");
+    if (limit) upstreamUrl.searchParams.set("limit", limit);
+    if (cursor) upstreamUrl.searchParams.set("cursor", cursor);
+
+    const upstream = await fetch(upstreamUrl.toString(), {
+      method: "GET",
+      next: { revalidate: 60 },
+    });
+
+    const text = await upstream.text();
+    const headers: Record<string, string> = {
+      "Content-Type": upstream.headers.get("content-type") || "application/json",
+    };
+    const cacheControl = upstream.headers.get("cache-control");
+    if (cacheControl) headers["Cache-Control"] = cacheControl;
+
+    return new NextResponse(text, { status: upstream.status, headers });
+  } catch (e: any) {
+    console.error("GET /api/feed failed:", e);
+    return NextResponse.json(
+      { error: "Feed proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,50 @@
+import { NextResponse } from "next/server";
+import { getToken } from "next-auth/jwt";
+
+// Bulk delete/restore: body { action: "delete" | "restore", sks: string[], purge?: boolean }
+export async function POST(req: Request) {
+  try {
+    const token = await getToken({ req: req as any });
+    const accessToken = (token as any)?.accessToken;
+
+    if (!accessToken) {
+      return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+    }
+
+    const body = await req.json().catch(() => ({}));
+    const action = body?.action;
+    const sks = body?.sks;
+
+    if (!Array.isArray(sks) || sks.length === 0) {
+      return NextResponse.json({ error: "Missing sks" }, { status: 400 });
+    }
+
+    const apiBase = process.env.API_BASE_URL;
+    if (!apiBase) {
+      return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+    }
+
+    const upstream = await fetch(`${apiBase}/moviePosterImageGenerator/history/bulk`, {
+      method: "POST",
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ action, sks, purge: body?.purge === true }),
+      cache: "no-store",
+    });
+
+    const text = await upstream.text();
+    const contentType = upstream.headers.get("content-type") || "application/json";
+    return new NextResponse(text, {
+      status: upstream.status,
+      headers: { "Content-Type": contentType },
+    });
+  } catch (e: any) {
+    console.error("POST /api/history/bulk failed:", e);
+    return NextResponse.json(
+      { error: "Bulk proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
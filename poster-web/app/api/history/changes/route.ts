@@ -0,0 +1,49 @@
+import { NextResponse } from "next/server";
+import { getToken } from "next-auth/jwt";
+
+// Incremental history sync: ?since=<syncToken | nextToken>
+export async function GET(req: Request) {
+  try {
+    const token = await getToken({ req: req as any });
+    const accessToken = (token as any)?.accessToken;
+
+    if (!accessToken) {
+      return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+    }
+
+    const apiBase = process.env.API_BASE_URL;
+    if (!apiBase) {
+      return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+    }
+
+    const since = new URL(req.url).searchParams.get("since");
+    if (!since) {
+      return NextResponse.json({ error: "Missing since" }, { status: 400 });
+    }
+
+    const upstreamUrl = new URL(`${apiBase}/moviePosterImageGenerator/history/changes`);
+    upstreamUrl.searchParams.set("since", since);
+
+    const upstream = await fetch(upstreamUrl.toString(), {
+      method: "GET",
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+      },
+      cache: "no-store",
+    });
+
+    const text = await upstream.text();
+    const contentType = upstream.headers.get("content-type") || "application/json";
+
+    return new NextResponse(text, {
+      status: upstream.status,
+      headers: { "Content-Type": contentType },
+    });
+  } catch (e: any) {
+    console.error("GET /api/history/changes failed:", e);
+    return NextResponse.json(
+      { error: "History changes proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,67 @@
+import { NextResponse } from "next/server";
+import { getToken } from "next-auth/jwt";
+
+async function forward(req: Request, init: RequestInit, search = "") {
+  const token = await getToken({ req: req as any });
+  const accessToken = (token as any)?.accessToken;
+
+  if (!accessToken) {
+    return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+  }
+
+  const apiBase = process.env.API_BASE_URL;
+  if (!apiBase) {
+    return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+  }
+
+  const upstream = await fetch(
+    `${apiBase}/moviePosterImageGenerator/history/export${search}`,
+    {
+      ...init,
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+        "Content-Type": "application/json",
+      },
+      cache: "no-store",
+    }
+  );
+
+  const text = await upstream.text();
+  const contentType = upstream.headers.get("content-type") || "application/json";
+  return new NextResponse(text, {
+    status: upstream.status,
+    headers: { "Content-Type": contentType },
+  });
+}
+
+// Start an export: body { sks?: string[] } (omit sks to export everything)
+export async function POST(req: Request) {
+  try {
+    const body = await req.json().catch(() => ({}));
+    const sks = Array.isArray(body?.sks) ? body.sks : undefined;
+    return await forward(req, { method: "POST", body: JSON.stringify(sks ? { sks } : {}) });
+  } catch (e: any) {
+    console.error("POST /api/history/export failed:", e);
+    return NextResponse.json(
+      { error: "Export proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
+
+// Poll an export job: ?jobId=...
+export async function GET(req: Request) {
+  try {
+    const jobId = new URL(req.url).searchParams.get("jobId");
+    if (!jobId) {
+      return NextResponse.json({ error: "Missing jobId" }, { status: 400 });
+    }
+    return await forward(req, { method: "GET" }, `?jobId=${encodeURIComponent(jobId)}`);
+  } catch (e: any) {
+    console.error("GET /api/history/export failed:", e);
+    return NextResponse.json(
+      { error: "Export proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
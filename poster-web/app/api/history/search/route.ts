@@ -0,0 +1,53 @@
+import { NextResponse } from "next/server";
+import { getToken } from "next-auth/jwt";
+
+// Prompt search: ?q=...&limit=...&cursor=...
+export async function GET(req: Request) {
+  try {
+    const token = await getToken({ req: req as any });
+    const accessToken = (token as any)?.accessToken;
+
+    if (!accessToken) {
+      return NextResponse.json({ items: [], nextCursor: null }, { status: 200 });
+    }
+
+    const apiBase = process.env.API_BASE_URL;
+    if (!apiBase) {
+      return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+    }
+
+    const { searchParams } = new URL(req.url);
+    const q = searchParams.get("q");
+    if (!q) {
+      return NextResponse.json({ error: "Missing q" }, { status: 400 });
+    }
+
+    const upstreamUrl = new URL(`${apiBase}/moviePosterImageGenerator/history/search`);
+    upstreamUrl.searchParams.set("q", q);
+    upstreamUrl.searchParams.set("limit", searchParams.get("limit") ?? "20");
+    const cursor = searchParams.get("cursor");
+    if (cursor) upstreamUrl.searchParams.set("cursor", cursor);
+
+    const upstream = await fetch(upstreamUrl.toString(), {
+      method: "GET",
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+      },
+      cache: "no-store",
+    });
+
+    const text = await upstream.text();
+    const contentType = upstream.headers.get("content-type") || "application/json";
+
+    return new NextResponse(text, {
+      status: upstream.status,
+      headers: { "Content-Type": contentType },
+    });
+  } catch (e: any) {
+    console.error("GET /api/history/search failed:", e);
+    return NextResponse.json(
+      { error: "History search proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,41 @@
+import { NextResponse } from "next/server";
+import { getToken } from "next-auth/jwt";
+
+// Prompt preset catalog (id, label, aspect_ratio, seed_policy)
+export async function GET(req: Request) {
+  try {
+    const token = await getToken({ req: req as any });
+    const accessToken = (token as any)?.accessToken;
+
+    if (!accessToken) {
+      return NextResponse.json({ presets: [] }, { status: 200 });
+    }
+
+    const apiBase = process.env.API_BASE_URL;
+    if (!apiBase) {
+      return NextResponse.json({ error: "Missing API_BASE_URL" }, { status: 500 });
+    }
+
+    const upstream = await fetch(`${apiBase}/moviePosterImageGenerator/presets`, {
+      method: "GET",
+      headers: {
+        Authorization: `Bearer ${accessToken}`,
+      },
+      cache: "no-store",
+    });
+
+    const text = await upstream.text();
+    const contentType = upstream.headers.get("content-type") || "application/json";
+
+    return new NextResponse(text, {
+      status: upstream.status,
+      headers: { "Content-Type": contentType },
+    });
+  } catch (e: any) {
+    console.error("GET /api/presets failed:", e);
+    return NextResponse.json(
+      { error: "Presets proxy failed", detail: e?.message || String(e) },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,38 @@
+"""
+GET /history/changes must return rows in the same shape as GET /history.
+The changes GSI only projects its INCLUDE list, so an attribute missing
+there silently drops out of the change feed.
+"""
+import os
+import re
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from _lambda import load_lambda  # noqa: E402
+from _local_aws import CHANGES_INCLUDE, local_aws  # noqa: E402
+
+
+def test_local_changes_index_matches_terraform():
+    with open(os.path.join(ROOT, "infra", "modules", "poster_api", "main.tf")) as f:
+        tf = f.read()
+    block = re.search(r'name\s*=\s*"changes".*?non_key_attributes\s*=\s*\[(.*?)\]', tf, re.S).group(1)
+    assert sorted(re.findall(r'"([^"]+)"', block)) == sorted(CHANGES_INCLUDE)
+
+
+def test_changes_feed_returns_preset():
+    with local_aws() as env:
+        lf = load_lambda(**env)
+        lf.write_history_best_effort(
+            "u1", "2026-10-19T12:00:00+00:00", "r1", "a lighthouse", "3:4", "png", "SUCCESS",
+            s3_key="generated/r1.png", preset_id="cinematic",
+        )
+
+        changed = lf.get_history_changes("u1", lf._encode_cursor({"since": 0}))["items"]
+        listed = lf.get_history("u1")["items"]
+
+        assert [it["preset"] for it in changed] == ["cinematic"]
+        assert {k: v for k, v in changed[0].items() if k != "presigned_url"} == {
+            k: v for k, v in listed[0].items() if k != "presigned_url"
+        }
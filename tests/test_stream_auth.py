@@ -0,0 +1,91 @@
+"""
+stream_server.verify_jwt: the function URL has no authorizer in front of it,
+so only a valid Cognito access token for this app client may get through.
+"""
+import importlib
+import json
+import os
+import sys
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from _lambda import load_lambda  # noqa: E402
+
+ISSUER = "https://cognito-idp.us-east-2.amazonaws.com/us-east-2_test"
+CLIENT_ID = "app-client"
+KID = "k1"
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048), rsa.generate_private_key(
+        public_exponent=65537, key_size=2048
+    )
+
+
+@pytest.fixture(scope="module")
+def ss(keys):
+    load_lambda(COGNITO_ISSUER=ISSUER, COGNITO_CLIENT_ID=CLIENT_ID)
+    import stream_server
+
+    stream_server = importlib.reload(stream_server)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(keys[0].public_key()))
+    stream_server._jwks_client.fetch_data = lambda: {"keys": [{**jwk, "kid": KID, "alg": "RS256", "use": "sig"}]}
+    return stream_server
+
+
+def _token(key, **overrides):
+    claims = {
+        "sub": "u1",
+        "iss": ISSUER,
+        "exp": int(time.time()) + 600,
+        "token_use": "access",
+        "client_id": CLIENT_ID,
+        "cognito:groups": ["plan-pro"],
+    }
+    claims.update(overrides)
+    return jwt.encode({k: v for k, v in claims.items() if v is not None}, key, algorithm="RS256", headers={"kid": KID})
+
+
+def test_access_token_is_accepted(ss, keys):
+    claims = ss.verify_jwt(_token(keys[0]))
+    assert claims["sub"] == "u1" and claims["cognito:groups"] == ["plan-pro"]
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        # an ID token for the same app client: aud instead of client_id
+        {"token_use": "id", "aud": CLIENT_ID, "client_id": None},
+        {"token_use": "id"},
+        {"client_id": "other-client"},
+        {"iss": "https://cognito-idp.us-east-2.amazonaws.com/us-east-2_other"},
+        {"exp": int(time.time()) - 60},
+        {"sub": None},
+    ],
+)
+def test_wrong_claims_are_rejected(ss, keys, overrides):
+    with pytest.raises(ValueError):
+        ss.verify_jwt(_token(keys[0], **overrides))
+
+
+def test_foreign_signature_is_rejected(ss, keys):
+    with pytest.raises(ValueError):
+        ss.verify_jwt(_token(keys[1]))
+
+
+def test_unsigned_and_hmac_tokens_are_rejected(ss):
+    claims = {"sub": "u1", "iss": ISSUER, "exp": int(time.time()) + 600, "token_use": "access", "client_id": CLIENT_ID}
+    for token in (
+        jwt.encode(claims, None, algorithm="none", headers={"kid": KID}),
+        jwt.encode(claims, "s" * 32, algorithm="HS256", headers={"kid": KID}),
+        "not.a.token",
+    ):
+        with pytest.raises(ValueError):
+            ss.verify_jwt(token)
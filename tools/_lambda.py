@@ -0,0 +1,24 @@
+"""
+Import the Lambda module for local tooling (benchmarks, dev server).
+
+The Lambda reads its config from env vars at import time, so set harmless
+defaults before importing it. Nothing here is shipped in the Lambda zip.
+"""
+import os
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+
+
+def load_lambda(**env):
+    os.environ.setdefault("BUCKET_NAME", "local-bucket")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+    for k, v in env.items():
+        os.environ[k] = str(v)
+
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+
+    import lambda_function
+
+    return lambda_function
@@ -0,0 +1,97 @@
+"""
+In-process AWS stand-ins (moto) shaped like infra/modules/poster_api.
+
+    from _local_aws import local_aws
+    with local_aws() as env:          # starts moto, creates bucket + table
+        lf = load_lambda(**env)       # import the Lambda against it
+
+Needs the dev requirements in tools/requirements.txt.
+"""
+import contextlib
+import os
+
+import boto3
+from moto import mock_aws
+
+REGION = "us-east-2"
+BUCKET = "local-bucket"
+TABLE = "poster-app-local"
+# non_key_attributes of the "changes" GSI in aws_dynamodb_table.app
+CHANGES_INCLUDE = [
+    "v", "st", "p", "ar", "of", "k", "em", "ps", "featured", "deleted",
+    "status", "createdAt", "prompt", "aspect_ratio", "output_format", "s3Key", "errorMessage",
+]
+
+
+def create_table(name: str = TABLE, region: str = REGION):
+    # keep in sync with aws_dynamodb_table.app
+    ddb = boto3.client("dynamodb", region_name=region)
+    ddb.create_table(
+        TableName=name,
+        BillingMode="PAY_PER_REQUEST",
+        KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}, {"AttributeName": "sk", "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "pk", "AttributeType": "S"},
+            {"AttributeName": "sk", "AttributeType": "S"},
+            {"AttributeName": "u", "AttributeType": "N"},
+            {"AttributeName": "ledgerShard", "AttributeType": "N"},
+            {"AttributeName": "ledgerCount", "AttributeType": "N"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "changes",
+                "KeySchema": [{"AttributeName": "pk", "KeyType": "HASH"}, {"AttributeName": "u", "KeyType": "RANGE"}],
+                "Projection": {"ProjectionType": "INCLUDE", "NonKeyAttributes": CHANGES_INCLUDE},
+            },
+            {
+                "IndexName": "ledger-counts",
+                "KeySchema": [
+                    {"AttributeName": "ledgerShard", "KeyType": "HASH"},
+                    {"AttributeName": "ledgerCount", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+            },
+        ],
+        StreamSpecification={"StreamEnabled": True, "StreamViewType": "NEW_AND_OLD_IMAGES"},
+    )
+
+
+def create_bucket(name: str = BUCKET, region: str = REGION):
+    boto3.client("s3", region_name=region).create_bucket(
+        Bucket=name, CreateBucketConfiguration={"LocationConstraint": region}
+    )
+
+
+class StreamReader:
+    """
+    Reads the table's stream from "now" on, in the Lambda event shape
+    (eventName, eventSource, dynamodb.Keys/NewImage/OldImage).
+    """
+
+    def __init__(self, name: str = TABLE, region: str = REGION):
+        arn = boto3.client("dynamodb", region_name=region).describe_table(TableName=name)["Table"]["LatestStreamArn"]
+        self._client = boto3.client("dynamodbstreams", region_name=region)
+        shards = self._client.describe_stream(StreamArn=arn)["StreamDescription"]["Shards"]
+        self._iterators = [
+            self._client.get_shard_iterator(StreamArn=arn, ShardId=sh["ShardId"], ShardIteratorType="LATEST")["ShardIterator"]
+            for sh in shards
+        ]
+
+    def poll(self) -> list:
+        records = []
+        for i, it in enumerate(self._iterators):
+            resp = self._client.get_records(ShardIterator=it)
+            records.extend(resp.get("Records", []))
+            self._iterators[i] = resp.get("NextShardIterator") or it
+        return records
+
+
+@contextlib.contextmanager
+def local_aws():
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("AWS_DEFAULT_REGION", REGION)
+    with mock_aws():
+        create_bucket()
+        create_table()
+        yield {"BUCKET_NAME": BUCKET, "DDB_TABLE_NAME": TABLE, "S3_REGION": REGION}
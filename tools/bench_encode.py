@@ -0,0 +1,104 @@
+"""
+Output bytes and encode time per format for the Lambda's encoding stage.
+
+    python tools/bench_encode.py [--images DIR] [--rounds 3] [--budget 250000]
+
+Runs encode_output() on PNG sources as Bedrock would return them: real
+generations from --images (*.png), or synthetic 1024x1024 posters (smooth
+gradients, hard-edged shapes, text, grain). For each format it reports the
+median output size and encode time at the default quality, plus the same
+under a --budget byte target (binary search over quality). PNG is Bedrock's
+own output and passes through. Needs Pillow.
+"""
+import argparse
+import glob
+import io
+import os
+import random
+import statistics
+import time
+
+from _lambda import load_lambda
+
+
+def synthetic_poster(seed, size=1024):
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rnd = random.Random(seed)
+    top, bottom = [rnd.randrange(256) for _ in range(3)], [rnd.randrange(256) for _ in range(3)]
+    im = Image.new("RGB", (size, size))
+    draw = ImageDraw.Draw(im)
+    for y in range(size):
+        t = y / (size - 1)
+        draw.line([(0, y), (size, y)], fill=tuple(int(a + (b - a) * t) for a, b in zip(top, bottom)))
+    for _ in range(12):
+        x, y, r = rnd.randrange(size), rnd.randrange(size), rnd.randrange(40, 260)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=tuple(rnd.randrange(256) for _ in range(3)))
+    im = im.filter(ImageFilter.GaussianBlur(6))
+    draw = ImageDraw.Draw(im)
+    # fine detail (foliage, fabric, rain) is what keeps real generations large
+    for _ in range(4000):
+        x, y, r = rnd.randrange(size), rnd.randrange(size), rnd.randrange(1, 6)
+        draw.ellipse([x, y, x + r, y + r], fill=tuple(rnd.randrange(256) for _ in range(3)))
+    draw.rectangle([0, size * 3 // 4, size, size], fill=(10, 10, 14))
+    for i in range(4):
+        draw.text((40, size * 3 // 4 + 30 + 40 * i), "THE LONG NIGHT  " * 3, fill=(235, 225, 200))
+
+    grain = Image.merge("RGB", [Image.effect_noise((size, size), 40) for _ in range(3)])
+    im = Image.blend(im, grain, 0.12)
+    out = io.BytesIO()
+    im.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _time(fn, rounds):
+    times, out = [], None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return out, statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--images", help="directory of PNG generations")
+    ap.add_argument("--samples", type=int, default=3)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--budget", type=int, default=250_000)
+    args = ap.parse_args()
+
+    lf = load_lambda()
+    if lf.Image is None:
+        raise SystemExit("Pillow is not installed")
+
+    if args.images:
+        paths = sorted(glob.glob(os.path.join(args.images, "*.png")))
+        sources = [open(p, "rb").read() for p in paths]
+    else:
+        sources = [synthetic_poster(i) for i in range(args.samples)]
+    print(f"{len(sources)} sources, median PNG {statistics.median(map(len, sources)) / 1024:.0f} KiB")
+    print(f"formats available: {sorted(lf.ALLOWED_OUTPUT_FORMATS - {'jpeg'})}\n")
+
+    formats = [f for f in lf.OUTPUT_FORMAT_PREFERENCE if f in lf.LOSSY_FORMATS & lf.ALLOWED_OUTPUT_FORMATS][::-1]
+    png = statistics.median(map(len, sources)) / 1024
+    print(f"{'format':<8} {'q':>4} {'KiB':>8} {'ms':>8}   {'budget KiB':>10} {'ms':>8}")
+    print(f"{'png':<8} {'-':>4} {png:>8.0f} {'pass':>8}")
+    for fmt in formats:
+        sizes, times, b_sizes, b_times = [], [], [], []
+        for src in sources:
+            data, t = _time(lambda: lf.encode_output(src, "png", fmt), args.rounds)
+            sizes.append(len(data))
+            times.append(t)
+            data, t = _time(lambda: lf.encode_output(src, "png", fmt, max_bytes=args.budget), args.rounds)
+            b_sizes.append(len(data))
+            b_times.append(t)
+        print(
+            f"{fmt:<8} {lf.DEFAULT_QUALITY[fmt]:>4} {statistics.median(sizes) / 1024:>8.0f} "
+            f"{statistics.median(times) * 1000:>8.0f}   {statistics.median(b_sizes) / 1024:>10.0f} "
+            f"{statistics.median(b_times) * 1000:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Microbenchmark for the response/request JSON path.
+
+    python tools/bench_json.py [--rounds 200] [--repeats 10]
+
+Encode: a 50-item get_history page (DynamoDB Decimals + presigned URLs),
+comparing the old _json_safe tree copy against the encoder `default` hook
+(stdlib, and orjson when installed).
+Decode: a ~1.5 MB /edit body (base64 image), plain and isBase64Encoded
+(_json_body parses the latter with the stdlib whatever the backend).
+Each figure is the best of --repeats timed blocks, and the candidates of a
+comparison take turns, so drift and one noisy block don't decide it.
+"""
+import argparse
+import base64
+import json
+import os
+import secrets
+import time
+from decimal import Decimal
+
+from _lambda import load_lambda
+
+
+def _legacy_json_safe(obj):
+    # _resp before the default hook: rebuilds every dict/list
+    if isinstance(obj, Decimal):
+        if obj % 1 == 0:
+            return int(obj)
+        return float(obj)
+    if isinstance(obj, dict):
+        return {k: _legacy_json_safe(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_legacy_json_safe(v) for v in obj]
+    return obj
+
+
+def history_page(lf, n=50):
+    items = []
+    for i in range(n):
+        req_id = secrets.token_hex(16)
+        sk = f"GEN#2026-10-{1 + i % 28:02d}T12:{i % 60:02d}:00+00:00#{req_id}"
+        items.append(
+            lf._decode_history_item(
+                {
+                    "pk": "USER#3f0c6a1e-8d9b-4c2e-9a51-2b7d4e6f8a90",
+                    "sk": sk,
+                    "v": Decimal(2),
+                    "st": "S",
+                    "p": "A cinematic movie poster of a dragon over a burning medieval city at dusk, dramatic lighting",
+                    "ar": Decimal(i % 6),
+                    "of": Decimal(1 + i % 2),
+                    "k": f"generated/dev/20261019T120000Z-{req_id}.png",
+                    "featured": i == 3,
+                    "ttl": Decimal(1790000000 + i),
+                }
+            )
+        )
+        items[-1]["presigned_url"] = (
+            f"https://local-bucket.s3.us-east-2.amazonaws.com/{items[-1]['s3Key']}"
+            "?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Credential=" + "A" * 200
+            + "&X-Amz-Date=20261019T120000Z&X-Amz-Expires=3600&X-Amz-SignedHeaders=host"
+            + "&X-Amz-Security-Token=" + "T" * 700 + "&X-Amz-Signature=" + secrets.token_hex(32)
+        )
+    return {"items": items, "nextCursor": base64.urlsafe_b64encode(b'{"pk":"x","sk":"y"}').decode()}
+
+
+def bench(fns, rounds, repeats):
+    """Best-of-repeats us per call for each fn; the fns take turns in every repeat."""
+    for fn in fns.values():
+        fn()
+    best = dict.fromkeys(fns, float("inf"))
+    for _ in range(repeats):
+        for name, fn in fns.items():
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                fn()
+            best[name] = min(best[name], (time.perf_counter() - t0) / rounds)
+    return {name: t * 1e6 for name, t in best.items()}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=200)
+    ap.add_argument("--repeats", type=int, default=10)
+    args = ap.parse_args()
+
+    lf = load_lambda()
+    page = history_page(lf)
+    backend = "orjson" if lf.orjson is not None else "stdlib json"
+    print(f"backend: {backend}")
+
+    results = bench(
+        {
+            "encode legacy (_json_safe + json.dumps)": lambda: json.dumps(_legacy_json_safe(page)),
+            "encode json.dumps(default=)": lambda: json.dumps(page, default=lf._json_default),
+            f"encode _dumps ({backend})": lambda: lf._dumps(page),
+        },
+        args.rounds,
+        args.repeats,
+    )
+    assert json.loads(lf._dumps(page)) == json.loads(json.dumps(_legacy_json_safe(page)))
+
+    image_b64 = base64.b64encode(os.urandom(1_100_000)).decode()
+    edit_body = json.dumps({"prompt": "make it noir", "image": image_b64, "strength": 0.35, "output_format": "png"})
+    event = {"body": edit_body}
+    event_b64 = {"body": base64.b64encode(edit_body.encode()).decode(), "isBase64Encoded": True}
+
+    def legacy_body(ev):
+        body = ev["body"]
+        if ev.get("isBase64Encoded"):
+            body = base64.b64decode(body).decode("utf-8")
+        return json.loads(body)
+
+    rounds = max(10, args.rounds // 10)
+    results.update(
+        bench(
+            {
+                f"decode edit body legacy ({len(edit_body) // 1024} KB)": lambda: legacy_body(event),
+                f"decode edit body _json_body ({backend})": lambda: lf._json_body(event),
+                "decode b64 edit body legacy": lambda: legacy_body(event_b64),
+                "decode b64 edit body _json_body (stdlib json)": lambda: lf._json_body(event_b64),
+            },
+            rounds,
+            args.repeats,
+        )
+    )
+
+    for name, us in results.items():
+        print(f"{name:48s} {us:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
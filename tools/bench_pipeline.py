@@ -0,0 +1,150 @@
+"""
+Request-path latency of the generation pipeline against an older lambda_function.
+
+    python tools/bench_pipeline.py --baseline <git-rev> [--candidate <git-rev>] [--runs 200]
+
+Runs POST generate and POST /edit through lambda_handler on both modules
+(the working tree's, or --candidate's), interleaved, against moto +
+tools/fake_bedrock.py with zero model latency, so what is measured is the
+Lambda's own overhead (validation, DynamoDB credit/history writes, decode,
+S3 put, presign). The working tree runs with DERIVED_WRITES=stream, as
+deployed.
+
+Every timed request gets a freshly created table: moto deep-copies the whole
+table on every TransactWriteItems, so a table that grows over the run would
+bill moto's copy to whichever module uses transactions. Also prints the
+current pipeline's per-stage medians and the AWS calls each module makes per
+request. Without --baseline only one module runs.
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+import boto3
+
+from _lambda import LAMBDA_DIR, load_lambda
+from _local_aws import REGION, TABLE, create_table, local_aws
+from fake_bedrock import FakeBedrock, _fake_png
+
+REPO_ROOT = os.path.join(LAMBDA_DIR, "..")
+
+
+def load_rev(rev, name):
+    src = subprocess.run(
+        ["git", "show", f"{rev}:lambda/lambda_function.py"], cwd=REPO_ROOT, capture_output=True, check=True
+    ).stdout
+    path = os.path.join(tempfile.mkdtemp(), f"{name}.py")
+    with open(path, "wb") as f:
+        f.write(src)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reset_table(name=TABLE):
+    boto3.client("dynamodb", region_name=REGION).delete_table(TableName=name)
+    create_table(name)
+
+
+def _event(path, body, sub):
+    return {
+        "rawPath": f"/moviePosterImageGenerator{path}",
+        "requestContext": {"http": {"method": "POST"}, "authorizer": {"jwt": {"claims": {"sub": sub}}}},
+        "body": json.dumps(body),
+    }
+
+
+class CallCounter:
+    """Counts AWS API calls made through a module's S3 and DynamoDB clients."""
+
+    def __init__(self, lf):
+        self.calls = {}
+        for client in (lf.s3, lf.ddb.meta.client):
+            client.meta.events.register("before-call", self._count)
+
+    def _count(self, model, **kwargs):
+        self.calls[model.name] = self.calls.get(model.name, 0) + 1
+
+    def take(self):
+        calls, self.calls = self.calls, {}
+        return calls
+
+
+def _ms(values, q):
+    values = sorted(values)
+    return 1000 * values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--baseline", help="git rev of the pre-pipeline lambda_function.py")
+    ap.add_argument("--candidate", help="git rev to compare instead of the working tree")
+    ap.add_argument("--runs", type=int, default=200)
+    ap.add_argument("--image-bytes", type=int, default=1_500_000)
+    args = ap.parse_args()
+
+    os.environ["PIPELINE_LOG_TIMINGS"] = "0"
+    os.environ["PRESETS_PATH"] = os.path.join(LAMBDA_DIR, "presets.json")
+    edit_image = base64.b64encode(_fake_png(args.image_bytes)).decode("ascii")
+    requests = {
+        "generate": ("", {"prompt": "a lighthouse in a storm", "aspect_ratio": "3:4"}),
+        "edit": ("/edit", {"prompt": "make it night", "image": edit_image, "strength": 0.4}),
+    }
+
+    with local_aws() as env:
+        current = load_lambda(**env, DAILY_CREDITS=10_000_000, DERIVED_WRITES="stream")
+        if args.candidate:
+            current = load_rev(args.candidate, "lambda_candidate")
+        modules = {"current": current}
+        if args.baseline:
+            modules["baseline"] = load_rev(args.baseline, "lambda_baseline")
+        counters = {}
+        for name, lf in modules.items():
+            lf.bedrock = FakeBedrock(latency_s=0, image_bytes=args.image_bytes)
+            counters[name] = CallCounter(lf)
+
+        samples = {(name, req): [] for name in modules for req in requests}
+        calls = {(name, req): {} for name in modules for req in requests}
+        for i in range(args.runs + 5):
+            for req, (path, body) in requests.items():
+                for name, lf in modules.items():
+                    reset_table()
+                    counters[name].take()
+                    t0 = time.perf_counter()
+                    resp = lf.lambda_handler(_event(path, body, f"bench-{name}"), None)
+                    elapsed = time.perf_counter() - t0
+                    if resp["statusCode"] != 200:
+                        raise RuntimeError(f"{name} {req}: {resp['body']}")
+                    calls[(name, req)] = counters[name].take()
+                    if i >= 5:  # warm-up
+                        samples[(name, req)].append(elapsed)
+
+        print(f"{'endpoint':<10} {'module':<10} {'p50 ms':>8} {'p99 ms':>8}  AWS calls per request")
+        for (name, req), values in sorted(samples.items(), key=lambda kv: (kv[0][1], kv[0][0])):
+            per_call = ", ".join(f"{op} {n}" for op, n in sorted(calls[(name, req)].items()))
+            print(f"{req:<10} {name:<10} {_ms(values, 0.5):>8.2f} {_ms(values, 0.99):>8.2f}  {per_call}")
+
+        lf = modules["current"]
+        for req, (path, body) in requests.items():
+            stage_times = {}
+            for _ in range(min(args.runs, 50)):
+                reset_table()
+                ctx = {"sub": "bench-stages", "event": {}, "body": body, "qsp": {}, "inline": False, "kind": None}
+                for _ev in lf.run_pipeline("text-to-image" if req == "generate" else "image-to-image", ctx):
+                    pass
+                for stage, ms in ctx["timings"].items():
+                    stage_times.setdefault(stage, []).append(ms)
+            print(f"\ncurrent pipeline, {req}, median ms per stage:")
+            print("  " + "  ".join(f"{stage}={statistics.median(v):.2f}" for stage, v in stage_times.items()))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Prompt search benchmark against in-process DynamoDB (moto).
+
+    python tools/bench_search.py [--sizes 1000,10000,30000] [--queries 20]
+
+For each history size, seeds a user through write_history_best_effort,
+then compares search_history with the old way of finding a poster
+(paging get_history newest-first until the match shows up). The index rows
+are written the way the stream consumer writes them, and that cost is
+reported per item ("index ms", "rows/item"). Finally run_search_backfill
+re-indexes the whole table, as it would for history that predates the index.
+
+"rows read" is what DynamoDB bills and what drives its latency; moto's own
+query time grows with partition size (index rows included), so wall time
+here is an upper bound. Browsing costs the same rows at any size but takes
+several of those slow queries, so it only runs up to --browse-max items.
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from _lambda import load_lambda
+from _local_aws import local_aws
+
+SUBJECTS = ["dragon", "robot", "astronaut", "samurai", "lion", "detective", "wizard", "spaceship",
+            "castle", "jungle", "city", "ocean", "desert", "mountain", "chef", "dancer", "pirate", "knight"]
+STYLES = ["cinematic", "noir", "watercolor", "retro", "synthwave", "minimalist", "baroque", "anime",
+          "photorealistic", "vintage", "neon", "pastel", "gothic", "futuristic"]
+EXTRAS = ["dramatic lighting", "golden hour", "rainy night", "film grain", "bold typography",
+          "wide angle", "soft focus", "high contrast", "foggy morning", "starry sky"]
+
+
+def _prompt(rnd):
+    return (f"A {rnd.choice(STYLES)} movie poster of a {rnd.choice(SUBJECTS)} in a "
+            f"{rnd.choice(SUBJECTS)}, {rnd.choice(EXTRAS)}, {rnd.choice(EXTRAS)}")
+
+
+class _CountingTable:
+    """Wraps the Table resource to count items DynamoDB reads (ScannedCount)."""
+
+    def __init__(self, table):
+        self._t = table
+        self.read = 0
+        self.calls = 0
+
+    def query(self, **kw):
+        resp = self._t.query(**kw)
+        self.read += resp.get("ScannedCount", len(resp.get("Items", [])))
+        self.calls += 1
+        return resp
+
+    def __getattr__(self, name):
+        return getattr(self._t, name)
+
+
+def _browse_until(lf, sub, term, want):
+    # baseline: what the history page does today
+    found, cursor = 0, None
+    while True:
+        page = lf.get_history(sub=sub, limit=50, cursor=cursor)
+        found += sum(1 for it in page["items"] if term in (it.get("prompt") or "").lower())
+        cursor = page["nextCursor"]
+        if found >= want or not cursor:
+            return
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000,30000")
+    ap.add_argument("--queries", type=int, default=10)
+    ap.add_argument("--browse-max", type=int, default=5000)
+    ap.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args()
+
+    with local_aws() as env:
+        lf = load_lambda(**env, DERIVED_WRITES="stream")
+        real_table = lf.table
+        rnd = random.Random(11)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        seeded = 0
+        sub = "bench-user"
+
+        print(
+            f"{'items':>7} | {'index ms':>8} {'rows/item':>9} | {'search p50 ms':>13} {'rows read':>9} {'queries':>7}"
+            f" | {'browse p50 ms':>13} {'rows read':>9} {'queries':>7}"
+        )
+        for size in [int(x) for x in args.sizes.split(",")]:
+            lf.table = real_table
+            index_ms, index_rows, new = [], 0, 0
+            while seeded < size:
+                ts = (now - timedelta(seconds=size * 10 - seeded)).isoformat()
+                prompt = _prompt(rnd)
+                lf.write_history_best_effort(sub, ts, f"{seeded:08x}", prompt, "1:1", "png", "SUCCESS", s3_key=f"generated/{seeded}.png")
+                t0 = time.perf_counter()
+                lf.write_search_index_best_effort(sub, lf._history_sk(ts, f"{seeded:08x}"), prompt)
+                index_ms.append((time.perf_counter() - t0) * 1000)
+                index_rows += len(lf._search_index_rows(sub, "GEN#x", prompt))
+                seeded += 1
+                new += 1
+
+            counting = _CountingTable(real_table)
+            lf.table = counting
+            lf.s3.generate_presigned_url = lambda **kw: "https://example/presigned"  # not what's measured
+
+            terms = [rnd.choice(SUBJECTS + STYLES) for _ in range(args.queries)]
+            results = {"browse": None}
+            runs = [("search", lambda t: lf.search_history(sub=sub, q=t, limit=args.limit))]
+            if size <= args.browse_max:
+                runs.append(("browse", lambda t: _browse_until(lf, sub, t, args.limit)))
+            for name, run in runs:
+                counting.read = counting.calls = 0
+                times = []
+                for t in terms:
+                    t0 = time.perf_counter()
+                    run(t)
+                    times.append((time.perf_counter() - t0) * 1000)
+                results[name] = (statistics.median(times), counting.read / len(terms), counting.calls / len(terms))
+
+            s, b = results["search"], results["browse"]
+            idx = (statistics.median(index_ms), index_rows / new) if new else (0.0, 0.0)
+            browse = f"{b[0]:13.1f} {b[1]:9.0f} {b[2]:7.1f}" if b else f"{'-':>13} {'-':>9} {'-':>7}"
+            print(f"{size:7d} | {idx[0]:8.2f} {idx[1]:9.1f} | {s[0]:13.1f} {s[1]:9.0f} {s[2]:7.1f} | {browse}")
+
+        lf.table = real_table
+        t0 = time.perf_counter()
+        result = lf.run_search_backfill({"source": lf.SEARCH_BACKFILL_EVENT_SOURCE})
+        elapsed = time.perf_counter() - t0
+        print(
+            f"\nbackfill: scanned {result['scanned']} rows, indexed {result['indexed']} items"
+            f" in {elapsed:.1f} s ({result['indexed'] / elapsed:.0f} items/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Local API: lambda_handler behind an HTTP shim, against moto + fake Bedrock.
+
+    python tools/dev_server.py [--port 8787] [--workers 4] [--latency 6 --jitter 1 --bedrock-concurrency 2]
+
+Point poster-web at it with API_BASE_URL=http://localhost:8787 (its API
+routes proxy server-side, so no CORS setup is needed).
+
+Each HTTP request becomes an API Gateway HTTP API v2 event (rawPath,
+rawQueryString, lowercased headers, queryStringParameters, base64 bodies
+for binary content types) and the Lambda's proxy response is written back.
+JWT claims are what the authorizer would pass: taken unverified from an
+"Authorization: Bearer" token (poster-web forwards the Cognito access
+token), else X-Dev-Sub / X-Dev-Groups headers, else --sub / --groups.
+
+Requests run on a pool of --workers threads, each standing in for one warm
+Lambda environment; more simultaneous requests queue, like a function at
+its concurrency limit. Workers share one module import and one moto
+backend (moto state lives in this process, so there is no process pool).
+
+Presigned URLs and the CloudFront base URL are rewritten to GET /_s3/<key>
+on this server so images load in the browser. Async export invocations run
+on a background thread. New GEN# and FEED# rows are read off the table's
+stream and handed to lambda_handler as stream batches, like the
+history_inserts event source mapping (derived writes and feed thumbnails run
+there, as deployed). lambda_function.py
+and presets.json are reloaded when they change on disk (in-flight requests
+finish first; a module that fails to import leaves the previous one running).
+
+DynamoDB/S3 state is in memory and lost on exit.
+"""
+import argparse
+import base64
+import importlib
+import json
+import mimetypes
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlparse
+
+from _lambda import LAMBDA_DIR, load_lambda
+from _local_aws import BUCKET, StreamReader, local_aws
+from fake_bedrock import FakeBedrock, _fake_png
+
+S3_PATH = "/_s3/"
+TEXT_TYPES = ("text/", "application/json", "application/x-www-form-urlencoded", "application/xml")
+WATCHED = ("lambda_function.py", "presets.json")
+
+
+class PoolHTTPServer(HTTPServer):
+    """HTTPServer that hands each connection to a fixed-size thread pool."""
+
+    daemon_threads = True
+
+    def __init__(self, address, handler, workers):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lambda")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._work, request, client_address)
+
+    def _work(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class Gate:
+    """Requests enter shared; a reload waits for them and holds new ones back."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._closed = False
+
+    def __enter__(self):
+        with self._cond:
+            self._cond.wait_for(lambda: not self._closed)
+            self._active += 1
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def exclusive(self, fn):
+        with self._cond:
+            self._closed = True
+            self._cond.wait_for(lambda: self._active == 0)
+            try:
+                return fn()
+            finally:
+                self._closed = False
+                self._cond.notify_all()
+
+
+class LocalPresigner:
+    """Wraps the Lambda's S3 client so presigned URLs point at this server."""
+
+    def __init__(self, client, base_url):
+        self._client = client
+        self._base_url = base_url
+
+    def generate_presigned_url(self, ClientMethod, Params=None, **kwargs):
+        return f"{self._base_url}{S3_PATH}{quote((Params or {})['Key'])}"
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class AsyncInvoker:
+    """Stand-in for the Lambda client: InvocationType=Event runs the handler on a thread."""
+
+    def __init__(self, app):
+        self._app = app
+
+    def invoke(self, FunctionName, Payload=b"", InvocationType="RequestResponse", **kwargs):
+        event = json.loads(Payload or b"{}")
+        if InvocationType == "Event":
+            threading.Thread(target=self._app.invoke, args=(event,), daemon=True).start()
+            return {"StatusCode": 202}
+        return {"StatusCode": 200, "Payload": json.dumps(self._app.invoke(event)).encode("utf-8")}
+
+
+class _Context:
+    function_name = "poster-image-generator-local"
+    memory_limit_in_mb = 1024
+
+    def __init__(self):
+        self.aws_request_id = str(uuid.uuid4())
+
+    def get_remaining_time_in_millis(self):
+        return 900_000
+
+
+class App:
+    def __init__(self, args, base_url, env):
+        self.args = args
+        self.base_url = base_url
+        self.gate = Gate()
+        self.bedrock = FakeBedrock(
+            latency_s=args.latency,
+            jitter_s=args.jitter,
+            max_concurrency=args.bedrock_concurrency,
+            fail_rate=args.fail_rate,
+            image=_sample_image(args.image_bytes),
+        )
+        self.lf = load_lambda(
+            **env,
+            CLOUDFRONT_BASE_URL=f"{base_url}{S3_PATH.rstrip('/')}",
+            PRESETS_PATH=os.path.join(LAMBDA_DIR, "presets.json"),
+            AWS_LAMBDA_FUNCTION_NAME=_Context.function_name,
+            DERIVED_WRITES="stream",
+        )
+        self._install()
+        self._mtimes = self._stat()
+
+    def _install(self):
+        lf = self.lf
+        lf.bedrock = self.bedrock
+        if not isinstance(lf.s3, LocalPresigner):
+            lf.s3 = LocalPresigner(lf.s3, self.base_url)
+        lf._lambda_client = AsyncInvoker(self)
+
+    def invoke(self, event):
+        with self.gate:
+            return self.lf.lambda_handler(event, _Context())
+
+    def pump_stream(self, interval=0.5):
+        # same filter as aws_lambda_event_source_mapping.history_inserts
+        reader = StreamReader()
+        while True:
+            time.sleep(interval)
+            try:
+                batch = [r for r in reader.poll() if self.lf._is_history_insert(r) or self.lf._is_feed_insert(r)]
+                if batch:
+                    self.invoke({"Records": batch})
+            except Exception:
+                traceback.print_exc()
+
+    # hot reload
+    def _stat(self):
+        return {name: os.stat(os.path.join(LAMBDA_DIR, name)).st_mtime_ns for name in WATCHED}
+
+    def watch(self, interval=0.5):
+        while True:
+            time.sleep(interval)
+            mtimes = self._stat()
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                self.gate.exclusive(self._reload)
+
+    def _reload(self):
+        path = os.path.join(LAMBDA_DIR, "lambda_function.py")
+        try:
+            with open(path, "rb") as f:
+                compile(f.read(), path, "exec")
+            importlib.reload(self.lf)
+        except Exception:
+            traceback.print_exc()
+            print("reload failed; keeping the previous module")
+        else:
+            print("reloaded lambda_function")
+        self._install()  # reload rebinds the module's clients
+
+
+def _sample_image(size):
+    # a decodable poster so re-encoding and the browser both work; filler PNG without Pillow
+    try:
+        from bench_encode import synthetic_poster
+
+        return synthetic_poster(0)
+    except ImportError:
+        return _fake_png(size)
+
+
+def _claims(headers, args):
+    claims = {}
+    auth = headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        try:
+            payload = auth.split()[1].split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        except Exception:
+            claims = {}
+    sub = claims.get("sub") or headers.get("x-dev-sub") or args.sub
+    groups = claims.get("cognito:groups") or headers.get("x-dev-groups", args.groups).replace(",", " ").split()
+    out = {"sub": sub, "token_use": claims.get("token_use", "access")}
+    if groups:
+        out["cognito:groups"] = f"[{' '.join(groups)}]"  # HTTP API flattens list claims
+    return out
+
+
+def to_event(method, target, headers, body, args, source_ip):
+    url = urlparse(target)
+    headers = {k.lower(): v for k, v in headers.items()}
+    qsp = {}
+    for k, v in parse_qsl(url.query, keep_blank_values=True):
+        qsp[k] = f"{qsp[k]},{v}" if k in qsp else v
+
+    content_type = headers.get("content-type", "")
+    is_text = not body or content_type.startswith(TEXT_TYPES)
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": f"{method} {url.path}",
+        "rawPath": url.path,
+        "rawQueryString": url.query,
+        "headers": headers,
+        "queryStringParameters": qsp or None,
+        "requestContext": {
+            "accountId": "000000000000",
+            "apiId": "local",
+            "domainName": headers.get("host", "localhost"),
+            "http": {
+                "method": method,
+                "path": url.path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": source_ip,
+                "userAgent": headers.get("user-agent", ""),
+            },
+            "requestId": uuid.uuid4().hex,
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now)),
+            "timeEpoch": int(now * 1000),
+            "authorizer": {"jwt": {"claims": _claims(headers, args), "scopes": None}},
+        },
+        "body": (body.decode("utf-8") if is_text else base64.b64encode(body).decode("ascii")) if body else None,
+        "isBase64Encoded": not is_text,
+    }
+
+
+def make_handler(app, args):
+    # HTTP/1.0 (one request per connection) so idle keep-alives don't pin workers
+    class Handler(BaseHTTPRequestHandler):
+        def _handle(self):
+            t0 = time.perf_counter()
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+
+            if self.command == "GET" and self.path.startswith(S3_PATH):
+                status = self._serve_s3(unquote(urlparse(self.path).path[len(S3_PATH):]))
+            else:
+                event = to_event(self.command, self.path, dict(self.headers), body, args, self.client_address[0])
+                try:
+                    resp = app.invoke(event)
+                except Exception:
+                    traceback.print_exc()
+                    resp = {"statusCode": 502, "body": json.dumps({"message": "Internal Server Error"})}
+                status = self._write(resp)
+            # one write per line so worker threads don't interleave
+            print(f"{self.command} {self.path.split('?')[0]} {status} {1000 * (time.perf_counter() - t0):.0f}ms\n", end="")
+
+        def _write(self, resp):
+            status = int(resp.get("statusCode") or 200)
+            payload = resp.get("body") or b""
+            if isinstance(payload, str):
+                payload = base64.b64decode(payload) if resp.get("isBase64Encoded") else payload.encode("utf-8")
+            self.send_response(status)
+            headers = {k.lower(): v for k, v in (resp.get("headers") or {}).items()}
+            headers.setdefault("content-type", "application/json")
+            for k, v in headers.items():
+                if k not in ("content-length", "connection"):
+                    self.send_header(k, v)
+            for cookie in resp.get("cookies") or []:
+                self.send_header("Set-Cookie", cookie)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return status
+
+        def _serve_s3(self, key):
+            try:
+                obj = app.lf.s3.get_object(Bucket=BUCKET, Key=key)
+            except Exception:
+                return self._write({"statusCode": 404, "body": json.dumps({"message": "Not Found"})})
+            content_type = obj.get("ContentType") or mimetypes.guess_type(key)[0] or "application/octet-stream"
+            headers = {"Content-Type": content_type}
+            if obj.get("ContentEncoding"):
+                headers["Content-Encoding"] = obj["ContentEncoding"]
+            return self._write({"statusCode": 200, "headers": headers, "body": obj["Body"].read()})
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = _handle
+
+        def log_message(self, format, *a):
+            pass  # one line per request from _handle instead
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8787)
+    ap.add_argument("--workers", type=int, default=4, help="concurrent requests (warm Lambda environments)")
+    ap.add_argument("--sub", default="local-user", help="JWT sub when the request carries no token")
+    ap.add_argument("--groups", default="", help="Cognito groups for --sub, e.g. admin,plan-pro")
+    ap.add_argument("--daily-credits", type=int, default=1000)
+    # fake Bedrock
+    ap.add_argument("--latency", type=float, default=0.5, help="seconds per model call")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--bedrock-concurrency", type=int, default=4, help="model calls in flight before queueing")
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--image-bytes", type=int, default=1_500_000, help="fake image size without Pillow")
+    ap.add_argument("--no-reload", action="store_true")
+    args = ap.parse_args()
+
+    base_url = f"http://{args.host}:{args.port}"
+    with local_aws() as env:
+        app = App(args, base_url, {**env, "DAILY_CREDITS": args.daily_credits})
+        if not args.no_reload:
+            threading.Thread(target=app.watch, daemon=True).start()
+        threading.Thread(target=app.pump_stream, daemon=True).start()
+
+        server = PoolHTTPServer((args.host, args.port), make_handler(app, args), args.workers)
+        print(f"lambda_handler on {base_url} ({args.workers} workers); API_BASE_URL={base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            server.pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
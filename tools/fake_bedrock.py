@@ -0,0 +1,48 @@
+"""
+Stand-in for the bedrock-runtime client with latency/throughput knobs.
+
+    lf.bedrock = FakeBedrock(latency_s=6.0, jitter_s=1.0, max_concurrency=2, image_bytes=1_500_000)
+
+invoke_model sleeps for latency (+ uniform jitter), holding one of
+max_concurrency slots (queueing like a throttled model), then returns a
+Stability-shaped {"images": [<base64>]} body. The image is a real PNG
+header followed by incompressible filler of the requested size, or the
+given image= bytes (needed when the Lambda decodes it, e.g. webp/avif).
+"""
+import base64
+import io
+import json
+import os
+import random
+import threading
+import time
+import zlib
+
+
+def _fake_png(size: int) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return len(data).to_bytes(4, "big") + kind + data + zlib.crc32(kind + data).to_bytes(4, "big")
+
+    ihdr = chunk(b"IHDR", (1024).to_bytes(4, "big") * 2 + bytes([8, 2, 0, 0, 0]))
+    filler = chunk(b"tEXt", b"x\0" + os.urandom(max(0, size - 64)))
+    return b"\x89PNG\r\n\x1a\n" + ihdr + filler + chunk(b"IEND", b"")
+
+
+class FakeBedrock:
+    def __init__(self, latency_s=0.5, jitter_s=0.0, max_concurrency=4, image_bytes=1_500_000, fail_rate=0.0, image=None):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.fail_rate = fail_rate
+        self._slots = threading.Semaphore(max(1, max_concurrency))
+        self._image_b64 = base64.b64encode(image or _fake_png(image_bytes)).decode("ascii")
+        self.calls = 0
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None, **kwargs):
+        json.loads(body)  # same validation a real call would get
+        with self._slots:
+            self.calls += 1
+            time.sleep(self.latency_s + random.uniform(0, self.jitter_s))
+            if random.random() < self.fail_rate:
+                raise RuntimeError("ThrottlingException (fake)")
+        payload = json.dumps({"images": [self._image_b64], "seeds": [0], "finish_reasons": [None]})
+        return {"body": io.BytesIO(payload.encode("utf-8")), "contentType": "application/json"}
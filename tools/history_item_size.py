@@ -0,0 +1,107 @@
+"""
+Compare DynamoDB item size / query RCUs for v1 (long names) and v2 (compact)
+history rows.
+
+    python tools/history_item_size.py [--items 50] [--failed-ratio 0.1]
+
+Sizes follow DynamoDB's billing rules: attribute name bytes + value bytes.
+A Query is billed on the summed size of the items it reads (rounded up to
+4 KB), 0.5 RCU per 4 KB for eventually consistent reads.
+"""
+import argparse
+import math
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from _lambda import load_lambda
+
+PROMPTS = [
+    "A cinematic movie poster of a dragon over a burning medieval city at dusk, dramatic lighting, ultra detailed",
+    "Retro 80s synthwave poster, neon grid, chrome lettering, a lone car driving into the sunset, film grain",
+    "Minimalist catering flyer, elegant plated dish on dark slate, soft rim light, space for title text",
+    "Futuristic city skyline poster, flying vehicles, holographic billboards, rain, cyberpunk palette, 4k",
+]
+# What a Bedrock failure looks like once str(e) has embedded the response.
+LONG_ERROR = "No image in Bedrock response: " + repr({"finish_reasons": ["Filter reason: prompt"], "seeds": [0], "detail": "x" * 1800})
+
+
+def _value_size(v) -> int:
+    if v is None or isinstance(v, bool):
+        return 1
+    if isinstance(v, (int, float, Decimal)):
+        digits = len(str(abs(Decimal(str(v)))).replace(".", "").lstrip("0")) or 1
+        return math.ceil(digits / 2) + 1
+    if isinstance(v, str):
+        return len(v.encode("utf-8"))
+    raise TypeError(type(v))
+
+
+def item_size(item: dict) -> int:
+    return sum(len(k.encode("utf-8")) + _value_size(v) for k, v in item.items())
+
+
+def _v1_item(lf, sub, ts_iso, req_id, prompt, ar, fmt, status, key, err):
+    # What write_history_best_effort stored before the compact format.
+    item = {
+        "pk": lf._pk(sub),
+        "sk": lf._history_sk(ts_iso, req_id),
+        "createdAt": ts_iso,
+        "status": status,
+        "prompt": prompt,
+        "aspect_ratio": ar,
+        "output_format": fmt,
+    }
+    if key:
+        item["s3Key"] = key
+    if err:
+        item["errorMessage"] = err
+    return item
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=50)
+    ap.add_argument("--failed-ratio", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    lf = load_lambda()
+    rnd = random.Random(args.seed)
+    sub = str(uuid.UUID(int=rnd.getrandbits(128)))
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    ttl = lf._ttl_epoch(30)
+
+    v1_sizes, v2_sizes = [], []
+    for i in range(args.items):
+        ts_iso = (now - timedelta(minutes=i)).isoformat()
+        req_id = uuid.UUID(int=rnd.getrandbits(128)).hex
+        prompt = rnd.choice(PROMPTS)
+        ar = rnd.choice(sorted(lf.ALLOWED_ASPECT_RATIOS))
+        fmt = rnd.choice(["png", "jpg"])
+        failed = rnd.random() < args.failed_ratio
+        status = "FAILED" if failed else "SUCCESS"
+        key = None if failed else f"{lf.KEY_PREFIX}{now:%Y%m%dT%H%M%SZ}-{req_id}.{fmt}"
+        err = LONG_ERROR if failed else None
+
+        v1 = _v1_item(lf, sub, ts_iso, req_id, prompt, ar, fmt, status, key, err)
+        v2 = lf._encode_history_item(sub, ts_iso, req_id, prompt, ar, fmt, status, key, err)
+        v1["ttl"] = v2["ttl"] = ttl
+        assert lf._decode_history_item(dict(v2))["createdAt"] == ts_iso
+
+        v1_sizes.append(item_size(v1))
+        v2_sizes.append(item_size(v2))
+
+    def rcu(total):
+        return math.ceil(total / 4096) * 0.5
+
+    t1, t2 = sum(v1_sizes), sum(v2_sizes)
+    print(f"items: {args.items} (failed ratio {args.failed_ratio})")
+    print(f"v1 avg item: {t1 / args.items:8.1f} B   max: {max(v1_sizes):6d} B   page: {t1:7d} B  {rcu(t1):.1f} RCU")
+    print(f"v2 avg item: {t2 / args.items:8.1f} B   max: {max(v2_sizes):6d} B   page: {t2:7d} B  {rcu(t2):.1f} RCU")
+    print(f"saved: {100 * (1 - t2 / t1):.1f}% bytes, {rcu(t1) - rcu(t2):.1f} RCU per page")
+
+
+if __name__ == "__main__":
+    main()
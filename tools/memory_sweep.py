@@ -0,0 +1,225 @@
+"""
+Memory-size sweep for the Lambda: latency vs cost per setting, plus the knee.
+
+    python tools/memory_sweep.py                                  # local model
+    python tools/memory_sweep.py --live poster-image-generator-dev --payload ev.json
+
+Lambda allocates CPU in proportion to memory (1 vCPU at 1769 MB), so the
+CPU-bound part of a request (imports, base64, JSON, SigV4) shrinks as memory
+grows while the I/O part (Bedrock, S3, DynamoDB) does not.
+
+Local mode measures both parts in-process: cold init is the CPU time of
+importing lambda_function in a fresh interpreter; a warm request is a full
+generate call against moto + tools/fake_bedrock.py, split into wall time
+outside Bedrock (I/O) and thread CPU time. Each memory setting is then
+modelled as io + cpu * max(1, 1769 / mb) * --cpu-scale. moto's backend runs in
+the same thread, so the CPU figure is an upper bound.
+
+Live mode (--live) sets MemorySize on the real function, invokes $LATEST with
+--payload (first call after the update is cold), reads Duration / Init
+Duration from the tail log, and restores the original memory at the end.
+
+The knee is the smallest memory whose --metric (cold = first request after
+idle, the default; or p99 warm) is within --tolerance of the best in the sweep.
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+FULL_VCPU_MB = 1769
+GB_SECOND_USD = 0.0000166667            # on-demand duration, x86
+REQUEST_USD = 0.20 / 1_000_000
+PROVISIONED_GB_SECOND_USD = 0.0000041667  # provisioned concurrency, per GB-s kept warm
+DEFAULT_MEMORY = [128, 256, 512, 768, 1024, 1536, 1769, 2048, 3008]
+
+_IMPORT_PROBE = r"""
+import sys, time
+sys.path.insert(0, sys.argv[1])
+t0, c0 = time.perf_counter(), time.process_time()
+import lambda_function
+print(time.perf_counter() - t0, time.process_time() - c0)
+"""
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _cost_per_1k(duration_ms, mb):
+    billed_s = max(1, round(duration_ms)) / 1000.0
+    return 1000 * (billed_s * mb / 1024.0 * GB_SECOND_USD + REQUEST_USD)
+
+
+# -------------------------
+# Local model
+# -------------------------
+def measure_cold_init(runs):
+    from _lambda import LAMBDA_DIR
+
+    env = dict(os.environ, BUCKET_NAME="local-bucket", AWS_DEFAULT_REGION="us-east-2")
+    cpu = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _IMPORT_PROBE, LAMBDA_DIR],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout.split()
+        cpu.append(float(out[1]))
+    return cpu
+
+
+def measure_warm(runs, bedrock_latency, image_bytes):
+    from _lambda import load_lambda
+    from _local_aws import local_aws
+    from fake_bedrock import FakeBedrock
+
+    samples = []
+    with local_aws() as env:
+        lf = load_lambda(**env, DAILY_CREDITS=1_000_000)
+        lf.bedrock = FakeBedrock(latency_s=bedrock_latency, image_bytes=image_bytes)
+        event = {
+            "rawPath": "/moviePosterImageGenerator",
+            "requestContext": {"http": {"method": "POST"}, "authorizer": {"jwt": {"claims": {"sub": "sweep"}}}},
+            "body": json.dumps({"prompt": "a lighthouse in a storm", "aspect_ratio": "3:4"}),
+        }
+        lf.lambda_handler(event, None)  # first call pays lazy botocore loading
+        for _ in range(runs):
+            t0, c0 = time.perf_counter(), time.thread_time()
+            resp = lf.lambda_handler(event, None)
+            wall, cpu = time.perf_counter() - t0, time.thread_time() - c0
+            if resp["statusCode"] != 200:
+                raise RuntimeError(f"generate failed: {resp['body']}")
+            samples.append((max(0.0, wall - cpu), cpu))
+    return samples
+
+
+def model(memory, cold_cpu, warm, cpu_scale):
+    rows = []
+    for mb in memory:
+        slow = max(1.0, FULL_VCPU_MB / mb) * cpu_scale
+        warm_ms = [1000 * (io + cpu * slow) for io, cpu in warm]
+        init_ms = [1000 * c * slow for c in cold_cpu]
+        rows.append(
+            {
+                "memory_mb": mb,
+                "init_ms": statistics.median(init_ms),
+                "p50_ms": _pct(warm_ms, 0.50),
+                "p99_ms": _pct(warm_ms, 0.99),
+                "cold_ms": statistics.median(init_ms) + _pct(warm_ms, 0.50),
+                "usd_per_1k": _cost_per_1k(statistics.mean(warm_ms), mb),
+            }
+        )
+    return rows
+
+
+# -------------------------
+# Live sweep
+# -------------------------
+_REPORT = re.compile(r"\bDuration: ([\d.]+) ms.*?(?:Init Duration: ([\d.]+) ms)?\s*$", re.S)
+
+
+def _invoke(client, function_name, payload):
+    resp = client.invoke(FunctionName=function_name, Payload=payload, LogType="Tail")
+    tail = base64.b64decode(resp.get("LogResult") or b"").decode("utf-8", "replace")
+    report = next((line for line in tail.splitlines() if line.startswith("REPORT")), "")
+    m = _REPORT.search(report)
+    if not m:
+        raise RuntimeError(f"no REPORT line in tail log:\n{tail}")
+    return float(m.group(1)), float(m.group(2) or 0)
+
+
+def live(function_name, memory, runs, payload):
+    import boto3
+
+    client = boto3.client("lambda")
+    original = client.get_function_configuration(FunctionName=function_name)["MemorySize"]
+    waiter = client.get_waiter("function_updated")
+    rows = []
+    try:
+        for mb in memory:
+            client.update_function_configuration(FunctionName=function_name, MemorySize=mb)
+            waiter.wait(FunctionName=function_name)
+
+            cold_duration, init = _invoke(client, function_name, payload)
+            warm_ms = [_invoke(client, function_name, payload)[0] for _ in range(runs)]
+            rows.append(
+                {
+                    "memory_mb": mb,
+                    "init_ms": init,
+                    "p50_ms": _pct(warm_ms, 0.50),
+                    "p99_ms": _pct(warm_ms, 0.99),
+                    "cold_ms": init + cold_duration,
+                    "usd_per_1k": _cost_per_1k(statistics.mean(warm_ms), mb),
+                }
+            )
+            print(f"  {mb} MB done", file=sys.stderr)
+    finally:
+        client.update_function_configuration(FunctionName=function_name, MemorySize=original)
+    return rows
+
+
+# -------------------------
+# Report
+# -------------------------
+def knee(rows, metric, tolerance):
+    field = f"{metric}_ms"
+    best = min(r[field] for r in rows)
+    return next(r for r in sorted(rows, key=lambda r: r["memory_mb"]) if r[field] <= best * (1 + tolerance))
+
+
+def print_table(rows, chosen):
+    print(f"{'MB':>6} {'init':>8} {'cold':>8} {'p50':>8} {'p99':>8} {'$/1k req':>10} {'$/h warm':>9}")
+    for r in rows:
+        warm_hour = 3600 * r["memory_mb"] / 1024.0 * PROVISIONED_GB_SECOND_USD
+        mark = "  <- knee" if r is chosen else ""
+        print(
+            f"{r['memory_mb']:>6} {r['init_ms']:>7.0f}ms {r['cold_ms']:>6.0f}ms {r['p50_ms']:>6.0f}ms "
+            f"{r['p99_ms']:>6.0f}ms {r['usd_per_1k']:>10.5f} {warm_hour:>9.4f}{mark}"
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--memory", default=",".join(map(str, DEFAULT_MEMORY)))
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--metric", choices=["cold", "p99"], default="cold")
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    ap.add_argument("--json", action="store_true")
+    # local model
+    ap.add_argument("--cold-runs", type=int, default=5)
+    ap.add_argument("--bedrock-latency", type=float, default=0.0)
+    ap.add_argument("--image-bytes", type=int, default=1_500_000)
+    ap.add_argument("--cpu-scale", type=float, default=1.0, help="Lambda core time / local core time")
+    # live sweep
+    ap.add_argument("--live", metavar="FUNCTION_NAME")
+    ap.add_argument("--payload", help="event JSON file for --live")
+    args = ap.parse_args()
+
+    memory = sorted(int(m) for m in args.memory.split(","))
+    if args.live:
+        if not args.payload:
+            ap.error("--live needs --payload")
+        with open(args.payload, "rb") as f:
+            rows = live(args.live, memory, args.runs, f.read())
+    else:
+        cold_cpu = measure_cold_init(args.cold_runs)
+        warm = measure_warm(args.runs, args.bedrock_latency, args.image_bytes)
+        rows = model(memory, cold_cpu, warm, args.cpu_scale)
+
+    chosen = knee(rows, args.metric, args.tolerance)
+    if args.json:
+        print(json.dumps({"rows": rows, "knee_mb": chosen["memory_mb"]}, indent=2))
+    else:
+        print_table(rows, chosen)
+        print(f"\nknee: {chosen['memory_mb']} MB ({args.metric} within {args.tolerance:.0%} of best)")
+        print(f'set lambda_memory_mb = {chosen["memory_mb"]} in infra/envs/<env>/main.tf')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Merge the Lambda's sampled profiles for a route and show where time goes.
+
+    python tools/profiles.py --bucket poster-images-dev --env dev --route post-edit [--day 2026-10-19] [--out edit.collapsed]
+    python tools/profiles.py --dir ./downloaded-profiles
+
+Reads the collapsed stacks under profiles/<env>/<route>/<day>/ (or *.collapsed in
+--dir), sums them, and prints the hottest frames by self and total samples.
+--out writes the merged stacks for flamegraph.pl or speedscope. Samples are
+wall clock, so time blocked on Bedrock/S3/DynamoDB shows up under the
+socket/SSL frames of the call that waited.
+"""
+import argparse
+import glob
+import os
+from datetime import datetime, timezone
+
+
+def _parse(text, merged):
+    for line in text.splitlines():
+        stack, _, n = line.rpartition(" ")
+        if stack and n.isdigit():
+            merged[stack] = merged.get(stack, 0) + int(n)
+
+
+def load_s3(bucket, env, route, day):
+    import boto3
+
+    s3 = boto3.client("s3")
+    prefix = f"profiles/{env}/{route}/{day}/"
+    merged, files = {}, 0
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []) or []:
+            _parse(s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read().decode("utf-8"), merged)
+            files += 1
+    return merged, files
+
+
+def load_dir(path):
+    merged, files = {}, 0
+    for name in sorted(glob.glob(os.path.join(path, "*.collapsed"))):
+        with open(name, encoding="utf-8") as f:
+            _parse(f.read(), merged)
+        files += 1
+    return merged, files
+
+
+def hot_frames(merged):
+    self_n, total_n = {}, {}
+    for stack, n in merged.items():
+        frames = stack.split(";")
+        self_n[frames[-1]] = self_n.get(frames[-1], 0) + n
+        for frame in set(frames):
+            total_n[frame] = total_n.get(frame, 0) + n
+    return self_n, total_n
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bucket")
+    ap.add_argument("--env", default="dev", help="PROFILE_PREFIX is profiles/<env>/")
+    ap.add_argument("--route", help="route slug, e.g. post, post-edit, get-history")
+    ap.add_argument("--day", default=datetime.now(timezone.utc).strftime("%Y-%m-%d"))
+    ap.add_argument("--dir", help="directory of downloaded *.collapsed files instead of S3")
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--out", help="write merged collapsed stacks here")
+    args = ap.parse_args()
+
+    if args.dir:
+        merged, files = load_dir(args.dir)
+    elif args.bucket and args.route:
+        merged, files = load_s3(args.bucket, args.env, args.route, args.day)
+    else:
+        ap.error("need --dir, or --bucket and --route")
+
+    total = sum(merged.values())
+    if not total:
+        raise SystemExit(f"no samples in {files} profiles")
+
+    self_n, total_n = hot_frames(merged)
+    print(f"{files} profiles, {total} samples\n")
+    print(f"{'self %':>7} {'total %':>8}  frame")
+    for frame, n in sorted(self_n.items(), key=lambda kv: kv[1], reverse=True)[: args.top]:
+        print(f"{100 * n / total:>6.1f}% {100 * total_n[frame] / total:>7.1f}%  {frame}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for stack, n in sorted(merged.items()):
+                f.write(f"{stack} {n}\n")
+        print(f"\nwrote {args.out} (flamegraph.pl {args.out} > flame.svg, or open in speedscope)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Local harness for the generate endpoint's streaming mode.
+
+    python tools/stream_harness.py --serve [--port 8787]      # curl -N it
+    python tools/stream_harness.py --bench [--runs 5]         # JSON+presign vs NDJSON vs stream
+
+POST /generate?mode=stream is lambda/stream_server.py's StreamHandler, the
+code the streaming function runs behind its function URL; only the Cognito
+check is replaced (every request is --sub). mode=json and mode=ndjson go
+through lambda_handler as API Gateway invokes it (ndjson = stream=true on
+the buffered route). GET /s3/<key> stands in for the presigned URL fetch
+(with --s3-rtt-ms of added latency).
+
+What it can't show: API Gateway, the function URL and the Web Adapter hop
+are not in the path, so absolute numbers are the handler's own, not what a
+client measures. The comparison between modes is the point.
+
+Bedrock is tools/fake_bedrock.py; DynamoDB/S3 are moto.
+"""
+import argparse
+import base64
+import http.client
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from _lambda import load_lambda
+from _local_aws import local_aws
+from fake_bedrock import FakeBedrock
+
+SUB = "local-user"
+
+
+def _event(method, path, body=None, qs=None):
+    return {
+        "rawPath": f"/moviePosterImageGenerator{path}",
+        "requestContext": {"http": {"method": method}, "authorizer": {"jwt": {"claims": {"sub": SUB}}}},
+        "queryStringParameters": qs or None,
+        "body": body,
+    }
+
+
+def make_handler(lf, stream_server, bucket, s3_rtt_s):
+    class Handler(stream_server.StreamHandler):
+        def claims(self):
+            return {"sub": SUB}
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            mode = (parse_qs(url.query).get("mode") or ["json"])[0]
+            if mode == "stream":
+                super().do_POST()
+                return
+
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+            if mode == "ndjson":
+                raw = json.dumps({**json.loads(raw or "{}"), "stream": True})
+            resp = lf.lambda_handler(_event("POST", "", raw), None)
+            self._send_json(resp["statusCode"], resp["body"])
+
+        def do_GET(self):
+            if not self.path.startswith("/s3/"):
+                self.send_error(404)
+                return
+            time.sleep(s3_rtt_s)
+            data = lf.s3.get_object(Bucket=bucket, Key=self.path[len("/s3/"):])["Body"].read()
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def _bench_once(port, mode, bucket):
+    body = json.dumps({"prompt": "a noir detective poster, rainy night", "aspect_ratio": "1:1"})
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("POST", f"/generate?mode={mode}", body=body, headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    ttfb = None
+    pixels = None
+
+    if mode == "json":
+        payload = resp.read()
+        ttfb = time.perf_counter() - t0  # whole JSON arrives at once
+        key = urlparse(json.loads(payload)["presigned_url"]).path.lstrip("/")
+        if key.startswith(f"{bucket}/"):  # path-style URL
+            key = key[len(bucket) + 1 :]
+        conn.request("GET", f"/s3/{key}")
+        img = conn.getresponse().read()
+        pixels = time.perf_counter() - t0
+    else:
+        img = None
+        while True:
+            line = resp.readline()
+            if not line:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - t0
+            ev = json.loads(line)
+            if ev["event"] == "image" and pixels is None:
+                img = base64.b64decode(ev["base64"])
+                pixels = time.perf_counter() - t0
+    conn.close()
+    assert img and img.startswith(b"\x89PNG")
+    return ttfb, pixels
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--serve", action="store_true")
+    ap.add_argument("--bench", action="store_true")
+    ap.add_argument("--port", type=int, default=8787)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--bedrock-latency", type=float, default=3.0)
+    ap.add_argument("--image-bytes", type=int, default=1_500_000)
+    ap.add_argument("--s3-rtt-ms", type=float, default=80.0)
+    args = ap.parse_args()
+
+    with local_aws() as env:
+        lf = load_lambda(DAILY_CREDITS=1_000_000, **env)
+        lf.bedrock = FakeBedrock(latency_s=args.bedrock_latency, image_bytes=args.image_bytes)
+        import stream_server  # on the path once the Lambda dir is
+
+        handler = make_handler(lf, stream_server, env["BUCKET_NAME"], args.s3_rtt_ms / 1000)
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+
+        if args.serve:
+            print(f"listening on http://127.0.0.1:{args.port}/generate?mode=stream|ndjson|json")
+            server.serve_forever()
+            return
+
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"bedrock {args.bedrock_latency}s, image {args.image_bytes} B, s3 rtt {args.s3_rtt_ms} ms, {args.runs} runs")
+        for mode in ("json", "ndjson", "stream"):
+            runs = [_bench_once(args.port, mode, env["BUCKET_NAME"]) for _ in range(args.runs)]
+            ttfb = statistics.median(r[0] for r in runs) * 1000
+            pixels = statistics.median(r[1] for r in runs) * 1000
+            print(f"{mode:6s}  TTFB p50 {ttfb:8.1f} ms   time-to-pixels p50 {pixels:8.1f} ms")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()